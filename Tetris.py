@@ -1,21 +1,29 @@
+import argparse
 import pygame
-import random
+import numpy as np
 import math
 import sys
 from datetime import datetime
-import json
 import os
+import functools
+from collections import OrderedDict, deque
 
-# Initialize configuration
-pygame.init()
-pygame.font.init()
+from tetris_engine import (TetrisEngine, GAME_WIDTH, GAME_HEIGHT, VISIBLE_HEIGHT, BUFFER_HEIGHT, ORIENTATIONS,
+                           EVENT_LOCK, EVENT_LINE_CLEAR, ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP,
+                           ACTION_HARD_DROP, FixedTimestep)
+from tetris_replay import Replay
+from tetris_snapshot import snapshot, restore
+from tetris_ai import Autoplayer
+from tetris_profiler import FrameProfiler
+from tetris_history import open_history, HistoryWriter, BACKEND_JSONL, BACKEND_SQLITE, WRITER_IDLE, WRITER_RETRYING
+
+# pygame subsystems are initialized on first use (TetrisApp, get_font), so
+# the module can be imported headless
 
 # Constants
 SCREEN_WIDTH = 900
 SCREEN_HEIGHT = 750
 BLOCK_SIZE = 35
-GAME_WIDTH = 12
-GAME_HEIGHT = 24
 INFO_WIDTH = 8
 FPS = 60  # Frames per second
 
@@ -37,23 +45,33 @@ COLORS = {
         (255, 165, 50),  # L
         (255, 255, 100), # J
         (200, 100, 255), # S
-        (50, 255, 255)   # Z
+        (50, 255, 255),  # Z
+        (128, 128, 128)  # Garbage (versus mode)
     ]
 }
 
-# Tetromino shapes
-SHAPES = [
-    [[1, 1, 1, 1]],  # I
-    [[2, 2], [2, 2]],  # O
-    [[3, 3, 3], [0, 3, 0]],  # T
-    [[4, 4, 4], [4, 0, 0]],  # L
-    [[5, 5, 5], [0, 0, 5]],  # J
-    [[6, 6, 0], [0, 6, 6]],  # S
-    [[0, 7, 7], [7, 7, 0]]  # Z
-]
-
 # Save file path
-SAVE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tetris_history.json")  # 绝对路径
+SAVE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tetris_history.json")  # 旧版记录文件，启动时导入新存储
+HISTORY_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tetris_history")  # 记录存储路径（扩展名由后端决定）
+REPLAY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tetris_last_replay.bin")  # 上一局回放
+SUSPEND_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tetris_suspend.bin")  # 退出时未结束的一局
+AI_ACTION_INTERVAL = 50  # 自动玩家每个动作的间隔（毫秒）
+ATTRACT_DELAY = 30000  # 主菜单闲置多久后自动进入演示模式（毫秒）
+IDLE_TIMEOUT = 250  # 空闲时最长阻塞等待输入的时间（毫秒）
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(family, size, bold=False):
+    """字体注册表：每种 (字体, 字号, 粗体) 只查找一次系统字体"""
+    if not pygame.font.get_init():
+        pygame.font.init()
+    return pygame.font.SysFont(family, size, bold=bold)
+
+
+@functools.lru_cache(maxsize=512)
+def render_text(font, text, color):
+    """渲染文字并缓存（LRU），同样的文字不会重复渲染；返回的 Surface 只能用于 blit"""
+    return font.render(text, True, color)
 
 
 
@@ -61,7 +79,7 @@ class Button:
     def __init__(self, x, y, width, height, text, font_size=36):
         self.rect = pygame.Rect(x, y, width, height)
         self.text = text
-        self.font = pygame.font.SysFont('Arial', font_size, bold=True)
+        self.font = get_font('Arial', font_size, bold=True)
         self.is_hovered = False
 
     def draw(self, screen):
@@ -69,7 +87,7 @@ class Button:
         pygame.draw.rect(screen, color, self.rect, border_radius=10)
         pygame.draw.rect(screen, COLORS['TEXT'], self.rect, 2, border_radius=10)
 
-        text_surface = self.font.render(self.text, True, COLORS['TEXT'])
+        text_surface = render_text(self.font, self.text, COLORS['TEXT'])
         text_rect = text_surface.get_rect(center=self.rect.center)
         screen.blit(text_surface, text_rect)
 
@@ -81,135 +99,21 @@ class Button:
         return self.rect.collidepoint(pos)
 
 
-class TetrisGame:
-    def __init__(self, screen):
-        self.VISIBLE_HEIGHT = 20  # 可视区域高度
-        self.BUFFER_HEIGHT = 4  # 上方缓冲区域
-        self.TOTAL_HEIGHT = self.VISIBLE_HEIGHT + self.BUFFER_HEIGHT
-
-        # 修改初始化
-        self.game_field = [[0] * GAME_WIDTH for _ in range(self.TOTAL_HEIGHT)]
-        self.screen = screen
-        self.reset_game()
-
-    def reset_game(self):
-        self.game_field = [[0] * GAME_WIDTH for _ in range(GAME_HEIGHT)]
-        self.current_piece = None
-        self.next_piece = random.choice(SHAPES)
-        self.score = 0
-        self.level = 1
-        self.lines = 0
-        self.start_time = datetime.now()
-        self.game_over = False
-        self.is_paused = False
-        self.ghost_alpha = 80
-        self.clear_effect = {'active': False, 'rows': [], 'frame': 0}
-        self.particles = []
-        self.create_new_piece()
-
-    def create_new_piece(self):
-        self.current_piece = {
-            'shape': self.next_piece,
-            'color': random.randint(1, 7),
-            'x': GAME_WIDTH // 2 - len(self.next_piece[0]) // 2,
-            'y': 0
-        }
-        self.next_piece = random.choice(SHAPES)
-        if self.check_collision(self.current_piece['shape'], (0, 0)):
-            self.game_over = True
-
-    def check_collision(self, shape, offset):
-        off_x, off_y = offset
-        for y, row in enumerate(shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    new_x = self.current_piece['x'] + x + off_x
-                    new_y = self.current_piece['y'] + y + off_y
-                    if new_x < 0 or new_x >= GAME_WIDTH or new_y >= GAME_HEIGHT:
-                        return True
-                    if new_y >= 0 and self.game_field[new_y][new_x]:
-                        return True
-        return False
-
-    def rotate_piece(self):
-        rotated = [list(row) for row in zip(*self.current_piece['shape'][::-1])]
-        if not self.check_collision(rotated, (0, 0)):
-            self.current_piece['shape'] = rotated
-
-    def merge_piece(self):
-        shape = self.current_piece['shape']
-        for y, row in enumerate(shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    pos_x = (self.current_piece['x'] + x) * BLOCK_SIZE + BLOCK_SIZE // 2
-                    pos_y = (self.current_piece['y'] + y) * BLOCK_SIZE + BLOCK_SIZE // 2
-                    self.add_particles((pos_x, pos_y))
-                    self.game_field[y + self.current_piece['y']][x + self.current_piece['x']] = self.current_piece['color']
-
-        lines_cleared = 0
-        new_field = []
-        for y in range(GAME_HEIGHT):
-            if 0 not in self.game_field[y]:
-                lines_cleared += 1
-            else:
-                new_field.append(self.game_field[y])
-        self.game_field = [[0] * GAME_WIDTH for _ in range(lines_cleared)] + new_field
-
-        if lines_cleared > 0:
-            score_multiplier = {1: 100, 2: 300, 3: 500, 4: 800}.get(lines_cleared, 1000)
-            self.score += score_multiplier * self.level
-            self.lines += lines_cleared
-            self.level = 1 + self.lines // 5
-
-            self.clear_effect['active'] = True
-            self.clear_effect['rows'] = list(range(len(new_field), len(new_field) + lines_cleared))
-            self.clear_effect['frame'] = 0
-
-        self.create_new_piece()
-
-    def add_particles(self, pos):
-        for _ in range(15):
-            self.particles.append({
-                'pos': [pos[0], pos[1]],
-                'velocity': [random.uniform(-3, 3), random.uniform(-6, -2)],
-                'timer': random.randint(10, 20),
-                'color': random.choice([(255, 255, 255), (255, 255, 200), (255, 200, 200)])
-            })
+class BlockSpriteCache:
+    """方块贴图缓存，按 (颜色索引, 透明度, 尺寸) 只渲染一次"""
 
-    def update_particles(self):
-        for p in self.particles[:]:
-            p['pos'][0] += p['velocity'][0]
-            p['pos'][1] += p['velocity'][1]
-            p['timer'] -= 1
-            if p['timer'] <= 0:
-                self.particles.remove(p)
+    def __init__(self):
+        self.sprites = {}
 
-    def draw_particles(self):
-        for p in self.particles:
-            alpha = int(255 * p['timer'] / 20)
-            size = int(3 * p['timer'] / 20) + 1
-            color = (*p['color'], alpha)
-            s = pygame.Surface((size * 2, size * 2), pygame.SRCALPHA)
-            pygame.draw.circle(s, color, (size, size), size)
-            self.screen.blit(s, (int(p['pos'][0] - size), int(p['pos'][1] - size)))
-
-    def get_fall_speed(self):
-        return max(50, 800 - (self.level * 50))
-
-    def draw_gradient_bg(self):
-        for y in range(SCREEN_HEIGHT):
-            color = (30 + y // 20, 30 + y // 20, 50 + y // 20)
-            pygame.draw.line(self.screen, color, (0, y), (SCREEN_WIDTH, y))
+    def get(self, color, alpha=255, size=BLOCK_SIZE - 1):
+        key = (color, alpha, size)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = self.sprites[key] = self.render(color, alpha, size)
+        return sprite
 
-    def draw_block(self, x, y, color, alpha=255, size=BLOCK_SIZE - 1):
-        # 调整绘制位置，只显示下方20行
-        draw_y = y - self.BUFFER_HEIGHT
-        if draw_y < 0:  # 不绘制缓冲区的方块
-            return
-        if x < 0 or x >= GAME_WIDTH or y < 0 or y >= GAME_HEIGHT:
-            return
+    def render(self, color, alpha, size):
         surface = pygame.Surface((size, size), pygame.SRCALPHA)
-        surface.set_alpha(alpha)
 
         # Main color
         pygame.draw.rect(surface, COLORS['TETROMINO'][color], (0, 0, size, size), 0, size // 5)
@@ -219,67 +123,287 @@ class TetrisGame:
         # Shadow
         pygame.draw.rect(surface, (0, 0, 0, 80), (0, size - 2, size, 2), 0, 1)
 
-        self.screen.blit(surface, (x * BLOCK_SIZE + 150, draw_y * BLOCK_SIZE + 50))
+        surface = surface.convert_alpha()
+        surface.set_alpha(alpha)
+        return surface
+
+    def clear(self):
+        # Call after changing COLORS['TETROMINO']
+        self.sprites.clear()
+
+
+class ParticleSystem:
+    """粒子池：定长结构数组 + 空闲槽复用，位置和计时器用 NumPy 批量更新"""
+
+    COLORS = [(255, 255, 255), (255, 255, 200), (255, 200, 200)]
+    MAX_TIMER = 20
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2), dtype=np.float64)
+        self.velocity = np.zeros((capacity, 2), dtype=np.float64)
+        self.timer = np.zeros(capacity, dtype=np.int32)  # 0 marks a free slot
+        self.color = np.zeros(capacity, dtype=np.int32)  # index into COLORS
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.rng = np.random.default_rng()
+        # Circle sprites keyed by (size, color index, alpha)
+        self.sprites = {}
+
+    def __len__(self):
+        return self.capacity - len(self.free_slots)
+
+    def clear(self):
+        self.timer[:] = 0
+        self.free_slots = list(range(self.capacity - 1, -1, -1))
+
+    def emit(self, pos, count):
+        # When the pool is full, extra particles are dropped
+        count = min(count, len(self.free_slots))
+        if count == 0:
+            return
+        slots = [self.free_slots.pop() for _ in range(count)]
+        self.pos[slots] = pos
+        self.velocity[slots, 0] = self.rng.uniform(-3, 3, count)
+        self.velocity[slots, 1] = self.rng.uniform(-6, -2, count)
+        self.timer[slots] = self.rng.integers(10, 21, count)
+        self.color[slots] = self.rng.integers(0, len(self.COLORS), count)
+
+    def active_slots(self):
+        return np.flatnonzero(self.timer > 0)
+
+    def update(self):
+        if len(self) == 0:
+            return
+        active = self.active_slots()
+        self.pos[active] += self.velocity[active]
+        self.timer[active] -= 1
+        expired = active[self.timer[active] <= 0]
+        self.free_slots.extend(expired.tolist())
+
+    def get_sprite(self, size, color, alpha):
+        key = (size, color, alpha)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = pygame.Surface((size * 2, size * 2), pygame.SRCALPHA)
+            pygame.draw.circle(sprite, (*self.COLORS[color], alpha), (size, size), size)
+            sprite = self.sprites[key] = sprite.convert_alpha()
+        return sprite
+
+    def draw(self, screen):
+        if len(self) == 0:
+            return
+        active = self.active_slots()
+        timer = self.timer[active]
+        alpha = 255 * timer // self.MAX_TIMER
+        size = 3 * timer // self.MAX_TIMER + 1
+        left = (self.pos[active, 0] - size).astype(np.int32)
+        top = (self.pos[active, 1] - size).astype(np.int32)
+        get_sprite = self.get_sprite
+        screen.blits([(get_sprite(s, c, a), (x, y)) for s, c, a, x, y in
+                      zip(size.tolist(), self.color[active].tolist(), alpha.tolist(),
+                          left.tolist(), top.tolist())], False)
+
+    def bounds(self):
+        """所有存活粒子的包围矩形（用于脏矩形刷新）"""
+        if len(self) == 0:
+            return None
+        pos = self.pos[self.active_slots()]
+        low = pos.min(axis=0)
+        high = pos.max(axis=0)
+        # Particle radius is at most 4 pixels
+        return pygame.Rect(int(low[0]) - 5, int(low[1]) - 5,
+                           int(high[0] - low[0]) + 11, int(high[1] - low[1]) + 11)
+
+
+class TetrisGame(TetrisEngine):
+    """Pygame renderer on top of the headless rules engine"""
+
+    def __init__(self, screen, **engine_options):
+        self.screen = screen
+        # Background gradient, border and grid never change between frames,
+        # so they are rendered once and blitted as one surface.
+        self.static_layer = None
+        self.static_layer_key = None
+        self.dim_overlay = None
+        self.block_sprites = BlockSpriteCache()
+        self.particles = ParticleSystem()
+        self.autoplayer = None  # set to an Autoplayer to let the AI play
+        super().__init__(**engine_options)
+        # Wide boards get smaller cells so the field keeps its on-screen
+        # width; boards taller than the window show a scrolling viewport of
+        # view_rows rows starting at view_top.
+        self.block_size = min(BLOCK_SIZE, BLOCK_SIZE * GAME_WIDTH // self.width)
+        self.view_rows = min(self.VISIBLE_HEIGHT, BLOCK_SIZE * VISIBLE_HEIGHT // self.block_size)
+        self.view_top = self.height - self.view_rows
+
+    def reset_game(self, seed=None):
+        super().reset_game(seed)
+        self.ghost_alpha = 80
+        self.reset_effects()
+
+    def reset_effects(self):
+        """清除特效和自动玩家计划（新游戏或恢复快照后）"""
+        # drawn: rows the flash covered in the last drawn frame
+        self.clear_effect = {'active': False, 'rows': [], 'frame': 0, 'drawn': ()}
+        self.particles.clear()
+        self.last_frame_state = None  # what the previous frame showed (dirty-rect mode)
+        self.ai_actions = deque()  # moves the autoplayer planned for ai_piece
+        self.ai_piece = None
+        self.ai_time = 0
+
+    def restore_snapshot(self, data):
+        """恢复 tetris_snapshot 保存的状态"""
+        restore(self, data)
+        self.reset_effects()
+
+    def toggle_autoplay(self):
+        self.autoplayer = None if self.autoplayer else Autoplayer()
+        self.ai_actions.clear()
+        self.ai_piece = None
+
+    def update_autoplay(self, elapsed):
+        """自动玩家每 AI_ACTION_INTERVAL 毫秒执行一个已规划的动作"""
+        if self.autoplayer is None or not self.can_act():
+            return
+        self.ai_time += elapsed
+        while self.ai_time >= AI_ACTION_INTERVAL and not self.game_over:
+            self.ai_time -= AI_ACTION_INTERVAL
+            if self.ai_piece is not self.current_piece:
+                # New piece (or gravity locked the old one): plan again
+                self.ai_piece = self.current_piece
+                self.ai_actions = deque(self.autoplayer.plan(self))
+            if self.ai_actions:
+                self.process_events(self.step(self.ai_actions.popleft()))
+
+    def process_events(self, events):
+        """根据引擎事件触发粒子和消行特效"""
+        for event in events:
+            if event['type'] == EVENT_LOCK:
+                for x, y in event['cells']:
+                    self.add_particles(self.cell_rect(x, y).center)
+            elif event['type'] == EVENT_LINE_CLEAR:
+                self.clear_effect['active'] = True
+                self.clear_effect['rows'] = list(event['rows'])
+                self.clear_effect['frame'] = 0
+
+    def add_particles(self, pos):
+        self.particles.emit(pos, 15)
+
+    def update_particles(self):
+        self.particles.update()
+
+    def draw_particles(self):
+        self.particles.draw(self.screen)
+
+    def draw_gradient_bg(self, surface):
+        width, height = surface.get_size()
+        for y in range(height):
+            color = (30 + y // 20, 30 + y // 20, 50 + y // 20)
+            pygame.draw.line(surface, color, (0, y), (width, y))
+
+    def build_static_layer(self):
+        """预渲染背景渐变、边框和网格（只覆盖视口）"""
+        layer = pygame.Surface(self.screen.get_size()).convert()
+        self.draw_gradient_bg(layer)
+        size = self.block_size
+
+        # Game area border
+        pygame.draw.rect(layer, (100, 100, 100),
+                         (150, 50, size * self.width, size * self.view_rows), 3)
+
+        # Grid lines
+        for y in range(self.view_rows):
+            for x in range(self.width):
+                pygame.draw.rect(layer, COLORS['GRID'],
+                                 (x * size + 150, y * size + 50,
+                                  size, size), 1)
+        return layer
+
+    def get_static_layer(self):
+        # Rebuild only when the window size or theme colors change
+        key = (self.screen.get_size(), COLORS['GRID'])
+        if key != self.static_layer_key:
+            self.static_layer = self.build_static_layer()
+            self.static_layer_key = key
+        return self.static_layer
+
+    def invalidate_static_layer(self):
+        self.static_layer_key = None
+
+    def draw_block(self, x, y, color, alpha=255, size=None):
+        # 调整绘制位置，只显示视口内的行（缓冲区始终在视口上方）
+        draw_y = y - self.view_top
+        if draw_y < 0 or draw_y >= self.view_rows:
+            return
+        if x < 0 or x >= self.width:
+            return
+        block_size = self.block_size
+        self.screen.blit(self.block_sprites.get(color, alpha, block_size - 1 if size is None else size),
+                         (x * block_size + 150, draw_y * block_size + 50))
+
+    def update_view(self):
+        """高棋盘的视口跟随堆叠表面，并保证落点可见"""
+        if self.view_rows >= self.VISIBLE_HEIGHT:
+            return  # the whole visible field fits on screen
+        # Surface of the stack a third of the way down the viewport, so the
+        # view stays still while a piece falls
+        top = self.height - self.max_height - self.view_rows // 3
+        landing_bottom = self.landing_y() + self.orientation().height
+        top = max(top, landing_bottom - self.view_rows)
+        self.view_top = max(self.BUFFER_HEIGHT, min(top, self.height - self.view_rows))
 
     def draw_ghost_piece(self):
         if self.game_over or self.is_paused:
             return
-        ghost_y = self.current_piece['y']
-        max_falls = GAME_HEIGHT - self.current_piece['y']
-        for _ in range(max_falls):
-            if self.check_collision(self.current_piece['shape'], (0, 1)):
-                break
-            ghost_y += 1
-        shape = self.current_piece['shape']
-        for y, row in enumerate(shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    self.draw_block(
-                        self.current_piece['x'] + x,
-                        ghost_y + y,
-                        self.current_piece['color'],
-                        self.ghost_alpha
-                    )
+        ghost_y = self.landing_y()
+        for x, y in self.orientation().cells:
+            self.draw_block(
+                self.current_piece['x'] + x,
+                ghost_y + y,
+                self.current_piece['color'],
+                self.ghost_alpha
+            )
 
     def draw_game_info(self):
-        font = pygame.font.SysFont('Arial', 28, bold=True)
-        small_font = pygame.font.SysFont('Arial', 24)
+        font = get_font('Arial', 28, bold=True)
+        small_font = get_font('Arial', 24)
 
         # Score
-        score_text = font.render(f'Score: {self.score}', True, COLORS['TEXT'])
+        score_text = render_text(font, f'Score: {self.score}', COLORS['TEXT'])
         self.screen.blit(score_text, (GAME_WIDTH * BLOCK_SIZE + 200, 100))
 
         # Level
-        level_text = font.render(f'Level: {self.level}', True, COLORS['TEXT'])
+        level_text = render_text(font, f'Level: {self.level}', COLORS['TEXT'])
         self.screen.blit(level_text, (GAME_WIDTH * BLOCK_SIZE + 200, 150))
 
         # Lines cleared
-        lines_text = font.render(f'Lines: {self.lines}', True, COLORS['TEXT'])
+        lines_text = render_text(font, f'Lines: {self.lines}', COLORS['TEXT'])
         self.screen.blit(lines_text, (GAME_WIDTH * BLOCK_SIZE + 200, 200))
 
         # Elapsed time
         if not self.game_over and not self.is_paused:
-            elapsed_time = (datetime.now() - self.start_time).total_seconds()
-            minutes, seconds = divmod(int(elapsed_time), 60)
-            time_text = font.render(f'Time: {minutes:02d}:{seconds:02d}', True, COLORS['TEXT'])
+            time_text = render_text(font, self.time_label(), COLORS['TEXT'])
             self.screen.blit(time_text, (GAME_WIDTH * BLOCK_SIZE + 200, 250))
 
+        # Autoplayer indicator
+        if self.autoplayer is not None:
+            ai_text = render_text(small_font, 'Autoplay', COLORS['TITLE'])
+            self.screen.blit(ai_text, (GAME_WIDTH * BLOCK_SIZE + 200, 300))
+
         # Next piece（修正位置和绘制逻辑）
         next_section_x = GAME_WIDTH * BLOCK_SIZE + 150  # 主区域右侧150像素
         next_section_y = 100  # 垂直起始位置
 
         # 绘制标题
-        next_text = font.render('Next:', True, COLORS['TEXT'])
+        next_text = render_text(font, 'Next:', COLORS['TEXT'])
         self.screen.blit(next_text, (next_section_x, next_section_y - 30))
 
         # 绘制下一个方块的每个单元格
-        for y, row in enumerate(self.next_piece):
-            for x, cell in enumerate(row):
-                if cell:
-                    # 计算在右侧区域的坐标（每个方块间隔35像素）
-                    x_pos = next_section_x + x * BLOCK_SIZE
-                    y_pos = next_section_y + y * BLOCK_SIZE
-                    self.draw_block(x, y, cell, 255, BLOCK_SIZE - 3)  # 直接使用cell作为颜色索引（与SHAPES定义一致）
+        for x, y in ORIENTATIONS[self.next_piece][0].cells:
+            # 计算在右侧区域的坐标（每个方块间隔35像素）
+            x_pos = next_section_x + x * BLOCK_SIZE
+            y_pos = next_section_y + y * BLOCK_SIZE
+            self.draw_block(x, y, self.next_piece + 1, 255, BLOCK_SIZE - 3)  # 颜色索引与SHAPES定义一致（形状编号+1）
 
         # Controls
         controls_y = 450
@@ -289,41 +413,102 @@ class TetrisGame:
             'Up Arrow: Rotate',
             'Space: Hard Drop',
             'P: Pause',
+            'A: Autoplay',
             'ESC: Menu'
         ]
 
         for i, text in enumerate(controls):
-            control_text = small_font.render(text, True, COLORS['TEXT'])
+            control_text = render_text(small_font, text, COLORS['TEXT'])
             self.screen.blit(control_text, (GAME_WIDTH * BLOCK_SIZE + 180, controls_y + i * 30))
 
-    def draw_game(self):
-        self.draw_gradient_bg()
+    def time_label(self):
+        elapsed_time = (datetime.now() - self.start_time).total_seconds()
+        minutes, seconds = divmod(int(elapsed_time), 60)
+        return f'Time: {minutes:02d}:{seconds:02d}'
+
+    def cell_rect(self, x, y, width=1, height=1):
+        """棋盘格子在屏幕上的矩形区域"""
+        size = self.block_size
+        return pygame.Rect(x * size + 150, (y - self.view_top) * size + 50,
+                           width * size, height * size)
+
+    def frame_state(self):
+        """记录本帧绘制内容，用于和上一帧比较"""
+        piece = self.current_piece
+        show_piece = not self.game_over and not self.is_paused
+        return {
+            'overlay': self.game_over or self.is_paused,
+            'piece': (piece['id'], piece['rotation'], piece['x'], piece['y'], piece['color'],
+                      self.landing_y()) if show_piece else None,
+            'field': self.field_version,
+            'view': self.view_top,
+            'info': (self.score, self.level, self.lines, self.next_piece,
+                     self.time_label() if show_piece else None, self.autoplayer is not None),
+            'clear_rows': self.clear_effect['drawn'],
+            'particles': self.particles.bounds(),
+        }
 
-        # Game area border
-        pygame.draw.rect(self.screen, (100, 100, 100),
-                         (150, 50, BLOCK_SIZE * GAME_WIDTH, BLOCK_SIZE * GAME_HEIGHT), 3)
+    def dirty_rects(self):
+        """返回与上一帧相比发生变化的区域；返回 None 表示需要整屏刷新"""
+        state = self.frame_state()
+        prev = self.last_frame_state
+        self.last_frame_state = state
+        if prev is None or state['overlay'] or prev['overlay']:
+            return None
+
+        rects = []
+        if state['field'] != prev['field'] or state['view'] != prev['view']:
+            # A lock (and possibly a line clear) changed the board, or it scrolled
+            rects.append(self.cell_rect(0, self.view_top, self.width, self.view_rows))
+        elif state['piece'] != prev['piece']:
+            for piece in (prev['piece'], state['piece']):
+                shape_id, rotation, x, y, _, ghost_y = piece
+                orientation = ORIENTATIONS[shape_id][rotation]
+                rects.append(self.cell_rect(x, y, orientation.width, orientation.height))
+                rects.append(self.cell_rect(x, ghost_y, orientation.width, orientation.height))
+
+        if state['info'] != prev['info']:
+            rects.append(pygame.Rect(GAME_WIDTH * BLOCK_SIZE + 150, 60,
+                                     SCREEN_WIDTH - GAME_WIDTH * BLOCK_SIZE - 150, 280))
+
+        for row in set(prev['clear_rows'] + state['clear_rows']):
+            rects.append(self.cell_rect(0, row, self.width))
+
+        for bounds in (prev['particles'], state['particles']):
+            if bounds is not None:
+                rects.append(bounds)
+
+        screen_rect = self.screen.get_rect()
+        return [rect.clip(screen_rect) for rect in rects if rect.colliderect(screen_rect)]
 
-        # Grid lines
-        for y in range(GAME_HEIGHT):
-            for x in range(GAME_WIDTH):
-                pygame.draw.rect(self.screen, COLORS['GRID'],
-                                 (x * BLOCK_SIZE + 150, y * BLOCK_SIZE + 50,
-                                  BLOCK_SIZE, BLOCK_SIZE), 1)
-
-        # Drawn blocks
-        for y in range(GAME_HEIGHT):
-            for x in range(GAME_WIDTH):
-                if self.game_field[y][x]:
-                    self.draw_block(x, y, self.game_field[y][x])
+    def draw_game(self):
+        # Background, border and grid
+        self.screen.blit(self.get_static_layer(), (0, 0))
+        self.update_view()
+
+        # Drawn blocks of the rows in the viewport (buffer rows are hidden),
+        # batched into one blits call
+        get_sprite = self.block_sprites.get
+        size = self.block_size
+        sprite_size = size - 1
+        batch = []
+        for row, y in enumerate(range(self.view_top, self.view_top + self.view_rows)):
+            if not self.row_fill[y]:
+                continue
+            draw_y = row * size + 50
+            for x, cell in enumerate(self.game_field[y]):
+                if cell:
+                    batch.append((get_sprite(cell, 255, sprite_size), (x * size + 150, draw_y)))
+        self.screen.blits(batch, False)
 
         # Clear effect
+        self.clear_effect['drawn'] = ()
         if self.clear_effect['active']:
+            self.clear_effect['drawn'] = tuple(self.clear_effect['rows'])
             alpha = abs(math.sin(self.clear_effect['frame'] * 0.5)) * 255
             for row in self.clear_effect['rows']:
-                if row < GAME_HEIGHT:
-                    pygame.draw.rect(self.screen, (255, 255, 255, alpha),
-                                    (150, row * BLOCK_SIZE + 50,
-                                     BLOCK_SIZE * GAME_WIDTH, BLOCK_SIZE))
+                if self.view_top <= row < self.view_top + self.view_rows:
+                    pygame.draw.rect(self.screen, (255, 255, 255, alpha), self.cell_rect(0, row, self.width))
             self.clear_effect['frame'] += 1
             if self.clear_effect['frame'] > 10:
                 self.clear_effect['active'] = False
@@ -331,13 +516,10 @@ class TetrisGame:
         # Current piece and ghost
         if not self.game_over and not self.is_paused:
             self.draw_ghost_piece()
-            shape = self.current_piece['shape']
             color = self.current_piece['color']
-            for y, row in enumerate(shape):
-                for x, cell in enumerate(row):
-                    if cell:
-                        self.draw_block(self.current_piece['x'] + x,
-                                        self.current_piece['y'] + y, color)
+            for x, y in self.orientation().cells:
+                self.draw_block(self.current_piece['x'] + x,
+                                self.current_piece['y'] + y, color)
 
         # Game info
         self.draw_game_info()
@@ -351,205 +533,206 @@ class TetrisGame:
         elif self.is_paused:
             self.draw_pause_overlay()
 
+    def get_dim_overlay(self):
+        """暂停和结束画面共用的半透明遮罩，只创建一次"""
+        if self.dim_overlay is None:
+            self.dim_overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+            self.dim_overlay.fill((0, 0, 0, 180))
+        return self.dim_overlay
+
     def draw_pause_overlay(self):
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 180))
-        self.screen.blit(overlay, (0, 0))
+        self.screen.blit(self.get_dim_overlay(), (0, 0))
 
-        text = pygame.font.SysFont('Arial', 72, bold=True).render('PAUSED', True, COLORS['PAUSED'])
+        text = render_text(get_font('Arial', 72, bold=True), 'PAUSED', COLORS['PAUSED'])
         text_rect = text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 30))
         self.screen.blit(text, text_rect)
 
-        prompt = pygame.font.SysFont('Arial', 36).render('Press P to Resume', True, COLORS['TEXT'])
+        prompt = render_text(get_font('Arial', 36), 'Press P to Resume', COLORS['TEXT'])
         prompt_rect = prompt.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 30))
         self.screen.blit(prompt, prompt_rect)
 
-        def draw_game_over(self):
-            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 180))
-            self.screen.blit(overlay, (0, 0))
-
-            text = pygame.font.SysFont('Arial', 72, bold=True).render('GAME OVER', True, COLORS['GAME_OVER'])
-            text_rect = text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50))
-            self.screen.blit(text, text_rect)
-
-            score_text = pygame.font.SysFont('Arial', 48).render(f'Final Score: {self.score}', True, COLORS['TEXT'])
-            score_rect = score_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 10))
-            self.screen.blit(score_text, score_rect)
-
-            prompt = pygame.font.SysFont('Arial', 36).render('Press any key to return to menu', True, COLORS['TEXT'])
-            prompt_rect = prompt.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 70))
-            self.screen.blit(prompt, prompt_rect)
-
-        def get_fall_speed(self):
-            return max(50, 800 - (self.level * 50))
-
-        def save_game_record(self):
-            end_time = datetime.now()
-            elapsed_time = (end_time - self.start_time).total_seconds()
-
-            record = {
-                'start_time': self.start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'end_time': end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'duration': f"{int(elapsed_time // 60):02d}:{int(elapsed_time % 60):02d}",
-                'level': self.level,
-                'score': self.score,
-                'lines': self.lines
-            }
-
-            try:
-                if os.path.exists(SAVE_FILE):
-                    with open(SAVE_FILE, 'r', encoding='utf-8') as f:
-                        history = json.load(f)
-                else:
-                    history = []
-
-                history.append(record)
-                # Keep only the last 100 records
-                if len(history) > 100:
-                    history = history[-100:]
-
-                with open(SAVE_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(history, f, ensure_ascii=False, indent=2)
-
-            except Exception as e:
-                print(f"Failed to save game record: {e}")
-
     def draw_game_over(self):
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 180))
-        self.screen.blit(overlay, (0, 0))
+        self.screen.blit(self.get_dim_overlay(), (0, 0))
 
-        text = pygame.font.SysFont('Arial', 72, bold=True).render('GAME OVER', True, COLORS['GAME_OVER'])
+        text = render_text(get_font('Arial', 72, bold=True), 'GAME OVER', COLORS['GAME_OVER'])
         text_rect = text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50))
         self.screen.blit(text, text_rect)
 
-        score_text = pygame.font.SysFont('Arial', 48).render(f'Final Score: {self.score}', True, COLORS['TEXT'])
+        score_text = render_text(get_font('Arial', 48), f'Final Score: {self.score}', COLORS['TEXT'])
         score_rect = score_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 10))
         self.screen.blit(score_text, score_rect)
 
-        prompt = pygame.font.SysFont('Arial', 36).render('Press any key to return to menu', True, COLORS['TEXT'])
+        prompt = render_text(get_font('Arial', 36), 'Press any key to return to menu', COLORS['TEXT'])
         prompt_rect = prompt.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 70))  # 位置上移
         self.screen.blit(prompt, prompt_rect)
 
-    def save_game_record(self):
+    def game_record(self):
         end_time = datetime.now()
         elapsed_time = (end_time - self.start_time).total_seconds()
 
-        record = {
+        return {
             'start_time': self.start_time.strftime('%Y-%m-%d %H:%M:%S'),
             'end_time': end_time.strftime('%Y-%m-%d %H:%M:%S'),
             'duration': f"{int(elapsed_time // 60):02d}:{int(elapsed_time % 60):02d}",
             'level': self.level,
             'score': self.score,
-            'lines': self.lines
+            'lines': self.lines,
+            'seed': self.seed
         }
 
+    def save_game_record(self, history):
         try:
-            os.makedirs(os.path.dirname(SAVE_FILE), exist_ok=True)
-
-            # 检查文件是否存在且非空
-            if os.path.exists(SAVE_FILE) and os.path.getsize(SAVE_FILE) > 0:
-                with open(SAVE_FILE, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-            else:
-                history = []
-
-            history.append(record)
-            history = history[-100:]  # 保留最近100条记录
-
-            with open(SAVE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
-
+            history.append(self.game_record())
         except Exception as e:
             print(f"保存记录失败: {e}")
 
+    def save_replay(self, path=REPLAY_FILE):
+        """保存本局回放（种子 + 输入流），可用 tetris_replay.py 无界面复现"""
+        if self.input_log is None:
+            return
+        try:
+            Replay.from_engine(self).save(path)
+        except Exception as e:
+            print(f"保存回放失败: {e}")
+
 
 class HistoryScreen:
-    def __init__(self, screen):
+    HEADERS = ["Start Time", "Duration", "Level", "Score", "Lines"]
+    HEADER_WIDTHS = [200, 100, 80, 100, 80]  # 各列宽度
+    VISIBLE_ROWS = 10
+    ROW_HEIGHT = 40
+    PAGE_SIZE = 50  # records fetched from the store at a time
+    MAX_PAGES = 20  # pages kept in memory
+
+    def __init__(self, screen, history_source):
         self.screen = screen
-        self.font = pygame.font.SysFont('Arial', 24)
-        self.title_font = pygame.font.SysFont('Arial', 48, bold=True)
+        # Returns the record store, or None while it is still being opened
+        # in the background
+        self.history_source = history_source
+        self.history = None
+        self.font = get_font('Arial', 24)
+        self.title_font = get_font('Arial', 48, bold=True)
         self.back_button = Button(50, 650, 200, 60, "Back", 28)
         self.clear_button = Button(650, 650, 200, 60, "Clear History", 28)  # 新增清空按钮
-        self.records = []
-        self.load_history()
+        # Nothing is read until the screen is first drawn
+        self.loaded = False
+        self.signature = None
+        self.total = 0
+        self.pages = OrderedDict()  # page index -> list of records, least recently used first
+        self.rows_surface = None
+        self.rows_key = None
         self.scroll_offset = 0
-        self.max_scroll = max(0, len(self.records) - 10)
+        self.max_scroll = 0
 
     def load_history(self):
+        """重新读取记录总数并清空缓存，记录本身滚动到时再分页读取"""
         try:
-            if os.path.exists(SAVE_FILE) and os.path.getsize(SAVE_FILE) > 0:
-                with open(SAVE_FILE, 'r', encoding='utf-8') as f:
-                    self.records = json.load(f)
-            else:
-                self.records = []
-
-            self.records.sort(key=lambda x: x['start_time'], reverse=True)  # 按时间倒序
-            self.max_scroll = max(0, len(self.records) - 10)
+            synced = self.history.sync()
+            # Not synced: a write is in progress, load again next frame
+            self.signature = self.history.signature() if synced else None
+            self.total = self.history.count()
         except Exception as e:
             print(f"加载记录失败: {e}")
-            self.records = []
-
-    def save_history(self):
-        """保存历史记录"""
-        try:
-            with open(SAVE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.records, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Failed to save history: {e}")
+            self.total = 0
+        self.loaded = True
+        self.pages.clear()
+        self.rows_key = None
+        self.max_scroll = max(0, self.total - self.VISIBLE_ROWS)
+        self.scroll_offset = min(self.scroll_offset, self.max_scroll)
+
+    def refresh(self):
+        """只有存储的大小或修改时间变化时才重新加载；存储还没打开好时返回 False"""
+        if self.history is None:
+            self.history = self.history_source()
+            if self.history is None:
+                return False
+        if not self.loaded or self.history.signature() != self.signature:
+            self.load_history()
+        return True
+
+    def get_page(self, index):
+        page = self.pages.get(index)
+        if page is None:
+            try:
+                page = self.history.page(index * self.PAGE_SIZE, self.PAGE_SIZE)
+            except Exception as e:
+                print(f"加载记录失败: {e}")
+                page = []
+            self.pages[index] = page
+            if len(self.pages) > self.MAX_PAGES:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(index)
+        return page
+
+    def visible_records(self):
+        """当前滚动位置可见的记录（按时间倒序）"""
+        start = self.scroll_offset
+        stop = min(start + self.VISIBLE_ROWS, self.total)
+        records = []
+        for index in range(start // self.PAGE_SIZE, (stop - 1) // self.PAGE_SIZE + 1):
+            base = index * self.PAGE_SIZE
+            records.extend(self.get_page(index)[max(0, start - base):stop - base])
+        return records
 
     def clear_history(self):
         """清空历史记录"""
+        if self.history is None:
+            return False
         try:
-            self.records = []
-            if os.path.exists(SAVE_FILE):
-                os.remove(SAVE_FILE)
+            self.history.clear()
+            self.scroll_offset = 0
+            self.load_history()
             return True
         except Exception as e:
             print(f"Failed to clear history: {e}")
             return False
 
+    def render_rows(self):
+        """把可见的记录渲染到一张表面上，滚动位置不变时直接复用"""
+        surface = pygame.Surface((SCREEN_WIDTH, self.VISIBLE_ROWS * self.ROW_HEIGHT), pygame.SRCALPHA)
+        for i, record in enumerate(self.visible_records()):
+            y = i * self.ROW_HEIGHT
+            values = [f"{record.get(field, '')}" for field in ('start_time', 'duration', 'level', 'score', 'lines')]
+
+            x_pos = 100
+            for j, value in enumerate(values):
+                text = render_text(self.font, value, COLORS['TEXT'])
+                surface.blit(text, (x_pos, y))
+                x_pos += self.HEADER_WIDTHS[j]
+        return surface
+
     def draw(self):
+        ready = self.refresh()
         self.screen.fill(COLORS['BACKGROUND'])
 
         # 绘制标题
-        title = self.title_font.render("Game History", True, COLORS['TITLE'])
+        title = render_text(self.title_font, "Game History", COLORS['TITLE'])
         title_rect = title.get_rect(center=(SCREEN_WIDTH // 2, 50))
         self.screen.blit(title, title_rect)
 
         # 绘制表头
-        headers = ["Start Time", "Duration", "Level", "Score", "Lines"]
-        header_widths = [200, 100, 80, 100, 80]  # 各列宽度
         x_pos = 100
-        for i, header in enumerate(headers):
-            header_text = self.font.render(header, True, COLORS['TITLE'])
+        for i, header in enumerate(self.HEADERS):
+            header_text = render_text(self.font, header, COLORS['TITLE'])
             self.screen.blit(header_text, (x_pos, 120))
-            x_pos += header_widths[i]
+            x_pos += self.HEADER_WIDTHS[i]
 
         # 绘制分隔线
         pygame.draw.line(self.screen, COLORS['TEXT'], (100, 150), (800, 150), 2)
 
         # 绘制记录
-        if not self.records:
-            no_record_text = self.font.render("No game history found", True, COLORS['TEXT'])
+        if not ready:
+            loading_text = render_text(self.font, "Loading history...", COLORS['TEXT'])
+            self.screen.blit(loading_text, (SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2))
+        elif not self.total:
+            no_record_text = render_text(self.font, "No game history found", COLORS['TEXT'])
             self.screen.blit(no_record_text, (SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2))
         else:
-            for i, record in enumerate(self.records[self.scroll_offset:self.scroll_offset + 10]):
-                y = 170 + i * 40
-                values = [
-                    record['start_time'],
-                    record['duration'],
-                    f"{record['level']}",
-                    f"{record['score']}",
-                    f"{record['lines']}"
-                ]
-
-                x_pos = 100
-                for j, value in enumerate(values):
-                    text = self.font.render(value, True, COLORS['TEXT'])
-                    self.screen.blit(text, (x_pos, y))
-                    x_pos += header_widths[j]
+            if self.rows_key != self.scroll_offset:
+                self.rows_surface = self.render_rows()
+                self.rows_key = self.scroll_offset
+            self.screen.blit(self.rows_surface, (0, 170))
 
         # 绘制滚动条
         if self.max_scroll > 0:
@@ -564,7 +747,7 @@ class HistoryScreen:
 
             # 滚动条滑块
             scroll_ratio = min(1.0, self.scroll_offset / self.max_scroll)
-            scroll_height = max(20, scrollbar_height * (10 / max(10, len(self.records))))
+            scroll_height = max(20, scrollbar_height * (10 / max(10, self.total)))
             scroll_pos = scroll_ratio * (scrollbar_height - scroll_height)
             pygame.draw.rect(self.screen, COLORS['BUTTON'],
                              (scrollbar_x, 150 + scroll_pos, scrollbar_width, scroll_height),
@@ -592,7 +775,7 @@ class HistoryScreen:
                 # 滚动条点击处理
                 if 820 <= mouse_pos[0] <= 830 and 150 <= mouse_pos[1] <= 450:
                     scrollbar_height = 300
-                    scroll_height = max(20, scrollbar_height * (10 / max(10, len(self.records))))
+                    scroll_height = max(20, scrollbar_height * (10 / max(10, self.total)))
                     available_height = scrollbar_height - scroll_height
                     scroll_ratio = (mouse_pos[1] - 150 - scroll_height / 2) / available_height
                     self.scroll_offset = int(scroll_ratio * self.max_scroll)
@@ -616,9 +799,9 @@ class HistoryScreen:
 class HelpScreen:
         def __init__(self, screen):
             self.screen = screen
-            self.title_font = pygame.font.SysFont('Arial', 48, bold=True)
-            self.header_font = pygame.font.SysFont('Arial', 32, bold=True)
-            self.text_font = pygame.font.SysFont('Arial', 24)
+            self.title_font = get_font('Arial', 48, bold=True)
+            self.header_font = get_font('Arial', 32, bold=True)
+            self.text_font = get_font('Arial', 24)
             self.back_button = Button(50, 650, 200, 60, "Back to Menu", 28)
 
             self.controls = [
@@ -627,6 +810,7 @@ class HelpScreen:
                 ("Up Arrow", "Rotate Block"),
                 ("Space Bar", "Hard Drop"),
                 ("P Key", "Pause/Resume Game"),
+                ("A Key", "Toggle Autoplayer"),
                 ("ESC Key", "Return to Main Menu")
             ]
 
@@ -642,28 +826,28 @@ class HelpScreen:
             self.screen.fill(COLORS['BACKGROUND'])
 
             # Draw title
-            title = self.title_font.render("Game Help", True, COLORS['TITLE'])
+            title = render_text(self.title_font, "Game Help", COLORS['TITLE'])
             title_rect = title.get_rect(center=(SCREEN_WIDTH // 2, 50))
             self.screen.blit(title, title_rect)
 
             # Draw controls section
-            controls_header = self.header_font.render("Controls", True, COLORS['TITLE'])
+            controls_header = render_text(self.header_font, "Controls", COLORS['TITLE'])
             self.screen.blit(controls_header, (100, 120))
 
             for i, (key, desc) in enumerate(self.controls):
-                key_text = self.text_font.render(key, True, COLORS['TEXT'])
-                desc_text = self.text_font.render(desc, True, COLORS['TEXT'])
+                key_text = render_text(self.text_font, key, COLORS['TEXT'])
+                desc_text = render_text(self.text_font, desc, COLORS['TEXT'])
 
-                y = 170 + i * 40
+                y = 170 + i * 36
                 self.screen.blit(key_text, (120, y))
                 self.screen.blit(desc_text, (300, y))
 
             # Draw scoring section
-            scoring_header = self.header_font.render("Scoring", True, COLORS['TITLE'])
+            scoring_header = render_text(self.header_font, "Scoring", COLORS['TITLE'])
             self.screen.blit(scoring_header, (100, 420))
 
             for i, rule in enumerate(self.scoring):
-                rule_text = self.text_font.render(rule, True, COLORS['TEXT'])
+                rule_text = render_text(self.text_font, rule, COLORS['TEXT'])
                 self.screen.blit(rule_text, (120, 470 + i * 35))
 
             # Draw back button
@@ -688,8 +872,8 @@ class HelpScreen:
 class MainMenu:
         def __init__(self, screen):
             self.screen = screen
-            self.title_font = pygame.font.SysFont('Arial', 72, bold=True)
-            self.button_font = pygame.font.SysFont('Arial', 36, bold=True)
+            self.title_font = get_font('Arial', 72, bold=True)
+            self.button_font = get_font('Arial', 36, bold=True)
 
             button_width = 300
             button_height = 70
@@ -707,15 +891,15 @@ class MainMenu:
         def draw(self):
             self.screen.fill(COLORS['BACKGROUND'])
 
-            title = self.title_font.render("Tetris Pro", True, COLORS['TITLE'])
+            title = render_text(self.title_font, "Tetris Pro", COLORS['TITLE'])
             title_rect = title.get_rect(center=(SCREEN_WIDTH // 2, 150))
             self.screen.blit(title, title_rect)
 
             for button in self.buttons:
                 button.draw(self.screen)
 
-            footer_font = pygame.font.SysFont('Arial', 20)
-            footer_text = footer_font.render('Press ESC to return to menu', True, COLORS['TEXT'])
+            footer_font = get_font('Arial', 20)
+            footer_text = render_text(footer_font, 'Press ESC to return to menu', COLORS['TEXT'])
             footer_rect = footer_text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT - 50))  # 调整至底部50像素处
             self.screen.blit(footer_text, footer_rect)
 
@@ -735,113 +919,442 @@ class MainMenu:
                     elif self.buttons[2].is_clicked(mouse_pos):
                         return "help"
                     elif self.buttons[3].is_clicked(mouse_pos):
-                        pygame.quit()
-                        sys.exit()
+                        return "quit"
 
             # 移除这里的ESC键处理
             return "main_menu"
 
+# Where the profiler overlay is drawn
+PROFILER_OVERLAY_RECT = pygame.Rect(5, 5, 330, 78)
+# Where "Saving..." is shown while game records are being written
+SAVE_STATUS_RECT = pygame.Rect(SCREEN_WIDTH - 285, SCREEN_HEIGHT - 30, 280, 26)
+
+# Keyboard bindings for the game screen
+KEY_ACTIONS = {
+    pygame.K_LEFT: ACTION_LEFT,
+    pygame.K_RIGHT: ACTION_RIGHT,
+    pygame.K_DOWN: ACTION_SOFT_DROP,
+    pygame.K_UP: ACTION_ROTATE,
+    pygame.K_SPACE: ACTION_HARD_DROP,
+}
+
+
+class ScreenRegistry:
+    """界面注册表：第一次使用时创建界面，离开临时界面时释放"""
+
+    def __init__(self, factories, transient=()):
+        self.factories = factories
+        self.transient = set(transient)
+        self.screens = {}
+
+    def get(self, name):
+        screen = self.screens.get(name)
+        if screen is None:
+            screen = self.screens[name] = self.factories[name]()
+        return screen
+
+    def release(self, name):
+        """释放临时界面，下次进入时重新创建"""
+        if name in self.transient:
+            self.screens.pop(name, None)
+
+    def close(self):
+        self.screens.clear()
+
+
 class TetrisApp:
-    def __init__(self):
+    def __init__(self, dirty_rects=False, profile=False, trace_path=None, history_backend=BACKEND_JSONL,
+                 demo=False, fps=60, board_width=GAME_WIDTH, board_height=GAME_HEIGHT, resume=False):
+        pygame.display.init()
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Tetris Pro")
         self.clock = pygame.time.Clock()
-        self.FPS = 60  # Frames per second
-
-        # Create screens
-        self.main_menu = MainMenu(self.screen)
-        self.game = TetrisGame(self.screen)
-        self.history_screen = HistoryScreen(self.screen)
-        self.help_screen = HelpScreen(self.screen)
+        self.FPS = fps  # Render rate; the simulation always runs at SIM_RATE
+
+        # Game record storage.  The writer thread opens it after the first
+        # frame (scanning a large store takes a while) and writes the records.
+        self.history_backend = history_backend
+        self.history_writer = None
+        self.save_status_shown = False
+
+        # Screens are built on first use; history and help are freed again
+        # when the player leaves them
+        self.screens = ScreenRegistry({
+            "main_menu": lambda: MainMenu(self.screen),
+            "game": lambda: TetrisGame(self.screen, record=True, width=board_width, height=board_height),
+            "history": lambda: HistoryScreen(self.screen, self.get_history),
+            "help": lambda: HelpScreen(self.screen),
+        }, transient=("history", "help"))
 
         # Current screen
         self.current_screen = "main_menu"
 
-        # Game state timer
-        self.fall_time = 0
+        # Fixed-timestep simulation clock (gravity, autoplayer)
+        self.sim_clock = FixedTimestep()
+        self.simulating = False
+
+        # Idle mode: what the last drawn frame showed while nothing animates
+        self.drawn_state = None
+
+        # Demo (attract) mode: the autoplayer plays until any key or click
+        self.demo_mode = False
+        self.idle_time = 0
+        if demo:
+            self.start_demo()
+        elif resume:
+            self.resume_game()
+
+        # Dirty-rect mode: only push changed regions of the game screen to
+        # the display; everything else still updates the full window.
+        self.dirty_rects = dirty_rects
+        self.last_drawn_screen = None
+
+        # Optional per-phase frame timing (F3 toggles the overlay, F10 runs
+        # cProfile for a few seconds).  None when disabled.
+        self.profiler = FrameProfiler() if profile or trace_path else None
+        self.trace_path = trace_path
+        self.show_profiler_overlay = profile
+        self.profiler_summary = None
+        self.profiler_background = None
+
+    @property
+    def main_menu(self):
+        return self.screens.get("main_menu")
+
+    @property
+    def game(self):
+        return self.screens.get("game")
+
+    @property
+    def history_screen(self):
+        return self.screens.get("history")
+
+    @property
+    def help_screen(self):
+        return self.screens.get("help")
+
+    def get_history(self):
+        """记录存储；写入线程还在打开（并导入旧版记录文件）时返回 None"""
+        writer = self.get_history_writer()
+        return writer.store if writer.ready.is_set() else None
+
+    def get_history_writer(self):
+        """第一次打开历史记录界面或保存记录时才启动写入线程；存储在该线程上打开，从不阻塞 UI"""
+        if self.history_writer is None:
+            backend = self.history_backend
+            self.history_writer = HistoryWriter(
+                opener=lambda: open_history(backend, HISTORY_BASE, legacy_path=SAVE_FILE))
+        return self.history_writer
+
+    def save_status(self):
+        """后台写入状态 (status, busy)；还没有保存过记录时为空闲"""
+        writer = self.history_writer
+        if writer is None:
+            return WRITER_IDLE, False
+        return writer.status, writer.busy
+
+    def switch_screen(self, name):
+        if name != self.current_screen:
+            self.screens.release(self.current_screen)
+            self.current_screen = name
+
+    def start_demo(self):
+        self.game.reset_game()
+        self.game.autoplayer = Autoplayer()
+        self.switch_screen("game")
+        self.demo_mode = True
+
+    def stop_demo(self):
+        self.demo_mode = False
+        self.game.autoplayer = None
+        self.game.reset_game()
+        self.switch_screen("main_menu")
+        self.idle_time = 0
+
+    def suspend_game(self, path=SUSPEND_FILE):
+        """退出时保存未结束的一局，下次用 --resume 继续"""
+        game = self.screens.screens.get("game")
+        if game is None or self.demo_mode or game.game_over or game.tick_count == 0:
+            return
+        game.is_paused = True
+        try:
+            with open(path, 'wb') as f:
+                f.write(snapshot(game))
+        except Exception as e:
+            print(f"保存进度失败: {e}")
+
+    def resume_game(self, path=SUSPEND_FILE):
+        """载入上次退出时保存的一局（暂停状态），载入后删除文件"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        try:
+            self.game.restore_snapshot(data)
+            os.remove(path)
+        except Exception as e:
+            print(f"载入进度失败: {e}")
+            self.game.reset_game()
+            return
+        self.switch_screen("game")
+
+    def quit(self):
+        self.suspend_game()
+        if self.profiler and self.trace_path:
+            try:
+                self.profiler.export(self.trace_path)
+            except Exception as e:
+                print(f"Failed to export frame trace: {e}")
+        if self.profiler:
+            self.profiler.stop_capture()
+        writer = self.history_writer
+        if writer is not None:
+            if not writer.close():
+                print("History writer did not finish in time")
+            elif writer.store is not None:
+                writer.store.close()
+        self.screens.close()
+        pygame.quit()
+        sys.exit()
 
     def run(self):
         while True:
+            self.run_frame()
+
+    def run_frame(self):
+        """处理输入、推进模拟并绘制一帧"""
+        profiler = self.profiler
+        if profiler:
+            profiler.begin_frame()
+        if self.is_idle():
+            # Nothing is moving: sleep until input arrives (or the
+            # timeout, for the attract-mode timer and status changes)
+            events = self.wait_events()
+        else:
             self.clock.tick(self.FPS)
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-
-                # Global ESC key to return to main menu
-                if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                    if self.current_screen != "main_menu":  # 只要不在主菜单，按ESC都返回主菜单
-                        self.current_screen = "main_menu"
-                        continue  # 跳过后续处理
-
-                # Handle events based on current screen
-                if self.current_screen == "main_menu":
-                    self.current_screen = self.main_menu.handle_event(event)
-
-                elif self.current_screen == "game":
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_p:
-                            self.game.is_paused = not self.game.is_paused
-                        elif not self.game.is_paused and not self.game.game_over:
-                            if event.key == pygame.K_LEFT:
-                                if not self.game.check_collision(self.game.current_piece['shape'], (-1, 0)):
-                                    self.game.current_piece['x'] -= 1
-                            elif event.key == pygame.K_RIGHT:
-                                if not self.game.check_collision(self.game.current_piece['shape'], (1, 0)):
-                                    self.game.current_piece['x'] += 1
-                            elif event.key == pygame.K_DOWN:
-                                if not self.game.check_collision(self.game.current_piece['shape'], (0, 1)):
-                                    self.game.current_piece['y'] += 1
-                            elif event.key == pygame.K_UP:
-                                self.game.rotate_piece()
-                            elif event.key == pygame.K_SPACE:
-                                while not self.game.check_collision(self.game.current_piece['shape'], (0, 1)):
-                                    self.game.current_piece['y'] += 1
-                                    self.game.score += 1
-                                self.game.merge_piece()
-                    elif event.type == pygame.MOUSEBUTTONDOWN:
-                        if self.game.game_over:
-                            self.game.save_game_record()
-                            self.game.reset_game()
-                            self.current_screen = "main_menu"
-
-                elif self.current_screen == "history":
-                    self.current_screen = self.history_screen.handle_event(event)
-                    if self.current_screen == "history":
-                        self.history_screen.load_history()
-
-                elif self.current_screen == "help":
-                    self.current_screen = self.help_screen.handle_event(event)
-
-            # Update game state (only in game screen and not paused)
-            if self.current_screen == "game" and not self.game.is_paused and not self.game.game_over:
-                self.fall_time += self.clock.get_rawtime()
-                fall_speed = self.game.get_fall_speed()
-
-                if self.fall_time >= fall_speed:
-                    if not self.game.check_collision(self.game.current_piece['shape'], (0, 1)):
-                        self.game.current_piece['y'] += 1
-                    else:
-                        self.game.merge_piece()
-                    self.fall_time = 0
-
-            # Update particles
-            if self.current_screen == "game":
-                self.game.update_particles()
-
-            # Draw current screen
+            events = pygame.event.get()
+        if profiler:
+            profiler.mark('wait')
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                self.quit()
+
+            if profiler and event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F3:
+                    self.show_profiler_overlay = not self.show_profiler_overlay
+                elif event.key == pygame.K_F10:
+                    profiler.start_capture(5.0)
+
+            if event.type in (pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.MOUSEMOTION):
+                self.idle_time = 0
+                if self.demo_mode and event.type != pygame.MOUSEMOTION:
+                    self.stop_demo()
+                    continue
+
+            # Global ESC key to return to main menu
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                if self.current_screen != "main_menu":  # 只要不在主菜单，按ESC都返回主菜单
+                    self.switch_screen("main_menu")
+                    continue  # 跳过后续处理
+
+            # Handle events based on current screen
             if self.current_screen == "main_menu":
-                self.main_menu.draw()
+                self.switch_screen(self.main_menu.handle_event(event))
+                if self.current_screen == "quit":
+                    self.quit()
+
             elif self.current_screen == "game":
-                self.game.draw_game()
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_p:
+                        self.game.is_paused = not self.game.is_paused
+                    elif event.key == pygame.K_a:
+                        self.game.toggle_autoplay()
+                    elif not self.game.is_paused and not self.game.game_over:
+                        action = KEY_ACTIONS.get(event.key)
+                        if action is not None:
+                            self.game.process_events(self.game.step(action))
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    if self.game.game_over:
+                        self.game.save_game_record(self.get_history_writer())
+                        self.game.save_replay()
+                        self.game.reset_game()
+                        self.switch_screen("main_menu")
+
             elif self.current_screen == "history":
-                self.history_screen.draw()
-            elif self.current_screen == "help":
-                self.help_screen.draw()
+                self.switch_screen(self.history_screen.handle_event(event))
 
+            elif self.current_screen == "help":
+                self.switch_screen(self.help_screen.handle_event(event))
+        if profiler:
+            profiler.mark('events')
+
+        # Update game state (only in game screen and not paused).  The
+        # simulation runs in fixed steps, however long the frame took.
+        if self.current_screen == "game" and not self.game.is_paused and not self.game.game_over:
+            # Time spent paused or in a menu does not count
+            elapsed = self.clock.get_time() if self.simulating else 0
+            self.simulating = True
+            for _ in range(self.sim_clock.advance(elapsed)):
+                self.game.process_events(self.game.simulate_tick())
+                self.game.update_autoplay(self.sim_clock.step_ms)
+        else:
+            self.simulating = False
+            self.sim_clock.reset()
+        if self.demo_mode and self.game.game_over:
+            self.game.reset_game()  # demo games are not recorded
+        if self.current_screen == "main_menu":
+            self.idle_time += self.clock.get_time()
+            if self.idle_time >= ATTRACT_DELAY:
+                self.start_demo()
+        if profiler:
+            profiler.mark('update')
+
+        # Update particles
+        if self.current_screen == "game":
+            self.game.update_particles()
+        if profiler:
+            profiler.mark('particles')
+
+        # In idle mode only redraw when something changed
+        state = self.idle_state()
+        if not events and state is not None and state == self.drawn_state:
+            if profiler:
+                profiler.end_frame()
+            return
+        self.drawn_state = state
+
+        # Draw current screen
+        if self.current_screen == "main_menu":
+            self.main_menu.draw()
+        elif self.current_screen == "game":
+            self.game.draw_game()
+        elif self.current_screen == "history":
+            self.history_screen.draw()
+        elif self.current_screen == "help":
+            self.help_screen.draw()
+        if profiler and self.show_profiler_overlay:
+            self.draw_profiler_overlay()
+        self.draw_save_status()
+        if profiler:
+            profiler.mark('draw')
+
+        self.present()
+        if profiler:
+            profiler.mark('present')
+            profiler.end_frame()
+
+    def idle_state(self):
+        """没有动画时返回决定画面内容的状态（变化时才重绘）；有动画时返回 None"""
+        screen = self.current_screen
+        if screen == "game":
+            game = self.game
+            if self.demo_mode or not (game.is_paused or game.game_over):
+                return None
+            if game.clear_effect['active'] or len(game.particles):
+                return None  # effects still fading out
+        state = (screen,) + self.save_status() + (self.show_profiler_overlay,)
+        if screen == "history":
+            # Also changes once the store has been opened in the background
+            history = self.get_history()
+            state += (history.signature() if history is not None else None,)
+        return state
+
+    def is_idle(self):
+        state = self.idle_state()
+        return state is not None and state == self.drawn_state
+
+    def wait_events(self):
+        """阻塞等待输入，最多 IDLE_TIMEOUT 毫秒；返回期间到达的所有事件"""
+        event = pygame.event.wait(IDLE_TIMEOUT)
+        events = [] if event.type == pygame.NOEVENT else [event]
+        events.extend(pygame.event.get())
+        # Keeps get_time() meaningful and caps the redraw rate during bursts
+        # of input such as mouse motion
+        self.clock.tick(self.FPS)
+        return events
+
+    def draw_profiler_overlay(self):
+        """左上角显示 FPS、帧耗时百分位和最慢阶段"""
+        # Re-summarize twice a second; the text only needs to be readable
+        if self.profiler_summary is None or self.profiler.frame_count % max(1, self.FPS // 2) == 0:
+            self.profiler_summary = self.profiler.summary()
+        summary = self.profiler_summary
+        if summary is None:
+            return
+        worst = summary['worst_phase']
+        lines = [
+            f"FPS {summary['fps']:.1f}",
+            f"frame p50 {summary['p50_ms']:.1f}  p95 {summary['p95_ms']:.1f}  p99 {summary['p99_ms']:.1f} ms",
+            f"worst: {worst} {summary['phase_ms'][worst]:.2f} ms",
+        ]
+        if self.profiler.capturing:
+            lines.append("cProfile capturing...")
+        font = get_font('Arial', 16)
+        if self.profiler_background is None:
+            self.profiler_background = pygame.Surface(PROFILER_OVERLAY_RECT.size, pygame.SRCALPHA)
+            self.profiler_background.fill((0, 0, 0, 160))
+        self.screen.blit(self.profiler_background, PROFILER_OVERLAY_RECT.topleft)
+        for i, line in enumerate(lines):
+            self.screen.blit(render_text(font, line, COLORS['TEXT']),
+                             (PROFILER_OVERLAY_RECT.x + 6, PROFILER_OVERLAY_RECT.y + 4 + i * 18))
+
+    def draw_save_status(self):
+        """后台仍在写记录时在右下角提示"""
+        status, busy = self.save_status()
+        if status == WRITER_RETRYING:
+            text, color = "Saving failed, retrying...", (255, 120, 120)
+        elif busy:
+            text, color = "Saving...", COLORS['TEXT']
+        else:
+            return
+        label = render_text(get_font('Arial', 18), text, color)
+        self.screen.blit(label, label.get_rect(bottomright=(SAVE_STATUS_RECT.right - 4, SAVE_STATUS_RECT.bottom - 4)))
+
+    def present(self):
+        rects = None
+        if self.dirty_rects and self.current_screen == "game":
+            rects = self.game.dirty_rects()
+            if self.last_drawn_screen != "game":
+                rects = None  # screen switch
+        self.last_drawn_screen = self.current_screen
+
+        if rects is not None and self.profiler and self.show_profiler_overlay:
+            rects.append(PROFILER_OVERLAY_RECT)
+        # Also update the status area for one frame after it disappears
+        save_status_shown = self.save_status()[1]
+        if rects is not None and (save_status_shown or self.save_status_shown):
+            rects.append(SAVE_STATUS_RECT)
+        self.save_status_shown = save_status_shown
+
+        if rects is None:
             pygame.display.update()
+        elif rects:
+            pygame.display.update(rects)
 
 if __name__ == "__main__":
-    app = TetrisApp()
+    parser = argparse.ArgumentParser(description="Tetris Pro")
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help="only push changed regions of the game screen to the display")
+    parser.add_argument('--profile', action='store_true',
+                        help="show frame-time overlay (F3 toggles, F10 captures cProfile)")
+    parser.add_argument('--trace', metavar='PATH',
+                        help="write per-phase frame timings to PATH (.csv or .json) on exit")
+    parser.add_argument('--history', choices=[BACKEND_JSONL, BACKEND_SQLITE], default=BACKEND_JSONL,
+                        help="game record storage backend (default: jsonl)")
+    parser.add_argument('--demo', action='store_true',
+                        help="start in demo mode with the autoplayer playing")
+    parser.add_argument('--fps', type=int, default=60,
+                        help="render rate (game speed does not depend on it, default: 60)")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the game that was in progress when the program last quit")
+    parser.add_argument('--width', type=int, default=GAME_WIDTH,
+                        help=f"board width in cells (default: {GAME_WIDTH})")
+    parser.add_argument('--height', type=int, default=GAME_HEIGHT,
+                        help=f"board height in cells, including the {BUFFER_HEIGHT} hidden rows (default: {GAME_HEIGHT})")
+    args = parser.parse_args()
+    app = TetrisApp(dirty_rects=args.dirty_rects, profile=args.profile, trace_path=args.trace,
+                    history_backend=args.history, demo=args.demo, fps=args.fps,
+                    board_width=args.width, board_height=args.height, resume=args.resume)
     app.run()
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""规则引擎：与逐格实现的参考规则比较，并核对列表模式和位板模式完全一致"""
+import random
+
+import pytest
+
+from tetris_engine import (TetrisEngine, ORIENTATIONS, LINE_SCORES, EVENT_LOCK, EVENT_LINE_CLEAR, EVENT_GAME_OVER,
+                           ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP,
+                           ACTION_GRAVITY, RANDOMIZER_RANDOM, RANDOMIZER_BAG)
+
+ACTIONS = [ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP, ACTION_GRAVITY]
+BOARD_SIZES = [(12, 24), (17, 33), (4, 8)]
+
+
+class Reference:
+    """逐格实现的规则，只用来核对引擎"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.field = [[0] * width for _ in range(height)]
+
+    def collides(self, cells, x, y):
+        for dx, dy in cells:
+            cx = x + dx
+            cy = y + dy
+            if cx < 0 or cx >= self.width or cy >= self.height:
+                return True
+            if cy >= 0 and self.field[cy][cx]:
+                return True
+        return False
+
+    def landing_y(self, cells, x, y):
+        while not self.collides(cells, x, y + 1):
+            y += 1
+        return y
+
+    def lock(self, cells, x, y, color):
+        """写入方块并消除满行，返回消除的行数"""
+        for dx, dy in cells:
+            self.field[y + dy][x + dx] = color
+        kept = [row for row in self.field if not all(row)]
+        cleared = self.height - len(kept)
+        self.field = [[0] * self.width for _ in range(cleared)] + kept
+        return cleared
+
+    def features(self):
+        heights = []
+        holes = 0
+        for col in range(self.width):
+            column = [self.field[y][col] for y in range(self.height)]
+            top = next((y for y, cell in enumerate(column) if cell), self.height)
+            heights.append(self.height - top)
+            holes += sum(1 for cell in column[top:] if not cell)
+        return {
+            'column_heights': heights,
+            'holes': holes,
+            'bumpiness': sum(abs(heights[i] - heights[i + 1]) for i in range(self.width - 1)),
+            'max_height': max(heights),
+            'aggregate_height': sum(heights),
+            'row_fill': [sum(1 for cell in row if cell) for row in self.field],
+        }
+
+
+def prefill(engine, reference, rng):
+    """底部填入几行各留一个空格的行，随机操作也能消行"""
+    width, height = engine.width, engine.height
+    rows = [[0] * width for _ in range(height)]
+    for y in range(height - rng.randint(0, height // 2), height):
+        hole = rng.randrange(width)
+        rows[y] = [0 if x == hole else 8 for x in range(width)]
+    engine.load_field(rows)
+    reference.field = [list(row) for row in rows]
+
+
+def field_rows(engine):
+    return [list(row) for row in engine.game_field]
+
+
+def expected_piece(reference, piece, action):
+    """非固定动作之后方块应有的位置"""
+    piece = dict(piece)
+    orientations = ORIENTATIONS[piece['id']]
+    cells = orientations[piece['rotation']].cells
+    if action in (ACTION_LEFT, ACTION_RIGHT):
+        dx = -1 if action == ACTION_LEFT else 1
+        if not reference.collides(cells, piece['x'] + dx, piece['y']):
+            piece['x'] += dx
+    elif action == ACTION_ROTATE:
+        rotation = (piece['rotation'] + 1) % len(orientations)
+        if not reference.collides(orientations[rotation].cells, piece['x'], piece['y']):
+            piece['rotation'] = rotation
+    elif action in (ACTION_SOFT_DROP, ACTION_GRAVITY):
+        if not reference.collides(cells, piece['x'], piece['y'] + 1):
+            piece['y'] += 1
+    return piece
+
+
+@pytest.mark.parametrize('bitboard', [False, True])
+@pytest.mark.parametrize('width,height', BOARD_SIZES)
+def test_engine_matches_reference(bitboard, width, height):
+    rng = random.Random(width * height)
+    engine = TetrisEngine(bitboard=bitboard, seed=1, width=width, height=height)
+    reference = Reference(width, height)
+    prefill(engine, reference, rng)
+    games = clears = 0
+    for _ in range(6000):
+        piece = dict(engine.current_piece)
+        cells = ORIENTATIONS[piece['id']][piece['rotation']].cells
+        score = engine.score
+        level = engine.level
+        action = rng.choice(ACTIONS)
+        events = engine.step(action)
+        locks = [event for event in events if event['type'] == EVENT_LOCK]
+        if locks:
+            y = piece['y']
+            if action == ACTION_HARD_DROP:
+                y = reference.landing_y(cells, piece['x'], piece['y'])
+                score += y - piece['y']
+            assert locks[0]['cells'] == [(piece['x'] + dx, y + dy) for dx, dy in cells]
+            cleared = reference.lock(cells, piece['x'], y, piece['color'])
+            if cleared:
+                clears += 1
+                score += LINE_SCORES[cleared] * level
+                assert any(event['type'] == EVENT_LINE_CLEAR and event['count'] == cleared for event in events)
+        else:
+            assert engine.current_piece == expected_piece(reference, piece, action)
+        assert engine.score == score
+        assert field_rows(engine) == reference.field
+        expected = reference.features()
+        features = engine.features()
+        for name, value in expected.items():
+            assert features[name] == value, name
+        assert bytes(engine.cells) == b''.join(bytes(row) for row in reference.field)
+        if engine.game_over:
+            assert any(event['type'] == EVENT_GAME_OVER for event in events)
+            games += 1
+            engine.reset_game(rng.randrange(2 ** 32))
+            reference = Reference(width, height)
+            prefill(engine, reference, rng)
+    assert games and clears
+
+
+def engine_state(engine):
+    return {
+        'field': field_rows(engine),
+        'cells': bytes(engine.cells),
+        'piece': dict(engine.current_piece),
+        'queue': list(engine.next_queue),
+        'score': engine.score,
+        'level': engine.level,
+        'lines': engine.lines,
+        'game_over': engine.game_over,
+        'features': engine.features(),
+        'field_version': engine.field_version,
+        'landing_y': engine.landing_y(),
+    }
+
+
+@pytest.mark.parametrize('randomizer', [RANDOMIZER_RANDOM, RANDOMIZER_BAG])
+@pytest.mark.parametrize('width,height', BOARD_SIZES)
+def test_list_and_bitboard_modes_agree(randomizer, width, height):
+    rng = random.Random(7)
+    engines = [TetrisEngine(bitboard=bitboard, seed=3, randomizer=randomizer, preview=3, width=width, height=height)
+               for bitboard in (False, True)]
+    for step in range(6000):
+        action = rng.choice(ACTIONS)
+        if rng.random() < 0.02:
+            count, hole = rng.randint(1, 4), rng.randrange(width)
+            for engine in engines:
+                engine.queue_garbage(count, hole)
+        events = [engine.step(action) for engine in engines]
+        assert events[0] == events[1], step
+        assert engine_state(engines[0]) == engine_state(engines[1]), step
+        bitboard = engines[1]
+        assert bitboard.board == [sum(1 << x for x, cell in enumerate(row) if cell) for row in field_rows(bitboard)]
+        if engines[0].game_over:
+            seed = rng.randrange(2 ** 32)
+            for engine in engines:
+                engine.reset_game(seed)
+
+
+def test_same_seed_same_game():
+    games = []
+    for _ in range(2):
+        engine = TetrisEngine(seed=42)
+        for _ in range(500):
+            engine.step(ACTION_HARD_DROP)
+            if engine.game_over:
+                break
+        games.append((engine.score, engine.lines, field_rows(engine)))
+    assert games[0] == games[1]
+
+
+def test_board_size_is_validated():
+    with pytest.raises(ValueError):
+        TetrisEngine(width=3)
+    with pytest.raises(ValueError):
+        TetrisEngine(height=4)
@@ -0,0 +1,178 @@
+"""记录存储：两种后端的追加、分页、清空，日志压缩，旧版文件导入和后台写入"""
+import json
+import os
+
+import pytest
+
+from tetris_history import (open_history, migrate_legacy, JsonLinesHistory, HistoryWriter, UNREADABLE_RECORD,
+                            BACKEND_JSONL, BACKEND_SQLITE)
+
+BACKENDS = [BACKEND_JSONL, BACKEND_SQLITE]
+
+
+def record(i):
+    return {'start_time': f'2024-01-01 00:{i // 60:02d}:{i % 60:02d}', 'end_time': '2024-01-01 01:00:00',
+            'duration': '0:01:00', 'level': 1 + i // 5, 'score': i * 10, 'lines': i, 'seed': i}
+
+
+@pytest.fixture(params=BACKENDS)
+def store(request, tmp_path):
+    store = open_history(request.param, str(tmp_path / 'history'))
+    yield store
+    store.close()
+
+
+def scores(records):
+    return [r['score'] for r in records]
+
+
+def test_append_and_page_newest_first(store):
+    store.append(record(0))
+    store.extend([record(i) for i in range(1, 25)])
+    assert store.count() == 25
+    assert scores(store.page(0, 10)) == [i * 10 for i in range(24, 14, -1)]
+    assert scores(store.page(10, 10)) == [i * 10 for i in range(14, 4, -1)]
+    assert scores(store.page(20, 10)) == [40, 30, 20, 10, 0]
+    assert store.page(25, 10) == []
+    assert store.load() == [record(i) for i in range(25)]
+
+
+def test_pages_follow_appends(store):
+    store.extend([record(i) for i in range(5)])
+    signature = store.signature()
+    store.append(record(5))
+    assert store.signature() != signature
+    assert store.sync()
+    assert store.count() == 6
+    assert scores(store.page(0, 2)) == [50, 40]
+
+
+def test_clear(store):
+    store.extend([record(i) for i in range(5)])
+    store.clear()
+    assert store.count() == 0
+    assert store.page(0, 10) == []
+    store.append(record(7))
+    assert scores(store.page(0, 10)) == [70]
+
+
+def test_reopen_keeps_records(tmp_path):
+    for backend in BACKENDS:
+        base = str(tmp_path / backend)
+        store = open_history(backend, base)
+        store.extend([record(i) for i in range(3)])
+        store.close()
+        store = open_history(backend, base)
+        assert store.load() == [record(i) for i in range(3)]
+        store.close()
+
+
+def append_raw(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+
+
+def test_jsonl_skips_torn_lines_and_compacts_on_open(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    store = JsonLinesHistory(path)
+    store.extend([record(i) for i in range(3)])
+    append_raw(path, b'{"start_time": "torn')  # crash mid-write
+    store = JsonLinesHistory(path, compact_garbage=2)
+    assert (store.count(), store.garbage) == (3, 1)
+    store.append(record(3))  # starts on a fresh line
+    assert store.load() == [record(i) for i in range(4)]
+    store = JsonLinesHistory(path)  # compact_garbage=1: compacts the torn line away
+    assert store.garbage == 0
+    with open(path, 'rb') as f:
+        assert f.read().count(b'\n') == 4
+
+
+def test_jsonl_keeps_unparseable_records_in_pages(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    store = JsonLinesHistory(path)
+    store.extend([record(i) for i in range(3)])
+    append_raw(path, b'{not json}\n')
+    store.append(record(3))
+    store.sync()
+    page = store.page(0, 10)
+    assert len(page) == store.count() == 5
+    assert page[1] == UNREADABLE_RECORD
+
+
+def test_jsonl_compacts_when_garbage_outgrows_records(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    store = JsonLinesHistory(path, compact_ratio=0.1)
+    store.extend([record(i) for i in range(20)])
+    append_raw(path, b'garbage\n')
+    store.sync()
+    assert store.garbage == 1
+    assert not store.maybe_compact()  # below 10% of the records
+    append_raw(path, b'garbage\n' * 2)
+    store.sync()
+    assert store.maybe_compact()
+    assert (store.count(), store.garbage) == (20, 0)
+    assert store.load() == [record(i) for i in range(20)]
+
+
+def test_writer_compacts_in_the_background(tmp_path):
+    path = str(tmp_path / 'history.jsonl')
+    store = JsonLinesHistory(path)
+    store.extend([record(i) for i in range(10)])
+    writer = HistoryWriter(store)
+    append_raw(path, b'garbage\n' * 5)
+    store.sync()
+    writer.append(record(10))
+    assert writer.close()
+    assert (store.count(), store.garbage) == (11, 0)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_writer_opens_the_store_on_its_thread(tmp_path, backend):
+    base = str(tmp_path / 'history')
+    writer = HistoryWriter(opener=lambda: open_history(backend, base))
+    for i in range(5):
+        writer.append(record(i))
+    assert writer.close()
+    assert writer.ready.is_set()
+    assert writer.store.load() == [record(i) for i in range(5)]
+    writer.store.close()
+
+
+def write_legacy(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(records, f)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_legacy_file_is_imported_once(tmp_path, backend):
+    legacy = str(tmp_path / 'tetris_history.json')
+    write_legacy(legacy, [record(2), record(0), 5, {'start_time': 1}, record(1), {'score': 3}])
+    store = open_history(backend, str(tmp_path / 'history'), legacy_path=legacy)
+    assert store.load() == [record(0), record(1), record(2)]  # sorted, malformed entries skipped
+    assert not os.path.exists(legacy)
+    assert os.path.exists(legacy + '.bak')
+    assert migrate_legacy(store, legacy) == 0
+    assert store.count() == 3
+    store.close()
+
+
+def test_unreadable_legacy_file_does_not_block_opening(tmp_path):
+    legacy = str(tmp_path / 'tetris_history.json')
+    write_legacy(legacy, {'not': 'a list'})
+    store = open_history(BACKEND_JSONL, str(tmp_path / 'history'), legacy_path=legacy)
+    assert store.count() == 0
+    assert os.path.exists(legacy)  # left alone for the player to look at
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_interrupted_import_is_finished_without_duplicates(tmp_path, backend):
+    legacy = str(tmp_path / 'tetris_history.json')
+    # The previous run renamed the file and stored the first record, then crashed
+    write_legacy(legacy + '.migrating', [record(0), record(1), record(2)])
+    store = open_history(backend, str(tmp_path / 'history'))
+    store.append(record(0))
+    assert migrate_legacy(store, legacy) == 2
+    assert store.load() == [record(0), record(1), record(2)]
+    assert os.path.exists(legacy + '.bak')
+    assert not os.path.exists(legacy + '.migrating')
+    store.close()
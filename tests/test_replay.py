@@ -0,0 +1,91 @@
+"""回放：保存、载入、校验和跳转"""
+import random
+
+import pytest
+
+from tetris_engine import TetrisEngine, ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP
+from tetris_replay import Replay, ReplayPlayer, ReplayError, HEADER, HEADER_V2, MAGIC
+
+ACTIONS = [ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP]
+
+
+def record_game(seed=5, width=12, height=24, ticks=4000):
+    """带重力按帧推进并随机输入的一局，返回开启了 record 的引擎"""
+    rng = random.Random(seed)
+    engine = TetrisEngine(seed=seed, record=True, width=width, height=height)
+    for _ in range(ticks):
+        if rng.random() < 0.2:
+            engine.step(rng.choice(ACTIONS))
+        engine.simulate_tick()
+        if engine.game_over:
+            break
+    return engine
+
+
+def test_save_load_round_trip(tmp_path):
+    engine = record_game()
+    replay = Replay.from_engine(engine)
+    path = str(tmp_path / 'game.bin')
+    replay.save(path)
+    loaded = Replay.load(path)
+    assert loaded.inputs == engine.input_log
+    assert (loaded.seed, loaded.score, loaded.lines) == (engine.seed, engine.score, engine.lines)
+    assert (loaded.width, loaded.height, loaded.randomizer, loaded.preview) == (12, 24, engine.randomizer, 1)
+
+
+@pytest.mark.parametrize('bitboard', [False, True])
+@pytest.mark.parametrize('width,height', [(12, 24), (20, 40)])
+def test_verify_replays_the_game(bitboard, width, height):
+    engine = record_game(seed=width, width=width, height=height)
+    replay = Replay.from_bytes(Replay.from_engine(engine).to_bytes())
+    player = ReplayPlayer(replay, bitboard=bitboard)
+    assert player.verify()
+    assert [list(row) for row in player.engine.game_field] == [list(row) for row in engine.game_field]
+
+
+def test_verify_detects_a_wrong_result():
+    replay = Replay.from_engine(record_game())
+    replay.score += 1
+    assert not ReplayPlayer(replay).verify()
+
+
+def test_large_scores_are_stored():
+    replay = Replay.from_engine(record_game())
+    replay.score = 2 ** 40 + 7
+    replay.lines = 2 ** 33
+    loaded = Replay.from_bytes(replay.to_bytes())
+    assert (loaded.score, loaded.lines) == (replay.score, replay.lines)
+
+
+def test_version_2_files_are_read():
+    engine = record_game()
+    data = Replay.from_engine(engine).to_bytes()
+    old = HEADER_V2.pack(MAGIC, 2, 0, 1, engine.seed, engine.score, engine.lines, len(engine.input_log),
+                         12, 24) + data[HEADER.size:]
+    assert Replay.from_bytes(old).inputs == engine.input_log
+    assert ReplayPlayer(Replay.from_bytes(old)).verify()
+
+
+def test_bad_files_are_rejected():
+    with pytest.raises(ReplayError):
+        Replay.from_bytes(b'TRPL')
+    with pytest.raises(ReplayError):
+        Replay.from_bytes(b'XXXX' + bytes(HEADER.size))
+    data = bytearray(Replay.from_engine(record_game()).to_bytes())
+    data[4] = 99
+    with pytest.raises(ReplayError):
+        Replay.from_bytes(bytes(data))
+
+
+def test_seek_matches_a_fresh_run():
+    replay = Replay.from_engine(record_game(ticks=6000))
+    player = ReplayPlayer(replay, keyframe_interval=300)
+    player.run_to_end()
+    assert player.keyframes
+    rng = random.Random(1)
+    for _ in range(20):
+        tick = rng.randrange(replay.last_tick + 1)
+        engine = player.seek(tick)
+        fresh = ReplayPlayer(replay, keyframe_interval=0).seek(tick)
+        assert bytes(engine.cells) == bytes(fresh.cells), tick
+        assert (engine.score, engine.lines, engine.current_piece) == (fresh.score, fresh.lines, fresh.current_piece)
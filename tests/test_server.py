@@ -0,0 +1,107 @@
+"""对战服务器：客户端按增量更新重建的棋盘始终与服务器一致"""
+import random
+import zlib
+
+from tetris_engine import ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP
+from tetris_server import (VersusServer, Player, FRAME, START, OVER, MSG_INPUT, MSG_START, MSG_UPDATE, MSG_OVER,
+                           decode_update)
+
+
+class FakeTransport:
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+class FakeWriter:
+    """收集服务器写出的字节，代替网络连接"""
+
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+
+class Client:
+    """按 START / UPDATE 重建棋盘的客户端"""
+
+    def __init__(self):
+        self.player = Player(FakeWriter())
+        self.width = self.height = 0
+        self.board = None
+        self.updates = 0
+        self.results = []
+
+    def receive(self):
+        data = self.player.writer.data
+        pos = 0
+        while pos < len(data):
+            size, = FRAME.unpack_from(data, pos)
+            payload = bytes(data[pos + FRAME.size:pos + FRAME.size + size])
+            pos += FRAME.size + size
+            if payload[0] == MSG_START:
+                _, _, _, self.width, self.height = START.unpack(payload)
+                self.board = bytearray(self.width * self.height)
+            elif payload[0] == MSG_UPDATE:
+                state, rows = decode_update(payload, self.width)
+                for y, cells in rows:
+                    assert 0 <= y < self.height
+                    self.board[y * self.width:(y + 1) * self.width] = cells
+                assert zlib.crc32(self.board) == state['checksum']
+                self.updates += 1
+            elif payload[0] == MSG_OVER:
+                self.results.append(OVER.unpack(payload)[1])
+        data.clear()
+
+
+def test_delta_updates_rebuild_the_board():
+    width, height = 10, 22
+    server = VersusServer(width=width, height=height, seed=3)
+    rng = random.Random(1)
+    actions = [ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP, ACTION_HARD_DROP]
+    clients = [Client(), Client()]
+    for client in clients:
+        server.join(client.player)
+    checked = 0
+    for _ in range(6000):
+        for client in clients:
+            if client.player.match is not None and rng.random() < 0.3:
+                server.queue_inputs(client.player, bytes([MSG_INPUT, rng.choice(actions)]))
+        server.tick()
+        for client in clients:
+            client.receive()
+            engine = client.player.engine
+            if client.player.match is not None:
+                assert client.board == engine.cells
+                checked += 1
+        if clients[0].player.match is None:
+            for client in clients:
+                server.join(client.player)
+    assert server.matches_finished >= 2
+    assert checked
+    assert all(client.updates for client in clients)
+    # Every finished match has one winner and one loser
+    finished = server.matches_finished
+    assert sorted(clients[0].results + clients[1].results) == [0] * finished + [1] * finished
+
+
+def test_garbage_reaches_the_opponent():
+    server = VersusServer(seed=5)
+    clients = [Client(), Client()]
+    for client in clients:
+        server.join(client.player)
+    first, second = clients[0].player, clients[1].player
+    # Two lines cleared at once send one garbage line
+    rows = [[0] * server.width for _ in range(server.height)]
+    rows[-1] = rows[-2] = [1] * (server.width - 1) + [0]
+    first.engine.load_field(rows)
+    piece = first.engine.current_piece
+    piece.update({'id': 0, 'rotation': 1, 'x': server.width - 1, 'y': 0})  # vertical I in the last column
+    server.queue_inputs(first, bytes([MSG_INPUT, ACTION_HARD_DROP]))
+    server.tick()
+    assert first.engine.lines == 2
+    assert sum(count for count, _ in second.engine.pending_garbage) == 1
@@ -0,0 +1,87 @@
+"""快照：恢复或分叉出的引擎接着玩下去与原来完全相同"""
+import random
+
+import pytest
+
+from tetris_engine import (TetrisEngine, ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP,
+                           ACTION_HARD_DROP, ACTION_GRAVITY, RANDOMIZER_RANDOM, RANDOMIZER_BAG)
+from tetris_snapshot import snapshot, restore, from_snapshot, SnapshotError
+
+ACTIONS = [ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP, ACTION_GRAVITY]
+
+
+def state(engine):
+    return {
+        'field': [list(row) for row in engine.game_field],
+        'cells': bytes(engine.cells),
+        'piece': dict(engine.current_piece),
+        'queue': list(engine.next_queue),
+        'bag': list(engine.bag),
+        'score': engine.score,
+        'level': engine.level,
+        'lines': engine.lines,
+        'ticks': (engine.tick_count, engine.gravity_time),
+        'garbage': [tuple(entry) for entry in engine.pending_garbage],
+        'game_over': engine.game_over,
+        'features': engine.features(),
+        'rng': engine.rng.getstate(),
+    }
+
+
+def play(engine, rng, steps):
+    for _ in range(steps):
+        if engine.game_over:
+            return
+        if rng.random() < 0.01:
+            engine.queue_garbage(rng.randint(1, 3), rng.randrange(engine.width))
+        engine.step(rng.choice(ACTIONS))
+        engine.simulate_tick()
+
+
+@pytest.mark.parametrize('randomizer', [RANDOMIZER_RANDOM, RANDOMIZER_BAG])
+@pytest.mark.parametrize('bitboard', [False, True])
+@pytest.mark.parametrize('width,height', [(12, 24), (20, 60)])
+def test_fork_plays_on_identically(randomizer, bitboard, width, height):
+    for seed in range(5):
+        engine = TetrisEngine(bitboard=bitboard, seed=seed, randomizer=randomizer, preview=3,
+                              width=width, height=height)
+        play(engine, random.Random(seed), 400 + 100 * seed)
+        data = snapshot(engine)
+        # Fork in the other mode too: the snapshot does not depend on it
+        fork = from_snapshot(data, bitboard=not bitboard)
+        assert state(fork) == state(engine)
+        play(engine, random.Random(seed + 100), 1500)
+        play(fork, random.Random(seed + 100), 1500)
+        assert state(fork) == state(engine)
+
+
+def test_restore_over_a_game_in_progress():
+    original = TetrisEngine(seed=1)
+    play(original, random.Random(1), 300)
+    data = snapshot(original)
+    # The target already has a taller stack than the snapshot
+    engine = TetrisEngine(seed=2)
+    play(engine, random.Random(2), 2000)
+    restore(engine, data)
+    assert state(engine) == state(original)
+
+
+def test_large_scores_round_trip():
+    engine = TetrisEngine(seed=1)
+    engine.score = 2 ** 40 + 3
+    engine.lines = 2 ** 33
+    engine.level = 70000
+    fork = from_snapshot(snapshot(engine))
+    assert (fork.score, fork.lines, fork.level) == (engine.score, engine.lines, engine.level)
+
+
+def test_bad_snapshots_are_rejected():
+    data = snapshot(TetrisEngine(seed=1))
+    with pytest.raises(SnapshotError):
+        from_snapshot(b'TSNP')
+    with pytest.raises(SnapshotError):
+        from_snapshot(b'XXXX' + data[4:])
+    with pytest.raises(SnapshotError):
+        from_snapshot(data[:-1])
+    with pytest.raises(SnapshotError):
+        restore(TetrisEngine(width=10), data)
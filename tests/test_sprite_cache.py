@@ -0,0 +1,50 @@
+"""方块贴图缓存（SDL dummy 视频驱动下运行）"""
+import pygame
+import pytest
+
+from Tetris import BlockSpriteCache, BLOCK_SIZE, COLORS
+
+
+@pytest.fixture(autouse=True)
+def display():
+    # convert_alpha() needs a display surface
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    yield
+    pygame.display.quit()
+
+
+def test_each_style_is_rendered_once():
+    cache = BlockSpriteCache()
+    sprite = cache.get(3)
+    assert cache.get(3) is sprite
+    assert cache.get(3, 255, BLOCK_SIZE - 1) is sprite
+    assert len(cache.sprites) == 1
+
+
+def test_styles_are_keyed_by_color_alpha_and_size():
+    cache = BlockSpriteCache()
+    sprites = {cache.get(color, alpha, size) for color in range(1, 8) for alpha in (60, 255) for size in (10, 29)}
+    assert len(sprites) == len(cache.sprites) == 7 * 2 * 2
+    assert cache.get(2, 60, 10).get_size() == (10, 10)
+    assert cache.get(2, 60, 10).get_alpha() == 60
+    assert cache.get(2).get_size() == (BLOCK_SIZE - 1, BLOCK_SIZE - 1)
+
+
+def test_sprite_uses_the_tetromino_color():
+    cache = BlockSpriteCache()
+    size = 20
+    center = cache.get(5, 255, size).get_at((size // 2, size // 2))
+    assert tuple(center)[:3] == COLORS['TETROMINO'][5]
+
+
+def test_clear_renders_again(monkeypatch):
+    cache = BlockSpriteCache()
+    sprite = cache.get(1)
+    monkeypatch.setitem(COLORS, 'TETROMINO', [(0, 0, 0)] + [(10, 20, 30)] * 8)
+    assert cache.get(1) is sprite  # still the cached sprite
+    cache.clear()
+    size = BLOCK_SIZE - 1
+    redrawn = cache.get(1)
+    assert redrawn is not sprite
+    assert tuple(redrawn.get_at((size // 2, size // 2)))[:3] == (10, 20, 30)
@@ -0,0 +1,250 @@
+"""自动玩家（AI）
+
+Autoplayer enumerates every placement of the current piece that can be
+reached from its spawn position by rotating and moving sideways, drops each
+one onto a bitboard copy of the field and scores the result with a weighted
+sum of board features.  It drives the engine through step() only, so games
+it plays are recorded and replayable like human ones.
+
+Board dimensions come from the engine: the row list gives the height and
+the column heights give the width, so large boards work the same way.
+
+Works headless on a bare TetrisEngine:
+
+    python tetris_ai.py --games 5 --seed 1
+"""
+import argparse
+import sys
+import time
+from collections import namedtuple, deque
+
+from tetris_engine import (TetrisEngine, GAME_WIDTH, GAME_HEIGHT, ORIENTATIONS, ACTION_LEFT, ACTION_RIGHT,
+                           ACTION_ROTATE, ACTION_HARD_DROP, RANDOMIZER_RANDOM, RANDOMIZER_BAG)
+
+# Weights for the board features; positive is good.  Tuned around the
+# well-known four-feature heuristic, plus a small penalty for deep wells.
+DEFAULT_WEIGHTS = {
+    'aggregate_height': -0.510066,
+    'lines': 0.760666,
+    'holes': -0.35663,
+    'bumpiness': -0.184483,
+    'wells': -0.1,
+}
+
+Placement = namedtuple('Placement', 'rotation x y actions lines rows features')
+
+
+def board_rows(engine):
+    """引擎场地的行掩码（列表模式下从 game_field 生成）"""
+    if engine.bitboard:
+        return list(engine.board)
+    return [sum(1 << x for x, cell in enumerate(row) if cell) for row in engine.game_field]
+
+
+def collides(rows, masks, extent, x, y, width=GAME_WIDTH):
+    if x + extent[0] < 0 or x + extent[1] > width:
+        return True
+    height = len(rows)
+    for row_mask in masks:
+        if y >= height:
+            return True
+        if y >= 0 and rows[y] & (row_mask << x):
+            return True
+        y += 1
+    return False
+
+
+def drop_y(rows, heights, orientation, x, y):
+    """从 y 开始硬降后的落点；方块在轮廓线以上时直接由列高度算出"""
+    height = len(rows)
+    landing = height
+    for col, bottom in enumerate(orientation.bottom):
+        top = height - heights[x + col]
+        if y + bottom >= top:
+            # Under an overhang: walk down instead
+            masks = orientation.masks
+            extent = orientation.extent
+            width = len(heights)
+            while not collides(rows, masks, extent, x, y + 1, width):
+                y += 1
+            return y
+        if top - 1 - bottom < landing:
+            landing = top - 1 - bottom
+    return landing
+
+
+def scan_board(rows, width=GAME_WIDTH):
+    """从行掩码算出列高度和空洞数"""
+    height = len(rows)
+    heights = [0] * width
+    seen = 0
+    holes = 0
+    for y, row in enumerate(rows):
+        # Empty cells under something already seen are holes
+        if seen:
+            holes += bin(seen & ~row).count('1')
+        new = row & ~seen
+        while new:
+            low = new & -new
+            heights[low.bit_length() - 1] = height - y
+            new ^= low
+        seen |= row
+    return heights, holes
+
+
+def board_features(heights, holes, board_height=GAME_HEIGHT):
+    """列高度之和、空洞数、相邻列高度差之和与井深之和"""
+    bumpiness = 0
+    wells = 0
+    left = board_height  # the walls count as full columns
+    for height, right in zip(heights, heights[1:] + [board_height]):
+        depth = (left if left < right else right) - height
+        if depth > 0:
+            wells += depth * (depth + 1) // 2  # deep wells cost more than shallow ones
+        left = height
+    for height, right in zip(heights, heights[1:]):
+        bumpiness += height - right if height > right else right - height
+    return {
+        'aggregate_height': sum(heights),
+        'holes': holes,
+        'bumpiness': bumpiness,
+        'wells': wells,
+    }
+
+
+def lock(rows, heights, holes, orientation, x, y):
+    """固定方块并消行，返回 (新行列表, 消除行数, 特征)
+
+    Without a line clear a piece resting on the surface only changes the
+    columns under it, so heights and holes are updated instead of rescanned.
+    """
+    rows = list(rows)
+    height = len(rows)
+    width = len(heights)
+    full_row = (1 << width) - 1
+    lines = 0
+    for row_mask in orientation.masks:
+        if y >= 0:
+            rows[y] |= row_mask << x
+            if rows[y] == full_row:
+                lines += 1
+        y += 1
+    y -= len(orientation.masks)
+    if lines:
+        rows = [0] * lines + [row for row in rows if row != full_row]
+        return rows, lines, board_features(*scan_board(rows, width), height)
+    heights = list(heights)
+    for col, (top, bottom) in enumerate(zip(orientation.top, orientation.bottom)):
+        # Cells between the piece and the old surface become holes
+        gap = height - heights[x + col] - (y + bottom) - 1
+        if gap < 0:
+            # Tucked under an overhang: the surface does not describe it
+            return rows, 0, board_features(*scan_board(rows, width), height)
+        holes += gap
+        heights[x + col] = height - (y + top)
+    return rows, 0, board_features(heights, holes, height)
+
+
+def enumerate_placements(engine):
+    """列出当前方块所有可达的 (旋转, 列) 落点及到达所需的动作"""
+    piece = engine.current_piece
+    shape = ORIENTATIONS[piece['id']]
+    rows = board_rows(engine)
+    width = engine.width
+    heights, holes = scan_board(rows, width)
+    y = piece['y']
+    # Breadth-first search over (rotation, x) at the spawn row, using the
+    # same moves a player has: rotate in place and shift one column.
+    start = (piece['rotation'], piece['x'])
+    paths = {start: ()}
+    frontier = deque([start])
+    while frontier:
+        rotation, x = frontier.popleft()
+        path = paths[(rotation, x)]
+        for state, action in (((rotation, x - 1), ACTION_LEFT), ((rotation, x + 1), ACTION_RIGHT),
+                              (((rotation + 1) % len(shape), x), ACTION_ROTATE)):
+            if state in paths:
+                continue
+            orientation = shape[state[0]]
+            if collides(rows, orientation.masks, orientation.extent, state[1], y, width):
+                continue
+            paths[state] = path + (action,)
+            frontier.append(state)
+
+    placements = []
+    for (rotation, x), path in paths.items():
+        orientation = shape[rotation]
+        landing = drop_y(rows, heights, orientation, x, y)
+        new_rows, lines, features = lock(rows, heights, holes, orientation, x, landing)
+        placements.append(Placement(rotation, x, landing, path + (ACTION_HARD_DROP,), lines, new_rows, features))
+    return placements
+
+
+class Autoplayer:
+    def __init__(self, weights=None):
+        self.weights = dict(DEFAULT_WEIGHTS)
+        if weights:
+            self.weights.update(weights)
+
+    def evaluate(self, placement):
+        weights = self.weights
+        score = weights['lines'] * placement.lines
+        for name, value in placement.features.items():
+            score += weights[name] * value
+        return score
+
+    def best_placement(self, engine):
+        """得分最高的落点；没有可达落点时返回 None"""
+        placements = enumerate_placements(engine)
+        if not placements:
+            return None
+        return max(placements, key=self.evaluate)
+
+    def plan(self, engine):
+        """当前方块应执行的动作序列（以硬降结尾）"""
+        placement = self.best_placement(engine)
+        return list(placement.actions) if placement else [ACTION_HARD_DROP]
+
+    def play_piece(self, engine):
+        """放置一个方块，返回引擎事件"""
+        events = []
+        for action in self.plan(engine):
+            events.extend(engine.step(action))
+        return events
+
+
+def play_game(engine, player=None, max_pieces=None):
+    """无界面自动玩到游戏结束（或放够 max_pieces 个方块），返回放置的方块数"""
+    player = player or Autoplayer()
+    pieces = 0
+    while not engine.game_over and (max_pieces is None or pieces < max_pieces):
+        player.play_piece(engine)
+        pieces += 1
+    return pieces
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Let the autoplayer play headless games")
+    parser.add_argument('--games', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game; game i uses seed + i")
+    parser.add_argument('--max-pieces', type=int, default=10000, help="stop a game after this many pieces")
+    parser.add_argument('--bag', action='store_true', help="use the 7-bag randomizer")
+    parser.add_argument('--width', type=int, default=GAME_WIDTH, help="board width in cells")
+    parser.add_argument('--height', type=int, default=GAME_HEIGHT, help="board height in cells")
+    options = parser.parse_args(argv)
+
+    player = Autoplayer()
+    for i in range(options.games):
+        engine = TetrisEngine(bitboard=True, seed=options.seed + i,
+                              randomizer=RANDOMIZER_BAG if options.bag else RANDOMIZER_RANDOM,
+                              width=options.width, height=options.height)
+        start = time.perf_counter()
+        pieces = play_game(engine, player, options.max_pieces)
+        elapsed = time.perf_counter() - start
+        print(f"seed={engine.seed} score={engine.score} lines={engine.lines} level={engine.level} "
+              f"pieces={pieces} {elapsed / max(1, pieces) * 1e6:.0f} us/piece")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""批量环境：用 NumPy 同步推进多个棋盘
+
+BatchTetris keeps B playfields in one (B, height, width) uint8 array of
+colors (GAME_HEIGHT x GAME_WIDTH unless given, like TetrisEngine) and applies one action per board per step() with array
+operations only -- there is no Python loop over boards.  The rules follow
+TetrisEngine (collision, rotation without kicks, hard-drop points, line-clear
+scoring, level = 1 + lines // 5, game over when a new piece collides at its
+spawn position).  Boards that reach game over are reset in the same step.
+
+Pieces come from one NumPy generator shared by the batch, so a board does not
+get the same sequence as a TetrisEngine with the same seed.
+"""
+import numpy as np
+
+from tetris_engine import (GAME_WIDTH, GAME_HEIGHT, BUFFER_HEIGHT, MIN_BOARD_WIDTH, MAX_BOARD_WIDTH,
+                           MAX_BOARD_HEIGHT, ORIENTATIONS, LINE_SCORES, ACTION_LEFT, ACTION_RIGHT,
+                           ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP, ACTION_GRAVITY,
+                           RANDOMIZER_RANDOM, RANDOMIZER_BAG)
+
+NUM_SHAPES = len(ORIENTATIONS)
+MAX_ROTATIONS = 4
+
+# Orientation tables indexed [shape, rotation]; shapes with fewer distinct
+# rotations repeat them cyclically so any rotation index is valid.
+ROTATION_COUNT = np.array([len(shape) for shape in ORIENTATIONS], dtype=np.int64)
+CELL_DX = np.array([[[dx for dx, dy in shape[r % len(shape)].cells] for r in range(MAX_ROTATIONS)]
+                    for shape in ORIENTATIONS], dtype=np.int64)
+CELL_DY = np.array([[[dy for dx, dy in shape[r % len(shape)].cells] for r in range(MAX_ROTATIONS)]
+                    for shape in ORIENTATIONS], dtype=np.int64)
+# Offset of every shape's spawn column from the middle of the board
+SPAWN_OFFSET = np.array([shape[0].width // 2 for shape in ORIENTATIONS], dtype=np.int64)
+# Points for clearing 0..4 lines at level 1
+CLEAR_POINTS = np.array([0] + [LINE_SCORES[n] for n in range(1, 5)], dtype=np.int64)
+
+
+class BatchTetris:
+    def __init__(self, batch_size, seed=None, randomizer=RANDOMIZER_RANDOM, width=GAME_WIDTH, height=GAME_HEIGHT):
+        if not MIN_BOARD_WIDTH <= width <= MAX_BOARD_WIDTH:
+            raise ValueError(f"board width must be {MIN_BOARD_WIDTH}..{MAX_BOARD_WIDTH}, got {width}")
+        if not BUFFER_HEIGHT < height <= MAX_BOARD_HEIGHT:
+            raise ValueError(f"board height must be {BUFFER_HEIGHT + 1}..{MAX_BOARD_HEIGHT}, got {height}")
+        self.batch_size = batch_size
+        self.randomizer = randomizer
+        self.width = width
+        self.height = height
+        self.spawn_x = width // 2 - SPAWN_OFFSET  # spawn column of every shape, as in create_new_piece
+        self.rng = np.random.default_rng(seed)
+        self.boards = np.arange(batch_size)
+        self.fields = np.zeros((batch_size, height, width), dtype=np.uint8)
+        self.piece_id = np.zeros(batch_size, dtype=np.int64)
+        self.rotation = np.zeros(batch_size, dtype=np.int64)
+        self.x = np.zeros(batch_size, dtype=np.int64)
+        self.y = np.zeros(batch_size, dtype=np.int64)
+        self.color = np.zeros(batch_size, dtype=np.int64)
+        self.next_piece = np.zeros(batch_size, dtype=np.int64)
+        self.score = np.zeros(batch_size, dtype=np.int64)
+        self.lines = np.zeros(batch_size, dtype=np.int64)
+        self.level = np.ones(batch_size, dtype=np.int64)
+        self.pieces = np.zeros(batch_size, dtype=np.int64)  # pieces locked this game
+        self.game_over = np.zeros(batch_size, dtype=bool)
+        # 7-bag state: one shuffled bag per board and the index of the next draw
+        self.bags = np.zeros((batch_size, NUM_SHAPES), dtype=np.int64)
+        self.bag_pos = np.full(batch_size, NUM_SHAPES, dtype=np.int64)
+        # Results of the last finished game of every board
+        self.final_score = np.zeros(batch_size, dtype=np.int64)
+        self.final_lines = np.zeros(batch_size, dtype=np.int64)
+        self.reset(self.boards)
+
+    def reset(self, boards):
+        """重置给定编号的棋盘（索引数组或布尔掩码）"""
+        boards = self.boards[boards]
+        self.fields[boards] = 0
+        self.score[boards] = 0
+        self.lines[boards] = 0
+        self.level[boards] = 1
+        self.pieces[boards] = 0
+        self.game_over[boards] = False
+        self.bag_pos[boards] = NUM_SHAPES
+        self.next_piece[boards] = self.draw_pieces(boards)
+        self.spawn(boards)
+
+    def draw_pieces(self, boards):
+        """为每个给定棋盘从随机器取下一个形状编号"""
+        if self.randomizer != RANDOMIZER_BAG:
+            return self.rng.integers(0, NUM_SHAPES, len(boards))
+        empty = boards[self.bag_pos[boards] >= NUM_SHAPES]
+        if len(empty):
+            # argsort of uniform noise gives an independent permutation per row
+            self.bags[empty] = np.argsort(self.rng.random((len(empty), NUM_SHAPES)), axis=1)
+            self.bag_pos[empty] = 0
+        shapes = self.bags[boards, self.bag_pos[boards]]
+        self.bag_pos[boards] += 1
+        return shapes
+
+    def spawn(self, boards):
+        """与 create_new_piece 相同：取出预览方块、随机颜色，出生即碰撞则游戏结束"""
+        shapes = self.next_piece[boards]
+        self.piece_id[boards] = shapes
+        self.rotation[boards] = 0
+        self.color[boards] = self.rng.integers(1, 8, len(boards))
+        self.x[boards] = self.spawn_x[shapes]
+        self.y[boards] = 0
+        self.next_piece[boards] = self.draw_pieces(boards)
+        self.game_over[boards] |= self.collides(boards, self.rotation[boards], self.x[boards], self.y[boards])
+
+    def cells(self, boards, rotation, x, y):
+        """方块四个格子的坐标，形状为 (len(boards), 4)"""
+        shapes = self.piece_id[boards]
+        cells_x = x[:, None] + CELL_DX[shapes, rotation]
+        cells_y = y[:, None] + CELL_DY[shapes, rotation]
+        return cells_x, cells_y
+
+    def collides(self, boards, rotation, x, y):
+        """check_collision 的批量版本：越界或与已有方块重叠"""
+        cells_x, cells_y = self.cells(boards, rotation, x, y)
+        outside = (cells_x < 0) | (cells_x >= self.width) | (cells_y >= self.height)
+        # Rows above the field (y < 0) are free, like in the engine
+        occupied = self.fields[boards[:, None], np.clip(cells_y, 0, self.height - 1),
+                               np.clip(cells_x, 0, self.width - 1)] != 0
+        return (outside | (occupied & (cells_y >= 0))).any(axis=1)
+
+    def try_move(self, boards, rotation, x, y):
+        """对不碰撞的棋盘应用新位置，返回成功的掩码"""
+        ok = ~self.collides(boards, rotation, x, y)
+        moved = boards[ok]
+        self.rotation[moved] = rotation[ok]
+        self.x[moved] = x[ok]
+        self.y[moved] = y[ok]
+        return ok
+
+    def drop_distance(self, boards):
+        """每个棋盘当前方块能下落的格数"""
+        distance = np.zeros(len(boards), dtype=np.int64)
+        falling = np.ones(len(boards), dtype=bool)
+        while falling.any():
+            index = np.flatnonzero(falling)
+            sub = boards[index]
+            blocked = self.collides(sub, self.rotation[sub], self.x[sub], self.y[sub] + distance[index] + 1)
+            distance[index[~blocked]] += 1
+            falling[index[blocked]] = False
+        return distance
+
+    def lock(self, boards):
+        """merge_piece 的批量版本：写入方块、消行、计分并生成新方块；返回得分"""
+        cells_x, cells_y = self.cells(boards, self.rotation[boards], self.x[boards], self.y[boards])
+        self.fields[boards[:, None], cells_y, cells_x] = self.color[boards][:, None]
+        self.pieces[boards] += 1
+
+        full = (self.fields[boards] != 0).all(axis=2)
+        cleared = full.sum(axis=1)
+        points = CLEAR_POINTS[cleared] * self.level[boards]
+        clearing = boards[cleared > 0]
+        if len(clearing):
+            rows_full = full[cleared > 0]
+            # Full rows first (they become the empty rows at the top), then
+            # the remaining rows in their original order
+            order = np.argsort(~rows_full, axis=1, kind='stable')
+            fields = self.fields[clearing[:, None], order]
+            fields[np.arange(self.height)[None, :] < cleared[cleared > 0][:, None]] = 0
+            self.fields[clearing] = fields
+        self.score[boards] += points
+        self.lines[boards] += cleared
+        self.level[boards] = 1 + self.lines[boards] // 5
+        self.spawn(boards)
+        return points
+
+    def step(self, actions):
+        """每个棋盘执行一个 ACTION_*；返回 (本步得分, 本步结束的棋盘掩码)
+
+        Finished boards are reset before returning; their results are kept in
+        final_score / final_lines.
+        """
+        actions = np.asarray(actions)
+        reward = np.zeros(self.batch_size, dtype=np.int64)
+
+        for action, dx in ((ACTION_LEFT, -1), (ACTION_RIGHT, 1)):
+            boards = self.boards[actions == action]
+            self.try_move(boards, self.rotation[boards], self.x[boards] + dx, self.y[boards])
+
+        boards = self.boards[actions == ACTION_ROTATE]
+        self.try_move(boards, (self.rotation[boards] + 1) % ROTATION_COUNT[self.piece_id[boards]],
+                      self.x[boards], self.y[boards])
+
+        boards = self.boards[actions == ACTION_SOFT_DROP]
+        self.try_move(boards, self.rotation[boards], self.x[boards], self.y[boards] + 1)
+
+        boards = self.boards[actions == ACTION_GRAVITY]
+        fell = self.try_move(boards, self.rotation[boards], self.x[boards], self.y[boards] + 1)
+        landed = boards[~fell]
+
+        boards = self.boards[actions == ACTION_HARD_DROP]
+        drop = self.drop_distance(boards)
+        self.y[boards] += drop
+        self.score[boards] += drop
+        reward[boards] += drop
+
+        locking = np.concatenate([landed, boards])
+        if len(locking):
+            reward[locking] += self.lock(locking)
+        return reward, self.finish_games()
+
+    def place(self, rotation, x):
+        """放置式接口：把每个棋盘的当前方块转到 rotation、移到 x 后硬降
+
+        Placements that collide at the current height are ignored and the
+        piece is dropped where it is.  Returns the same as step().
+        """
+        boards = self.boards
+        rotation = np.asarray(rotation) % ROTATION_COUNT[self.piece_id]
+        self.try_move(boards, rotation, np.asarray(x), self.y.copy())
+        return self.step(np.full(self.batch_size, ACTION_HARD_DROP))
+
+    def finish_games(self):
+        done = self.game_over.copy()
+        if done.any():
+            self.final_score[done] = self.score[done]
+            self.final_lines[done] = self.lines[done]
+            self.reset(done)
+        return done
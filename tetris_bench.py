@@ -0,0 +1,479 @@
+"""性能基准测试
+
+Micro and macro benchmarks for the rules engine and the pygame renderer.  Runs
+headless (SDL_VIDEODRIVER=dummy), writes machine-readable JSON and can compare
+against a stored baseline:
+
+    python tetris_bench.py --output bench.json
+    python tetris_bench.py --save-baseline baseline.json
+    python tetris_bench.py --baseline baseline.json --threshold 0.2
+
+Exits with status 1 when any benchmark's median is slower than the baseline
+by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+import Tetris
+from tetris_engine import TetrisEngine, GAME_WIDTH, GAME_HEIGHT
+from tetris_ai import Autoplayer
+from tetris_batch import BatchTetris
+from tetris_snapshot import snapshot, restore
+from tetris_history import open_history, HistoryWriter, BACKEND_JSONL, BACKEND_SQLITE
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return register
+
+
+def time_calls(func, number, setup=None):
+    """逐次计时 func()，setup（不计时）在每次调用前执行；返回每次耗时（秒）"""
+    timings = []
+    perf_counter = time.perf_counter
+    for _ in range(number):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'calls': len(timings),
+        'median_us': statistics.median(timings) * 1e6,
+        'mean_us': statistics.fmean(timings) * 1e6,
+        'min_us': timings[0] * 1e6,
+        'p95_us': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1e6,
+    }
+
+
+# ---- Board fixtures -----------------------------------------------------
+
+def set_field(engine, rows):
+    engine.load_field(rows)
+
+
+def sparse_rows(rng, width=GAME_WIDTH, height=GAME_HEIGHT):
+    rows = [[0] * width for _ in range(height)]
+    for y in range(height - 4, height):
+        for x in range(width):
+            if rng.random() < 0.3:
+                rows[y][x] = rng.randint(1, 7)
+    return rows
+
+
+def near_full_rows(rng, width=GAME_WIDTH, height=GAME_HEIGHT):
+    """下方 18 行几乎填满；第 0 列留空，竖直 I 方块可以一次消 4 行"""
+    rows = [[0] * width for _ in range(height)]
+    for y in range(height - 18, height):
+        rows[y] = [0] + [rng.randint(1, 7) for _ in range(width - 1)]
+        if y < height - 4:
+            rows[y][rng.randrange(1, width)] = 0
+    return rows
+
+
+def full_display_rows(rng):
+    # Every visible row occupied but none complete, so nothing clears
+    rows = [[0] * GAME_WIDTH for _ in range(GAME_HEIGHT)]
+    for y in range(GAME_HEIGHT - 20, GAME_HEIGHT):
+        rows[y] = [rng.randint(1, 7) for _ in range(GAME_WIDTH)]
+        rows[y][rng.randrange(GAME_WIDTH)] = 0
+    return rows
+
+
+def place_piece(engine, shape_id, rotation, x, y):
+    engine.current_piece = {'id': shape_id, 'rotation': rotation, 'color': 1, 'x': x, 'y': y}
+
+
+# ---- Engine -------------------------------------------------------------
+
+def engine_modes():
+    return [('list', False), ('bitboard', True)]
+
+
+for _mode, _bitboard in engine_modes():
+    @benchmark(f'engine.check_collision[{_mode}]')
+    def bench_check_collision(options, bitboard=_bitboard):
+        rng = random.Random(1)
+        engine = TetrisEngine(bitboard=bitboard, seed=1)
+        set_field(engine, sparse_rows(rng))
+        place_piece(engine, 2, 0, 4, 5)
+        orientation = engine.orientation()
+        return time_calls(lambda: engine.check_collision(orientation, (0, 1)), options.number)
+
+    @benchmark(f'engine.rotate_piece[{_mode}]')
+    def bench_rotate_piece(options, bitboard=_bitboard):
+        engine = TetrisEngine(bitboard=bitboard, seed=1)
+        place_piece(engine, 2, 0, 4, 5)
+        return time_calls(engine.rotate_piece, options.number)
+
+    @benchmark(f'engine.merge_piece.sparse[{_mode}]')
+    def bench_merge_sparse(options, bitboard=_bitboard):
+        rng = random.Random(2)
+        engine = TetrisEngine(bitboard=bitboard, seed=1)
+        rows = sparse_rows(rng)
+
+        def setup():
+            set_field(engine, rows)
+            engine.game_over = False
+            place_piece(engine, 2, 0, 4, 10)
+        return time_calls(engine.merge_piece, options.number, setup)
+
+    @benchmark(f'engine.merge_piece.near_full[{_mode}]')
+    def bench_merge_near_full(options, bitboard=_bitboard):
+        rng = random.Random(3)
+        engine = TetrisEngine(bitboard=bitboard, seed=1)
+        rows = near_full_rows(rng)
+        vertical_i = 1  # second orientation of the I piece
+
+        def setup():
+            set_field(engine, rows)
+            engine.game_over = False
+            place_piece(engine, 0, vertical_i, 0, GAME_HEIGHT - 4)
+        return time_calls(engine.merge_piece, options.number, setup)
+
+    # Target is 10 us (100k placements/s per core); not met on every machine,
+    # see the README for the measured numbers and what the time goes to
+    @benchmark(f'engine.placement[{_mode}]')
+    def bench_placement(options, bitboard=_bitboard):
+        """一次完整的落块：随机旋转和平移后硬降"""
+        engine = TetrisEngine(bitboard=bitboard, seed=4)
+        rng = random.Random(4)
+
+        def place():
+            for _ in range(rng.randint(0, 3)):
+                engine.rotate()
+            engine.move(rng.randint(-6, 6))
+            engine.hard_drop()
+            if engine.game_over:
+                engine.reset_game(rng.randrange(2 ** 32))
+        return time_calls(place, options.number)
+
+
+# Large boards: the cost of a lock should not depend on the board size.
+# Measured over real play because rebuilding a large field before every
+# call (as the merge_piece benchmarks do) would flush the CPU caches.
+LARGE_BOARDS = [(24, 128), (64, 512)]
+
+for _mode, _bitboard in engine_modes():
+    for _width, _height in [(GAME_WIDTH, GAME_HEIGHT)] + LARGE_BOARDS:
+        @benchmark(f'engine.lock[{_mode},{_width}x{_height}]')
+        def bench_lock(options, bitboard=_bitboard, width=_width, height=_height):
+            """完整一局中的落块（硬降到底并固定，包括消行）"""
+            engine = TetrisEngine(bitboard=bitboard, seed=4, width=width, height=height)
+            rng = random.Random(4)
+
+            def setup():
+                if engine.game_over:
+                    engine.reset_game(rng.randrange(2 ** 32))
+                for _ in range(rng.randint(0, 3)):
+                    engine.rotate()
+                engine.move(rng.randint(-width // 2, width // 2))
+            return time_calls(engine.hard_drop, options.number, setup)
+
+
+def midgame_engine(width, height):
+    """用自动玩家下到有一定高度的堆叠"""
+    engine = TetrisEngine(bitboard=True, seed=11, width=width, height=height)
+    player = Autoplayer()
+    while engine.max_height < height // 4 and not engine.game_over:
+        player.play_piece(engine)
+        engine.hard_drop()  # leave some uncleared rows
+    return engine
+
+
+for _width, _height in [(GAME_WIDTH, GAME_HEIGHT), (64, 512)]:
+    @benchmark(f'snapshot.save[{_width}x{_height}]')
+    def bench_snapshot_save(options, width=_width, height=_height):
+        """把一局进行中的游戏打包成快照"""
+        engine = midgame_engine(width, height)
+        return time_calls(lambda: snapshot(engine), options.number)
+
+    @benchmark(f'snapshot.restore[{_width}x{_height}]')
+    def bench_snapshot_restore(options, width=_width, height=_height):
+        """从快照恢复引擎状态（包括重建位板和特征）"""
+        engine = midgame_engine(width, height)
+        data = snapshot(engine)
+        return time_calls(lambda: restore(engine, data), options.number)
+
+
+@benchmark('ai.best_placement')
+def bench_best_placement(options):
+    """自动玩家为一个方块枚举并评估所有落点"""
+    rng = random.Random(9)
+    engine = TetrisEngine(bitboard=True, seed=9)
+    set_field(engine, sparse_rows(rng))
+    player = Autoplayer()
+
+    def setup():
+        place_piece(engine, rng.randrange(7), 0, GAME_WIDTH // 2 - 1, 0)
+    return time_calls(lambda: player.best_placement(engine), options.number // 4, setup)
+
+
+@benchmark('batch.place[4096]')
+def bench_batch_place(options):
+    """4096 个棋盘各放置一个方块（每次调用）"""
+    env = BatchTetris(4096, seed=10)
+    rng = np.random.default_rng(10)
+    rotations = rng.integers(0, 4, (options.frames, env.batch_size))
+    columns = rng.integers(-1, GAME_WIDTH - 1, (options.frames, env.batch_size))
+    moves = iter(zip(rotations, columns))
+    return time_calls(lambda: env.place(*next(moves)), options.frames)
+
+
+# ---- Renderer -----------------------------------------------------------
+
+def make_game():
+    screen = pygame.display.set_mode((Tetris.SCREEN_WIDTH, Tetris.SCREEN_HEIGHT))
+    return Tetris.TetrisGame(screen, seed=5)
+
+
+@benchmark('render.draw_ghost_piece.cached')
+def bench_ghost_cached(options):
+    game = make_game()
+    set_field(game, sparse_rows(random.Random(6)))
+    return time_calls(game.draw_ghost_piece, options.number)
+
+
+@benchmark('render.draw_ghost_piece.cold')
+def bench_ghost_cold(options):
+    game = make_game()
+    set_field(game, sparse_rows(random.Random(6)))
+
+    def invalidate():
+        game.field_version += 1
+    return time_calls(game.draw_ghost_piece, options.number, invalidate)
+
+
+@benchmark('render.draw_game.empty')
+def bench_draw_empty(options):
+    game = make_game()
+    return time_calls(game.draw_game, options.frames)
+
+
+@benchmark('render.draw_game.full')
+def bench_draw_full(options):
+    game = make_game()
+    set_field(game, full_display_rows(random.Random(7)))
+    return time_calls(game.draw_game, options.frames)
+
+
+@benchmark('render.draw_game.particles')
+def bench_draw_particles(options):
+    game = make_game()
+    set_field(game, full_display_rows(random.Random(8)))
+    rng = random.Random(8)
+    while len(game.particles) < game.particles.capacity:
+        game.add_particles((rng.uniform(150, 570), rng.uniform(50, 750)))
+    return time_calls(game.draw_game, options.frames)
+
+
+# ---- History ------------------------------------------------------------
+
+def history_records(count):
+    start = datetime(2024, 1, 1)
+    rng = random.Random(count)
+    for i in range(count):
+        begin = start + timedelta(minutes=7 * i)
+        yield {
+            'start_time': begin.strftime('%Y-%m-%d %H:%M:%S'),
+            'end_time': (begin + timedelta(minutes=5)).strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': '05:00',
+            'level': rng.randint(1, 20),
+            'score': rng.randint(0, 100000),
+            'lines': rng.randint(0, 100),
+            'seed': rng.randrange(2 ** 32),
+        }
+
+
+def history_benchmarks(backend, count):
+    """打开存储（建立索引）、首次加载历史界面，以及逐行滚动时每帧的绘制耗时"""
+    def bench_open(options):
+        with tempfile.TemporaryDirectory() as tmp:
+            base = os.path.join(tmp, 'tetris_history')
+            store = open_history(backend, base)
+            store.extend(list(history_records(count)))
+            store.close()
+            number = max(1, min(20, 100000 // count))
+            return time_calls(lambda: open_history(backend, base).close(), number)
+
+    def bench_load(options):
+        screen = pygame.display.set_mode((Tetris.SCREEN_WIDTH, Tetris.SCREEN_HEIGHT))
+        with tempfile.TemporaryDirectory() as tmp:
+            store = open_history(backend, os.path.join(tmp, 'tetris_history'))
+            try:
+                store.extend(list(history_records(count)))
+                history = Tetris.HistoryScreen(screen, lambda: store)
+
+                def unload():
+                    history.loaded = False
+                    history.scroll_offset = 0
+                return time_calls(history.draw, max(1, min(20, 100000 // count)), unload)
+            finally:
+                store.close()
+
+    def bench_scroll(options):
+        screen = pygame.display.set_mode((Tetris.SCREEN_WIDTH, Tetris.SCREEN_HEIGHT))
+        with tempfile.TemporaryDirectory() as tmp:
+            store = open_history(backend, os.path.join(tmp, 'tetris_history'))
+            try:
+                store.extend(list(history_records(count)))
+                history = Tetris.HistoryScreen(screen, lambda: store)
+                history.draw()
+
+                def scroll():
+                    history.scroll_offset = (history.scroll_offset + 1) % (history.max_scroll + 1)
+                return time_calls(history.draw, options.frames, scroll)
+            finally:
+                store.close()
+    return bench_open, bench_load, bench_scroll
+
+
+@benchmark('history.writer.append')
+def bench_writer_append(options):
+    """UI 线程保存一局记录的耗时（只入队，写盘在后台线程）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_history(BACKEND_JSONL, os.path.join(tmp, 'tetris_history'))
+        writer = HistoryWriter(store, max_queue=options.number)
+        records = history_records(options.number)
+        try:
+            return time_calls(lambda: writer.append(next(records)), options.number)
+        finally:
+            writer.close()
+            store.close()
+
+
+def register_history_benchmarks(sizes):
+    for count in sizes:
+        for backend in (BACKEND_JSONL, BACKEND_SQLITE):
+            bench_open, bench_load, bench_scroll = history_benchmarks(backend, count)
+            benchmark(f'history.open[{backend},{count}]')(bench_open)
+            benchmark(f'history.first_draw[{backend},{count}]')(bench_load)
+            benchmark(f'history.draw.scroll[{backend},{count}]')(bench_scroll)
+
+
+# ---- Startup -----------------------------------------------------------
+
+# Runs in a fresh interpreter: import, build the app and draw the first frame.
+# The record store is redirected to the directory given as argv[1] so the
+# benchmark never opens, writes or migrates the player's history.
+STARTUP_SCRIPT = """
+import os, sys, time
+start = time.perf_counter()
+import Tetris
+data_dir = sys.argv[1]
+Tetris.SAVE_FILE = os.path.join(data_dir, 'tetris_history.json')
+Tetris.HISTORY_BASE = os.path.join(data_dir, 'tetris_history')
+app = Tetris.TetrisApp()
+app.run_frame()
+print(time.perf_counter() - start)
+"""
+
+
+@benchmark('startup.first_frame')
+def bench_startup(options):
+    """从导入 Tetris 到第一帧显示的时间（每次都在新进程中测量）"""
+    timings = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        for _ in range(options.startup_runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, data_dir],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, check=True).stdout
+            timings.append(float(output.split()[-1]))
+    return timings
+
+
+# ---- Runner -------------------------------------------------------------
+
+def run(options):
+    results = {}
+    for name, func in BENCHMARKS:
+        if options.filter and options.filter not in name:
+            continue
+        stats = summarize(func(options))
+        results[name] = stats
+        print(f"{name:45s} median {stats['median_us']:12.2f} us   p95 {stats['p95_us']:12.2f} us")
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'video_driver': os.environ.get('SDL_VIDEODRIVER'),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """与基线比较中位数，返回变慢超过阈值的测试名"""
+    regressions = []
+    for name, stats in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = stats['median_us'] / base['median_us'] if base['median_us'] else 1.0
+        flag = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f"{name:45s} {ratio:6.2f}x baseline {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tetris benchmark suite")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against this JSON results file")
+    parser.add_argument('--save-baseline', help="write results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed slowdown of the median before failing (default 0.2 = 20%%)")
+    parser.add_argument('--number', type=int, default=2000, help="calls per micro benchmark")
+    parser.add_argument('--frames', type=int, default=200, help="frames per draw_game benchmark")
+    parser.add_argument('--startup-runs', type=int, default=10, help="processes started by the startup benchmark")
+    parser.add_argument('--history-sizes', default='100,10000,1000000',
+                        help="comma-separated history record counts")
+    parser.add_argument('--filter', help="only run benchmarks whose name contains this string")
+    options = parser.parse_args(argv)
+
+    register_history_benchmarks(int(size) for size in options.history_sizes.split(',') if size)
+    pygame.display.init()
+    report = run(options)
+
+    for path in (options.output, options.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,638 @@
+"""俄罗斯方块规则引擎
+
+Pure-Python game rules with no pygame dependency, so it can be imported and
+stepped headlessly (simulation, tuning, regression runs).  The pygame front end
+in Tetris.py renders on top of this class.
+"""
+import random
+from collections import deque, namedtuple
+from datetime import datetime
+
+# Board dimensions (defaults; every engine can use its own width and height)
+GAME_WIDTH = 12
+GAME_HEIGHT = 24
+VISIBLE_HEIGHT = 20  # 可视区域高度
+BUFFER_HEIGHT = 4  # 上方缓冲区域
+MIN_BOARD_WIDTH = 4  # the I piece has to fit
+MAX_BOARD_WIDTH = 64
+MAX_BOARD_HEIGHT = 1024
+
+# Tetromino shapes
+SHAPES = [
+    [[1, 1, 1, 1]],  # I
+    [[2, 2], [2, 2]],  # O
+    [[3, 3, 3], [0, 3, 0]],  # T
+    [[4, 4, 4], [4, 0, 0]],  # L
+    [[5, 5, 5], [0, 0, 5]],  # J
+    [[6, 6, 0], [0, 6, 6]],  # S
+    [[0, 7, 7], [7, 7, 0]]  # Z
+]
+
+# Values drawn for a new piece.  rng.choice over a range draws the same
+# numbers as randrange/randint (so seeded games and replays are unchanged)
+# with less call overhead.
+SHAPE_IDS = range(len(SHAPES))
+PIECE_COLORS = range(1, 8)
+
+# Bitmask of a completely filled row of the default width (bitboard mode)
+FULL_ROW = (1 << GAME_WIDTH) - 1
+
+# Points per number of lines cleared at once (multiplied by level)
+LINE_SCORES = {1: 100, 2: 300, 3: 500, 4: 800}
+
+# Event types returned by the step API
+EVENT_LOCK = 'lock'
+EVENT_LINE_CLEAR = 'line_clear'
+EVENT_GAME_OVER = 'game_over'
+EVENT_GARBAGE = 'garbage'
+
+# Color index of garbage rows pushed in by a versus opponent
+GARBAGE_COLOR = 8
+
+# Input actions accepted by TetrisEngine.step (also the replay log alphabet)
+ACTION_LEFT = 0
+ACTION_RIGHT = 1
+ACTION_ROTATE = 2
+ACTION_SOFT_DROP = 3
+ACTION_HARD_DROP = 4
+ACTION_GRAVITY = 5
+
+# Fixed simulation rate (ticks per second), independent of the render rate.
+# Every fall speed (a multiple of 50 ms) is a whole number of ticks.
+SIM_RATE = 120
+MAX_CATCH_UP_MS = 250  # longest stall the simulation catches up on
+
+# Piece randomizers
+RANDOMIZER_RANDOM = 'random'  # independent uniform draws
+RANDOMIZER_BAG = 'bag'  # 7-bag: every shape once per shuffled bag
+
+
+def row_masks(shape):
+    """方块每一行的位掩码（第 x 列对应第 x 位）"""
+    return tuple(sum(1 << x for x, cell in enumerate(row) if cell) for row in shape)
+
+
+def mask_extent(masks):
+    """掩码占用的最左列和最右列之后一列"""
+    acc = 0
+    for m in masks:
+        acc |= m
+    return (acc & -acc).bit_length() - 1, acc.bit_length()
+
+
+# One rotation state of a shape.  cells are (dx, dy) offsets from the piece
+# origin; top/bottom give the highest/lowest occupied dy of every column.
+Orientation = namedtuple('Orientation', 'cells width height masks extent top bottom')
+
+
+def build_orientations(shape):
+    """预先计算一个形状的所有不同旋转状态（顺时针顺序）"""
+    orientations = []
+    matrix = shape
+    for _ in range(4):
+        cells = tuple((x, y) for y, row in enumerate(matrix) for x, cell in enumerate(row) if cell)
+        width = len(matrix[0])
+        masks = row_masks(matrix)
+        orientation = Orientation(
+            cells=cells,
+            width=width,
+            height=len(matrix),
+            masks=masks,
+            extent=mask_extent(masks),
+            top=tuple(min(y for x, y in cells if x == col) for col in range(width)),
+            bottom=tuple(max(y for x, y in cells if x == col) for col in range(width)),
+        )
+        if orientation in orientations:
+            break
+        orientations.append(orientation)
+        matrix = [list(row) for row in zip(*matrix[::-1])]
+    return tuple(orientations)
+
+
+# ORIENTATIONS[shape_id][rotation] for every entry in SHAPES
+ORIENTATIONS = tuple(build_orientations(shape) for shape in SHAPES)
+
+
+class FixedTimestep:
+    """固定步长调度器：把每帧实际经过的毫秒数换算成整数个模拟步
+
+    Time is kept in units of 1 / (1000 * rate) s so that no rounding error
+    accumulates.  Leftover time carries over to the next frame; a stall
+    longer than max_catch_up_ms is dropped instead of replayed in a burst.
+    """
+
+    def __init__(self, rate=SIM_RATE, max_catch_up_ms=MAX_CATCH_UP_MS):
+        self.rate = rate
+        self.step_ms = 1000 / rate
+        self.max_steps = max(1, max_catch_up_ms * rate // 1000)
+        self.accumulator = 0
+        self.dropped_steps = 0  # steps skipped by the catch-up limit
+
+    def reset(self):
+        self.accumulator = 0
+
+    def advance(self, elapsed_ms):
+        """累加 elapsed_ms，返回本帧应执行的模拟步数"""
+        self.accumulator += elapsed_ms * self.rate
+        steps = self.accumulator // 1000
+        if steps > self.max_steps:
+            self.dropped_steps += steps - self.max_steps
+            steps = self.max_steps
+            self.accumulator %= 1000
+        else:
+            self.accumulator -= steps * 1000
+        return int(steps)
+
+    @property
+    def alpha(self):
+        """距下一个模拟步的进度（0..1），可用于插值绘制"""
+        return self.accumulator / 1000
+
+
+class TetrisEngine:
+    def __init__(self, bitboard=False, seed=None, randomizer=RANDOMIZER_RANDOM, preview=1, record=False,
+                 width=GAME_WIDTH, height=GAME_HEIGHT):
+        # bitboard=True keeps each row as an int bitmask for collision and
+        # line clears; game_field rows are then read-only views of cells
+        # rather than lists of their own.
+        self.bitboard = bitboard
+        self.randomizer = randomizer
+        self.preview = preview  # number of upcoming pieces kept in next_queue
+        self.record = record  # keep a tick-stamped input log for replays
+        if not MIN_BOARD_WIDTH <= width <= MAX_BOARD_WIDTH:
+            raise ValueError(f"board width must be {MIN_BOARD_WIDTH}..{MAX_BOARD_WIDTH}, got {width}")
+        if not BUFFER_HEIGHT < height <= MAX_BOARD_HEIGHT:
+            raise ValueError(f"board height must be {BUFFER_HEIGHT + 1}..{MAX_BOARD_HEIGHT}, got {height}")
+        self.width = width
+        self.height = height
+        self.full_row = (1 << width) - 1
+        self.VISIBLE_HEIGHT = height - BUFFER_HEIGHT
+        self.BUFFER_HEIGHT = BUFFER_HEIGHT
+        self.TOTAL_HEIGHT = height
+        # Row-major copy of game_field in one flat buffer.  field_view is a
+        # (height, width) memoryview of it that stays valid for the engine's
+        # lifetime (np.asarray(engine.field_view) does not copy).
+        self.cells = bytearray(height * width)
+        self.field_view = memoryview(self.cells).cast('B', (height, width))
+        self.reset_game(seed)
+
+    def reset_game(self, seed=None):
+        # Every game has its own seeded RNG so it can be reproduced exactly
+        self.seed = random.randrange(2 ** 63) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.bag = []
+        self.tick_count = 0
+        self.gravity_time = 0  # simulated ms since the last gravity step, times SIM_RATE
+        self.input_log = [] if self.record else None
+        self.cells[:] = bytes(len(self.cells))
+        if self.bitboard:
+            buffer = memoryview(self.cells).toreadonly()
+            self.game_field = [buffer[y * self.width:(y + 1) * self.width] for y in range(self.height)]
+        else:
+            self.game_field = [[0] * self.width for _ in range(self.height)]
+        self.board = [0] * self.height
+        # Skyline index: height of the highest filled cell in every column
+        self.column_heights = [0] * self.width
+        # Board features.  Row fill counts are kept up to date by
+        # merge_piece; holes, bumpiness, max_height and aggregate_height are
+        # derived from the skyline on first read after the field changed.
+        self.row_fill = [0] * self.height  # filled cells per row
+        self.filled_cells = 0
+        self._features = None  # (holes, bumpiness, max_height, aggregate_height); None when stale
+        self.field_version = 0  # bumped whenever the field changes
+        self.pending_garbage = []  # (count, hole column) waiting to rise (versus mode)
+        self._landing_key = None
+        self._landing_y = 0
+        self.current_piece = None
+        self.next_queue = deque(self.draw_piece() for _ in range(self.preview))
+        self.next_piece = self.next_queue[0]
+        self.score = 0
+        self.level = 1
+        self.lines = 0
+        self.start_time = datetime.now()
+        self.game_over = False
+        self.is_paused = False
+        self.create_new_piece()
+
+    def draw_piece(self):
+        """从随机器取下一个形状编号"""
+        if self.randomizer == RANDOMIZER_BAG:
+            if not self.bag:
+                self.bag = list(SHAPE_IDS)
+                self.rng.shuffle(self.bag)
+            return self.bag.pop()
+        return self.rng.choice(SHAPE_IDS)
+
+    def create_new_piece(self):
+        shape_id = self.next_queue.popleft()
+        orientation = ORIENTATIONS[shape_id][0]
+        # current_piece is (shape id, rotation index, position) plus its color
+        self.current_piece = {
+            'id': shape_id,
+            'rotation': 0,
+            'color': self.rng.choice(PIECE_COLORS),
+            'x': self.width // 2 - orientation.width // 2,
+            'y': 0
+        }
+        self.next_queue.append(self.draw_piece())
+        self.next_piece = self.next_queue[0]
+        if self.check_collision(orientation, (0, 0)):
+            self.game_over = True
+
+    def orientation(self, piece=None):
+        """方块当前旋转状态的 Orientation"""
+        piece = piece or self.current_piece
+        return ORIENTATIONS[piece['id']][piece['rotation']]
+
+    def check_collision(self, orientation, offset):
+        piece = self.current_piece
+        x = piece['x'] + offset[0]
+        y = piece['y'] + offset[1]
+        if self.bitboard:
+            extent = orientation.extent
+            if x + extent[0] < 0 or x + extent[1] > self.width or y + orientation.height > self.height:
+                return True
+            board = self.board
+            for row_mask in orientation.masks:
+                if y >= 0 and board[y] & (row_mask << x):
+                    return True
+                y += 1
+            return False
+        field = self.game_field
+        width = self.width
+        height = self.height
+        for dx, dy in orientation.cells:
+            new_x = x + dx
+            new_y = y + dy
+            if new_x < 0 or new_x >= width or new_y >= height:
+                return True
+            if new_y >= 0 and field[new_y][new_x]:
+                return True
+        return False
+
+    def rotate_piece(self):
+        piece = self.current_piece
+        orientations = ORIENTATIONS[piece['id']]
+        rotation = (piece['rotation'] + 1) % len(orientations)
+        if not self.check_collision(orientations[rotation], (0, 0)):
+            piece['rotation'] = rotation
+            return True
+        return False
+
+    def merge_piece(self):
+        """固定当前方块并消行，返回事件列表
+
+        Only the rows the piece touched can become full, and a line clear
+        only moves the rows between the top of the stack and the cleared
+        row, so the cost does not grow with the board height.
+        """
+        piece = self.current_piece
+        orientation = ORIENTATIONS[piece['id']][piece['rotation']]
+        color = piece['color']
+        width = self.width
+        piece_x = piece['x']
+        piece_y = piece['y']
+        cells = [(piece_x + dx, piece_y + dy) for dx, dy in orientation.cells]
+        buffer = self.cells
+        row_fill = self.row_fill
+        if self.bitboard:
+            # game_field rows are views of the buffer
+            for x, y in cells:
+                buffer[y * width + x] = color
+                row_fill[y] += 1
+        else:
+            field = self.game_field
+            for x, y in cells:
+                field[y][x] = color
+                buffer[y * width + x] = color
+                row_fill[y] += 1
+        self.filled_cells += len(cells)
+        heights = self.column_heights
+        base = self.height - piece_y
+        col = piece_x
+        for top in orientation.top:
+            if base - top > heights[col]:
+                heights[col] = base - top
+            col += 1
+        self._features = None
+        self.field_version += 1
+        events = [{'type': EVENT_LOCK, 'cells': cells, 'color': color}]
+
+        if self.bitboard:
+            cleared_rows = self.merge_bits(orientation, piece_x, piece_y)
+        else:
+            cleared_rows = [y for y in range(piece_y, piece_y + orientation.height) if row_fill[y] == width]
+        lines_cleared = len(cleared_rows)
+        if lines_cleared > 0:
+            # Rows above the stack (which now includes the piece, whose first
+            # row is never empty) do not move
+            stack_top = self.height - max(heights)
+            if not self.bitboard:
+                # Untouched rows are moved, not rebuilt
+                for y in reversed(cleared_rows):
+                    del field[y]
+                field[:0] = [[0] * width for _ in range(lines_cleared)]
+            self.update_features_after_clear(cleared_rows, stack_top)
+            self.update_heights_after_clear(cleared_rows)
+            points = LINE_SCORES.get(lines_cleared, 1000) * self.level
+            self.score += points
+            self.lines += lines_cleared
+            self.level = 1 + self.lines // 5
+            events.append({'type': EVENT_LINE_CLEAR, 'rows': cleared_rows,
+                           'count': lines_cleared, 'points': points})
+        elif self.pending_garbage:
+            events.extend(self.rise_garbage())
+
+        self.create_new_piece()
+        if self.game_over:
+            events.append({'type': EVENT_GAME_OVER})
+        return events
+
+    def merge_bits(self, orientation, x, y):
+        """把方块写入位板，消除满行并返回被消除的行号"""
+        board = self.board
+        full_row = self.full_row
+        cleared_rows = []
+        for row_mask in orientation.masks:
+            row = board[y] | row_mask << x
+            board[y] = row
+            if row == full_row:
+                cleared_rows.append(y)
+            y += 1
+        if cleared_rows:
+            for y in reversed(cleared_rows):
+                del board[y]
+            board[:0] = [0] * len(cleared_rows)
+        return cleared_rows
+
+    def update_heights_after_clear(self, cleared_rows):
+        """消行后更新列高度；只有最高格被消掉的列需要重新扫描"""
+        heights = self.column_heights
+        height = self.height
+        lines_cleared = len(cleared_rows)
+        for col in range(self.width):
+            top = height - heights[col]
+            if top in cleared_rows:
+                # Everything above the old top is empty: start scanning there
+                heights[col] = self.scan_column_height(col, top)
+            else:
+                heights[col] -= lines_cleared
+
+    def update_features_after_clear(self, cleared_rows, stack_top=0):
+        """消行后同步缓冲区和行计数；stack_top 以上的行原本为空"""
+        n = len(cleared_rows)
+        width = self.width
+        buffer = self.cells
+        row_fill = self.row_fill
+        empty_row = bytes(width)
+        top = max(0, stack_top)
+        for y in sorted(cleared_rows):
+            # Shift the stack above the row down by one.  Equal-length slice
+            # assignment keeps the buffer (and field_view) in place.
+            buffer[(top + 1) * width:(y + 1) * width] = buffer[top * width:y * width]
+            buffer[top * width:(top + 1) * width] = empty_row
+            top += 1
+            del row_fill[y]
+            row_fill.insert(0, 0)
+        self.filled_cells -= n * width
+        self._features = None
+
+    def queue_garbage(self, count, hole):
+        """对战模式：排队 count 行垃圾行（hole 列留空），下一次没有消行的固定后从底部升起"""
+        self.pending_garbage.append((count, hole))
+
+    def rise_garbage(self):
+        """把排队的垃圾行推入场地底部，返回事件列表；顶部方块被挤出则游戏结束"""
+        events = []
+        width = self.width
+        height = self.height
+        for count, hole in self.pending_garbage:
+            count = min(count, height)
+            if any(self.row_fill[:count]):
+                self.game_over = True  # blocks pushed out of the top
+            row = [GARBAGE_COLOR] * width
+            row[hole] = 0
+            if not self.bitboard:
+                del self.game_field[:count]
+                self.game_field.extend([list(row) for _ in range(count)])
+            del self.board[:count]
+            self.board.extend([self.full_row & ~(1 << hole)] * count)
+            # Equal-length slice assignment keeps the buffer in place
+            self.cells[:-count * width] = self.cells[count * width:]
+            self.cells[-count * width:] = bytes(row) * count
+            self.filled_cells += (width - 1) * count - sum(self.row_fill[:count])
+            del self.row_fill[:count]
+            self.row_fill.extend([width - 1] * count)
+            heights = self.column_heights
+            for col in range(width):
+                if heights[col] or col != hole:
+                    heights[col] = min(height, heights[col] + count)
+            events.append({'type': EVENT_GARBAGE, 'count': count, 'hole': hole})
+        if self.game_over:
+            self.column_heights = [self.scan_column_height(col) for col in range(width)]
+        self.pending_garbage = []
+        self._features = None
+        self.field_version += 1
+        return events
+
+    def recompute_features(self):
+        """由列高度算出汇总特征并缓存，场地变化前重复读取为 O(1)"""
+        heights = self.column_heights
+        aggregate_height = sum(heights)
+        self._features = (
+            aggregate_height - self.filled_cells,  # a column's holes are its height minus its filled cells
+            sum([abs(heights[col] - heights[col + 1]) for col in range(self.width - 1)]),
+            max(heights),
+            aggregate_height,
+        )
+        return self._features
+
+    @property
+    def holes(self):
+        """列顶以下的空格数"""
+        return (self._features or self.recompute_features())[0]
+
+    @property
+    def bumpiness(self):
+        """相邻列高度差之和"""
+        return (self._features or self.recompute_features())[1]
+
+    @property
+    def max_height(self):
+        return (self._features or self.recompute_features())[2]
+
+    @property
+    def aggregate_height(self):
+        """所有列高度之和"""
+        return (self._features or self.recompute_features())[3]
+
+    def features(self):
+        """当前棋盘特征（列高度和行计数随落块更新，其余在场地变化后第一次读取时算出）"""
+        return {
+            'column_heights': self.column_heights,
+            'row_fill': self.row_fill,
+            'holes': self.holes,
+            'bumpiness': self.bumpiness,
+            'max_height': self.max_height,
+            'aggregate_height': self.aggregate_height,
+        }
+
+    def load_field(self, rows):
+        """用颜色行列表替换场地，并重建位板、列高度、缓冲区和特征"""
+        if len(rows) != self.height or any(len(row) != self.width for row in rows):
+            raise ValueError(f"field must be {self.height} rows of {self.width} cells")
+        self.cells[:] = b''.join(bytes(row) for row in rows)
+        if not self.bitboard:
+            self.game_field = [list(row) for row in rows]
+        self.board = [sum(1 << x for x, cell in enumerate(row) if cell) for row in rows]
+        self.column_heights = [self.scan_column_height(col) for col in range(self.width)]
+        self.row_fill = [sum(1 for cell in row if cell) for row in rows]
+        self.filled_cells = sum(self.row_fill)
+        self._features = None
+        self.field_version += 1
+
+    def scan_column_height(self, col, start=0):
+        """从 start 行往下扫描 col 列的高度（读缓冲区，两种模式通用）"""
+        return len(self.cells[start * self.width + col::self.width].lstrip(b'\0'))
+
+    def drop_distance(self):
+        """当前方块能直接下落的格数，由列高度索引算出"""
+        piece = self.current_piece
+        orientation = ORIENTATIONS[piece['id']][piece['rotation']]
+        x = piece['x']
+        y = piece['y']
+        heights = self.column_heights
+        height = self.height
+        landing = height
+        col = x
+        for bottom in orientation.bottom:
+            top = height - heights[col]
+            col += 1
+            if y + bottom >= top:
+                # Piece has slid under an overhang: the skyline does not
+                # apply, so walk down cell by cell instead.
+                drop = 0
+                if not self.bitboard:
+                    while not self.check_collision(orientation, (0, drop + 1)):
+                        drop += 1
+                    return drop
+                board = self.board
+                masks = [row_mask << x for row_mask in orientation.masks]
+                while y + drop + len(masks) < height:
+                    row = y + drop + 1
+                    for row_mask in masks:
+                        if board[row] & row_mask:
+                            return drop
+                        row += 1
+                    drop += 1
+                return drop
+            if top - 1 - bottom < landing:
+                landing = top - 1 - bottom
+        return landing - y
+
+    def landing_y(self):
+        """硬降落点的 y，方块移动或场地变化前直接返回缓存值"""
+        piece = self.current_piece
+        key = (piece['id'], piece['rotation'], piece['x'], piece['y'], self.field_version)
+        if key != self._landing_key:
+            self._landing_key = key
+            self._landing_y = piece['y'] + self.drop_distance()
+        return self._landing_y
+
+    def get_fall_speed(self):
+        return max(50, 800 - (self.level * 50))
+
+    # ---- Step API -------------------------------------------------------
+
+    def can_act(self):
+        return not self.game_over and not self.is_paused
+
+    def next_tick(self):
+        """推进一个模拟帧（回放日志的时间戳）"""
+        self.tick_count += 1
+
+    def simulate_tick(self):
+        """执行一个 1/SIM_RATE 秒的固定模拟步：到了下落时间就施加重力，返回事件列表"""
+        events = []
+        if self.can_act():
+            self.gravity_time += 1000
+            fall = self.get_fall_speed() * SIM_RATE
+            if self.gravity_time >= fall:
+                # Keep the remainder so the average speed is exact
+                self.gravity_time -= fall
+                events = self.step(ACTION_GRAVITY)
+        self.next_tick()
+        return events
+
+    def simulate_ticks(self, count):
+        """一次执行 count 个固定模拟步，游戏状态与连续调用 simulate_tick 相同（回放日志时间戳除外）"""
+        events = []
+        if not self.game_over and not self.is_paused:
+            self.gravity_time += 1000 * count
+            fall = self.get_fall_speed() * SIM_RATE
+            # Usually nothing falls in a batch and the loop is skipped
+            while self.gravity_time >= fall and self.can_act():
+                self.gravity_time -= fall
+                events.extend(self.step(ACTION_GRAVITY))
+                fall = self.get_fall_speed() * SIM_RATE
+        self.tick_count += count
+        return events
+
+    def step(self, action):
+        """执行一个输入动作（ACTION_*），写入回放日志并返回事件列表"""
+        if not self.can_act():
+            return []
+        if self.input_log is not None:
+            self.input_log.append((self.tick_count, action))
+        if action == ACTION_LEFT:
+            self.move(-1)
+        elif action == ACTION_RIGHT:
+            self.move(1)
+        elif action == ACTION_ROTATE:
+            self.rotate()
+        elif action == ACTION_SOFT_DROP:
+            return self.soft_drop()
+        elif action == ACTION_HARD_DROP:
+            return self.hard_drop()
+        elif action == ACTION_GRAVITY:
+            return self.tick()
+        return []
+
+    def move(self, dx):
+        """水平移动 dx 格，成功返回 True"""
+        piece = self.current_piece
+        if (self.game_over or self.is_paused
+                or self.check_collision(ORIENTATIONS[piece['id']][piece['rotation']], (dx, 0))):
+            return False
+        piece['x'] += dx
+        return True
+
+    def rotate(self):
+        """顺时针旋转，成功返回 True"""
+        if self.game_over or self.is_paused:
+            return False
+        return self.rotate_piece()
+
+    def soft_drop(self):
+        """下移一格（不固定方块），返回事件列表"""
+        if self.can_act() and not self.check_collision(self.orientation(), (0, 1)):
+            self.current_piece['y'] += 1
+        return []
+
+    def hard_drop(self):
+        """直接落到底并固定，每格 +1 分，返回事件列表"""
+        if self.game_over or self.is_paused:
+            return []
+        drop = self.drop_distance()
+        self.current_piece['y'] += drop
+        self.score += drop
+        return self.merge_piece()
+
+    def tick(self):
+        """重力一步：能下落则下落，否则固定，返回事件列表"""
+        if not self.can_act():
+            return []
+        if not self.check_collision(self.orientation(), (0, 1)):
+            self.current_piece['y'] += 1
+            return []
+        return self.merge_piece()
@@ -0,0 +1,542 @@
+"""游戏记录存储
+
+Pluggable, append-only history backends.  Both keep unlimited history with
+O(1) appends and never rewrite the whole store for a single game:
+
+* JsonLinesHistory -- one JSON object per line.  Appends are fsync'ed; a line
+  torn by a crash is skipped when reading and dropped by the next
+  compaction, which rewrites the log atomically (temp file + os.replace).
+* SqliteHistory -- stdlib sqlite3 table with indexes on start time and score.
+
+HistoryWriter moves the writes onto a background thread so that a slow disk
+never stalls the UI.
+
+Records are dicts with start_time, end_time, duration, level, score, lines and
+optionally seed.  Both backends page them newest-written first.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+
+BACKEND_JSONL = 'jsonl'
+BACKEND_SQLITE = 'sqlite'
+
+# HistoryWriter.status values
+WRITER_IDLE = 'idle'
+WRITER_SAVING = 'saving'
+WRITER_RETRYING = 'retrying'  # last write failed, will try again
+
+RECORD_FIELDS = ('start_time', 'end_time', 'duration', 'level', 'score', 'lines', 'seed')
+# Keys every record of the old JSON array file has
+LEGACY_FIELDS = ('start_time', 'end_time', 'duration', 'level', 'score', 'lines')
+# Shown in place of a line that is framed like a record but does not parse,
+# so pages keep their length and match count()
+UNREADABLE_RECORD = {'start_time': '(unreadable record)', 'end_time': '', 'duration': '',
+                     'level': '', 'score': '', 'lines': ''}
+
+
+def fsync_directory(path):
+    # Make the rename itself durable (not supported on Windows)
+    if os.name != 'posix':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """写临时文件后原子替换，崩溃时旧文件保持完整"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(path)
+
+
+class JsonLinesHistory:
+    """追加写入的 JSON Lines 日志，内存中保存每条记录的字节偏移作为索引"""
+
+    def __init__(self, path, compact_garbage=1, compact_ratio=0.1):
+        self.path = path
+        # Compact on open when at least compact_garbage unreadable lines are
+        # found, and while running (see maybe_compact) once they also make
+        # up compact_ratio of the live records
+        self.compact_garbage = compact_garbage
+        self.compact_ratio = compact_ratio
+        # Guards the file and the index; reentrant so compact() and clear()
+        # can rescan while holding it
+        self.lock = threading.RLock()
+        self.offsets = array('q')  # byte offset of every valid record
+        self.garbage = 0
+        self.known_signature = None  # file signature the index was built from
+        self.scan()
+        if self.garbage >= self.compact_garbage:
+            self.compact()
+
+    def scan(self):
+        """扫描日志，重建偏移索引并统计损坏的行"""
+        with self.lock:
+            offsets = array('q')
+            garbage = 0
+            torn_tail = False  # file ends in a partial line
+            signature = self.signature()
+            if signature is not None:
+                with open(self.path, 'rb') as f:
+                    pos = 0
+                    for line in f:
+                        # Only check the framing here; parsing a million lines
+                        # on startup is too slow.  A torn write never ends in "}\n".
+                        if line.startswith(b'{') and line.endswith(b'}\n'):
+                            offsets.append(pos)
+                        elif line.strip():
+                            garbage += 1
+                        pos += len(line)
+                        torn_tail = not line.endswith(b'\n')
+            self.offsets = offsets
+            self.garbage = garbage
+            self.torn_tail = torn_tail
+            self.known_signature = signature
+
+    def sync(self):
+        """文件被其他进程修改过时重新扫描；写入线程正在追加时返回 False"""
+        # While the writer thread holds the lock it is appending and will
+        # update the index itself; rescanning the half-indexed file then
+        # would add its records twice.  Never wait for it on the UI thread.
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self.signature() != self.known_signature:
+                self.scan()
+            return True
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def parse(line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) else None
+
+    @staticmethod
+    def encode(record):
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        lines = [self.encode(record) for record in records]
+        if not lines:
+            return
+        with self.lock:
+            if self.signature() != self.known_signature:
+                # Changed by another process: index its lines before ours,
+                # or the new signature would hide them from sync()
+                self.scan()
+            try:
+                with open(self.path, 'ab') as f:
+                    if self.torn_tail:
+                        # Left over from a crash mid-write: start on a fresh line
+                        f.write(b'\n')
+                        self.torn_tail = False
+                    pos = f.tell()
+                    f.write(b''.join(lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError:
+                # A failed write can leave a torn line behind: rescan so the
+                # retry starts on a fresh line and the garbage is counted
+                self.known_signature = None
+                try:
+                    self.scan()
+                except OSError:
+                    pass
+                raise
+            for line in lines:
+                self.offsets.append(pos)
+                pos += len(line)
+            self.known_signature = self.signature()
+
+    def count(self):
+        return len(self.offsets)
+
+    def read_range(self, start, stop):
+        """按存储顺序读取第 start 到 stop-1 条记录"""
+        start = max(0, start)
+        stop = min(stop, len(self.offsets))
+        if start >= stop:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[start])
+            return [self.parse(f.readline()) for _ in range(stop - start)]
+
+    def page(self, offset, limit):
+        """最新写入的记录在前，返回第 offset 条开始的 limit 条"""
+        total = len(self.offsets)
+        records = [dict(UNREADABLE_RECORD) if record is None else record
+                   for record in self.read_range(total - offset - limit, total - offset)]
+        records.reverse()
+        return records
+
+    def load(self):
+        """按存储顺序返回全部记录"""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'rb') as f:
+            for line in f:
+                record = self.parse(line) if line.endswith(b'\n') else None
+                if record is not None:
+                    records.append(record)
+        return records
+
+    def maybe_compact(self):
+        """损坏的行达到有效记录的 compact_ratio 时压缩，返回是否压缩了"""
+        with self.lock:
+            if self.garbage < max(self.compact_garbage, self.compact_ratio * len(self.offsets)):
+                return False
+            self.compact()
+            return True
+
+    def compact(self):
+        """丢弃损坏的行并原子地重写日志"""
+        with self.lock:
+            records = self.load()
+            atomic_write(self.path, b''.join(self.encode(record) for record in records))
+            self.scan()
+
+    def clear(self):
+        with self.lock:
+            atomic_write(self.path, b'')
+            self.scan()
+
+    def signature(self):
+        """文件大小和修改时间，用于判断是否需要重新加载"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def close(self):
+        pass
+
+
+class SqliteHistory:
+    """sqlite3 存储，start_time 和 score 上建索引"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            start_time TEXT NOT NULL,
+            end_time TEXT,
+            duration TEXT,
+            level INTEGER,
+            score INTEGER,
+            lines INTEGER,
+            seed INTEGER)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS games_start_time ON games (start_time)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS games_score ON games (score)')
+        self.db.commit()
+        # (MAX(id), COUNT(*)) and the last id of every page read so far, valid
+        # while the data version they were taken at is current
+        self.stats_version = None
+        self.stats = (None, 0)
+        self.page_keys = {}
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT INTO games (start_time, end_time, duration, level, score, lines, seed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [tuple(record.get(field) for field in RECORD_FIELDS) for record in records])
+
+    def rows_to_records(self, rows):
+        return [{field: value for field, value in zip(RECORD_FIELDS, row) if value is not None}
+                for row in rows]
+
+    def table_stats(self):
+        """(最大 id, 行数)，数据变化后才重新查询；调用方需持有 self.lock"""
+        version = self.db.total_changes, self.db.execute('PRAGMA data_version').fetchone()[0]
+        if version != self.stats_version:
+            self.stats_version = version
+            self.stats = self.db.execute('SELECT MAX(id), COUNT(*) FROM games').fetchone()
+            self.page_keys = {}
+        return self.stats
+
+    def count(self):
+        with self.lock:
+            return self.table_stats()[1]
+
+    def page(self, offset, limit):
+        """最新写入的记录在前（按 id 倒序），返回第 offset 条开始的 limit 条
+
+        The store only appends and clears, so ids normally run 1..count and
+        the page at any offset is one primary-key range lookup.  If rows were
+        deleted by other means, a page continues from the last id of the page
+        before it (keyset paging); only a jump to a page whose predecessor
+        has not been read falls back to OFFSET.
+        """
+        select = 'SELECT start_time, end_time, duration, level, score, lines, seed, id FROM games '
+        with self.lock:
+            last_id, total = self.table_stats()
+            if last_id == total:
+                rows = self.db.execute(select + 'WHERE id <= ? ORDER BY id DESC LIMIT ?',
+                                       (total - offset, limit)).fetchall()
+            else:
+                after = self.page_keys.get(offset)
+                if after is not None:
+                    rows = self.db.execute(select + 'WHERE id < ? ORDER BY id DESC LIMIT ?',
+                                           (after, limit)).fetchall()
+                else:
+                    rows = self.db.execute(select + 'ORDER BY id DESC LIMIT ? OFFSET ?',
+                                           (limit, offset)).fetchall()
+                if rows:
+                    self.page_keys[offset + len(rows)] = rows[-1][-1]
+        return self.rows_to_records(rows)
+
+    def top_scores(self, limit=10):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT start_time, end_time, duration, level, score, lines, seed FROM games '
+                'ORDER BY score DESC LIMIT ?', (limit,)).fetchall()
+        return self.rows_to_records(rows)
+
+    def load(self):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT start_time, end_time, duration, level, score, lines, seed FROM games '
+                'ORDER BY id').fetchall()
+        return self.rows_to_records(rows)
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM games')
+
+    def sync(self):
+        return True  # every query already sees the current database
+
+    def signature(self):
+        """本连接的修改次数和其他连接提交后变化的 data_version，查询代价为 O(1)"""
+        with self.lock:
+            return self.db.total_changes, self.db.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class HistoryWriter:
+    """后台线程写入游戏记录，UI 线程只负责入队
+
+    Records wait in a bounded queue; the worker writes whatever has piled up
+    as one batch (store.extend) and keeps a failed batch to retry with
+    exponential backoff.  close() flushes the queue before returning.
+
+    Instead of a store, an opener can be given: the worker calls it first,
+    so the index scan and legacy import of a large store never run on the
+    UI thread.  store stays None (and ready unset) until it has opened.
+    Between batches the worker also compacts a store that has collected
+    enough unreadable lines (stores with a maybe_compact method).
+    """
+
+    def __init__(self, store=None, max_queue=256, batch_size=64, retry_delay=0.5, max_retry_delay=10.0,
+                 opener=None):
+        self.store = store
+        self.opener = opener
+        self.ready = threading.Event()
+        if store is not None:
+            self.ready.set()
+        self.queue = queue.Queue(max_queue)
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.status = WRITER_IDLE
+        self.last_error = None
+        self.pending = []  # batch taken from the queue but not yet written
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='history-writer', daemon=True)
+        self.thread.start()
+
+    def append(self, record):
+        """入队一条记录，从不阻塞；队列已满时返回 False"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            print("History queue is full, record dropped")
+            return False
+        return True
+
+    @property
+    def busy(self):
+        return self.status != WRITER_IDLE or not self.queue.empty()
+
+    def take_batch(self, timeout):
+        """把队列中的记录取入 pending；timeout 内没有新记录时返回"""
+        try:
+            if not self.pending:
+                self.pending.append(self.queue.get(timeout=timeout))
+            while len(self.pending) < self.batch_size:
+                self.pending.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    def open_store(self):
+        """在写入线程上打开存储，失败时返回 False（写入时会重试）"""
+        if self.store is not None:
+            return True
+        try:
+            self.store = self.opener()
+        except Exception as e:
+            self.last_error = e
+            print(f"打开记录存储失败: {e}")
+            return False
+        self.ready.set()
+        return True
+
+    def write_pending(self):
+        if not self.pending:
+            return True
+        if not self.open_store():
+            self.status = WRITER_RETRYING
+            return False
+        self.status = WRITER_SAVING
+        try:
+            self.store.extend(self.pending)
+        except Exception as e:
+            self.last_error = e
+            self.status = WRITER_RETRYING
+            print(f"保存记录失败，稍后重试: {e}")
+            return False
+        self.pending = []
+        self.last_error = None
+        self.status = WRITER_IDLE
+        return True
+
+    def compact_store(self):
+        maybe_compact = getattr(self.store, 'maybe_compact', None)
+        if maybe_compact is None:
+            return
+        try:
+            maybe_compact()
+        except Exception as e:
+            print(f"压缩记录存储失败: {e}")
+
+    def run(self):
+        self.open_store()
+        delay = self.retry_delay
+        while not (self.stopping.is_set() and self.queue.empty() and not self.pending):
+            self.take_batch(timeout=0.1)
+            if self.write_pending():
+                delay = self.retry_delay
+                self.compact_store()
+            elif not self.stopping.wait(delay):
+                delay = min(delay * 2, self.max_retry_delay)
+            elif self.retries_exhausted():
+                break
+
+    def retries_exhausted(self):
+        # While shutting down, give a failing store a few quick attempts
+        for _ in range(3):
+            time.sleep(self.retry_delay)
+            if self.write_pending():
+                return False
+        print(f"放弃保存 {len(self.pending) + self.queue.qsize()} 条记录: {self.last_error}")
+        return True
+
+    def close(self, timeout=5.0):
+        """写完队列中的记录后停止线程"""
+        self.stopping.set()
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+
+def read_legacy(path):
+    """读取旧版记录文件，跳过格式不对的条目；文件不可用时返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f) if os.path.getsize(path) > 0 else []
+    except (OSError, ValueError) as e:
+        print(f"Failed to read legacy history: {e}")
+        return None
+    if not isinstance(records, list):
+        print(f"Failed to read legacy history: {path} is not a list of records")
+        return None
+    valid = [record for record in records
+             if isinstance(record, dict) and all(field in record for field in LEGACY_FIELDS)
+             and isinstance(record['start_time'], str)]
+    if len(valid) != len(records):
+        print(f"Skipped {len(records) - len(valid)} malformed legacy records")
+    return valid
+
+
+def migrate_legacy(store, legacy_path):
+    """把旧版 JSON 数组格式的记录导入新存储，并将旧文件改名为 .bak
+
+    The file is renamed to .migrating before its records are written, so an
+    import cut short by a crash is finished on the next open, skipping the
+    records that already reached the store.  Errors are printed, never
+    raised: a bad legacy file must not keep the store from opening.
+    """
+    if not legacy_path:
+        return 0
+    migrating_path = legacy_path + '.migrating'
+    try:
+        if os.path.exists(migrating_path):
+            records = read_legacy(migrating_path)
+            if records is None:
+                return 0
+            # One start time per record that the interrupted import stored
+            stored = Counter(record.get('start_time') for record in store.load())
+            remaining = []
+            for record in records:
+                if stored[record['start_time']] > 0:
+                    stored[record['start_time']] -= 1
+                else:
+                    remaining.append(record)
+            records = remaining
+        elif os.path.exists(legacy_path):
+            records = read_legacy(legacy_path)
+            if records is None:
+                return 0
+            os.replace(legacy_path, migrating_path)
+        else:
+            return 0
+        records.sort(key=lambda x: x['start_time'])
+        store.extend(records)
+        os.replace(migrating_path, legacy_path + '.bak')
+    except Exception as e:
+        print(f"Failed to import legacy history: {e}")
+        return 0
+    return len(records)
+
+
+def open_history(backend, base_path, legacy_path=None):
+    """按后端名打开存储；base_path 不带扩展名"""
+    if backend == BACKEND_SQLITE:
+        store = SqliteHistory(base_path + '.db')
+    elif backend == BACKEND_JSONL:
+        store = JsonLinesHistory(base_path + '.jsonl')
+    else:
+        raise ValueError(f"unknown history backend: {backend}")
+    migrate_legacy(store, legacy_path)
+    return store
@@ -0,0 +1,178 @@
+"""对战服务器压力测试
+
+Connects many bot players to a tetris_server.py instance and plays random
+inputs, keeping a client-side copy of every board from the delta updates and
+checking it against the board checksum in every update.
+
+    python tetris_loadtest.py --bots 2000 --duration 30 --spawn-server
+    python tetris_loadtest.py --bots 2000 --host 127.0.0.1 --port 7777
+
+--spawn-server starts the server as a separate process (it prints its own
+tick latency and bandwidth reports); otherwise the server must already be
+running.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+import zlib
+from array import array
+
+from tetris_engine import ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP, ACTION_HARD_DROP
+from tetris_profiler import percentile
+from tetris_server import (MSG_JOIN, MSG_INPUT, MSG_START, MSG_UPDATE, MSG_OVER, START, OVER, frame,
+                           read_frame, decode_update, set_nodelay, raise_file_limit)
+
+# Random bot inputs, weighted towards moves so pieces spread over the board
+BOT_ACTIONS = [ACTION_LEFT] * 3 + [ACTION_RIGHT] * 3 + [ACTION_ROTATE] * 2 + [ACTION_SOFT_DROP, ACTION_HARD_DROP]
+
+
+class ClientStats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.matches = 0
+        self.finished = 0
+        self.updates = 0
+        self.bytes = 0
+        self.rows = 0
+        self.inputs = 0
+        self.errors = 0
+        self.mismatches = 0  # updates after which the rebuilt board differed from the server's
+        self.update_gaps = array('d')  # ms between updates of one board
+
+
+async def bot(options, rng, stats, deadline):
+    try:
+        reader, writer = await asyncio.open_connection(options.host, options.port)
+    except OSError:
+        stats.failed += 1
+        return
+    stats.connected += 1
+    set_nodelay(writer)
+    writer.write(frame(bytes([MSG_JOIN])))
+    sender = None
+    try:
+        width = height = 0
+        board = None
+        last_update = None
+        while time.perf_counter() < deadline:
+            try:
+                payload = await asyncio.wait_for(read_frame(reader), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            stats.bytes += len(payload) + 2
+            kind = payload[0]
+            if kind == MSG_UPDATE:
+                state, rows = decode_update(payload, width)
+                for y, cells in rows:
+                    if not 0 <= y < height:
+                        stats.errors += 1
+                        continue
+                    board[y * width:(y + 1) * width] = cells
+                if zlib.crc32(board) != state['checksum']:
+                    stats.mismatches += 1
+                stats.updates += 1
+                stats.rows += len(rows)
+                now = time.perf_counter()
+                if last_update is not None:
+                    stats.update_gaps.append((now - last_update) * 1000)
+                last_update = now
+            elif kind == MSG_START:
+                _, _, _, width, height = START.unpack(payload)
+                board = bytearray(width * height)
+                last_update = None
+                stats.matches += 1
+                if sender is None:
+                    sender = asyncio.ensure_future(send_inputs(options, rng, writer, stats))
+            elif kind == MSG_OVER:
+                OVER.unpack(payload)
+                stats.finished += 1
+                writer.write(frame(bytes([MSG_JOIN])))  # play again
+            else:
+                stats.errors += 1
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        if sender is not None:
+            sender.cancel()
+        writer.close()
+
+
+async def send_inputs(options, rng, writer, stats):
+    """每隔随机的思考时间发送一到三个随机动作"""
+    while True:
+        await asyncio.sleep(rng.uniform(0.5, 1.5) * options.action_interval)
+        actions = bytes(rng.choice(BOT_ACTIONS) for _ in range(rng.randint(1, 3)))
+        writer.write(frame(bytes([MSG_INPUT]) + actions))
+        stats.inputs += len(actions)
+
+
+async def run(options):
+    stats = ClientStats()
+    rng = random.Random(options.seed)
+    start = time.perf_counter()
+    deadline = start + options.duration
+    bots = []
+    # Ramp up so the listen queue is not flooded
+    for i in range(options.bots):
+        bots.append(asyncio.ensure_future(bot(options, random.Random(rng.randrange(2 ** 32)), stats, deadline)))
+        if options.ramp and i % 100 == 99:
+            await asyncio.sleep(options.ramp * 100 / options.bots)
+    await asyncio.gather(*bots)
+    elapsed = time.perf_counter() - start
+    return stats, elapsed
+
+
+def print_report(stats, elapsed):
+    gaps = sorted(stats.update_gaps)
+    board_seconds = stats.connected * elapsed
+    print(f"{stats.connected} bots connected ({stats.failed} failed), {stats.matches} games started, "
+          f"{stats.finished} finished in {elapsed:.1f} s")
+    print(f"received {stats.updates} updates, {stats.rows} rows, {stats.bytes / 1e6:.2f} MB; "
+          f"sent {stats.inputs} inputs; {stats.errors} protocol errors, {stats.mismatches} board mismatches")
+    if board_seconds:
+        print(f"per board: {stats.bytes / board_seconds:.1f} B/s, {stats.updates / board_seconds:.1f} updates/s, "
+              f"{stats.rows / max(1, stats.updates):.2f} rows/update")
+    print(f"update interval p50 {percentile(gaps, 0.50):.1f} p99 {percentile(gaps, 0.99):.1f} "
+          f"max {gaps[-1] if gaps else 0.0:.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the versus server with bot players")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--bots', type=int, default=2000)
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to play")
+    parser.add_argument('--action-interval', type=float, default=0.3, help="mean seconds between bot inputs")
+    parser.add_argument('--ramp', type=float, default=2.0, help="seconds over which the bots connect")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--spawn-server', action='store_true', help="start tetris_server.py in a subprocess")
+    parser.add_argument('--tick-rate', type=int, help="tick rate of the spawned server")
+    options = parser.parse_args(argv)
+
+    raise_file_limit()
+    server = None
+    if options.spawn_server:
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tetris_server.py'),
+                   '--host', options.host, '--port', str(options.port),
+                   '--duration', str(options.duration + options.ramp + 5)]
+        if options.tick_rate:
+            command += ['--tick-rate', str(options.tick_rate)]
+        server = subprocess.Popen(command)
+        time.sleep(1.0)  # let it start listening
+    try:
+        stats, elapsed = asyncio.run(run(options))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print_report(stats, elapsed)
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
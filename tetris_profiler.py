@@ -0,0 +1,131 @@
+"""帧耗时统计与性能剖析
+
+FrameProfiler records how long each phase of the main loop took into a
+fixed-size ring buffer, summarizes FPS / frame-time percentiles, exports the
+buffer as a CSV or JSON trace and can run cProfile over a window of frames.
+It has no pygame dependency; TetrisApp only creates one when profiling is
+requested, so the disabled cost is a single ``if`` per phase.
+"""
+import cProfile
+import csv
+import json
+import pstats
+import time
+from array import array
+
+# Main-loop phases in the order they are marked
+PHASES = ('wait', 'events', 'update', 'particles', 'draw', 'present')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class FrameProfiler:
+    def __init__(self, capacity=600, phases=PHASES):
+        self.phases = phases
+        self.capacity = capacity
+        # One ring buffer of seconds per phase
+        self.samples = {phase: array('d', bytes(8 * capacity)) for phase in phases}
+        self.frame_count = 0  # frames recorded so far (ring position = frame_count % capacity)
+        self.slot = 0
+        self.last_mark = 0.0
+        self.profile = None
+        self.capture_end = 0.0  # perf_counter() time the cProfile capture stops
+        self.capture_path = None
+
+    def begin_frame(self):
+        self.slot = self.frame_count % self.capacity
+        # Phases a frame skips (an idle frame that draws nothing) count as
+        # zero instead of keeping the sample of capacity frames ago
+        for samples in self.samples.values():
+            samples[self.slot] = 0.0
+        self.last_mark = time.perf_counter()
+
+    def mark(self, phase):
+        """记录从上一个标记到现在的耗时，归入 phase"""
+        now = time.perf_counter()
+        self.samples[phase][self.slot] = now - self.last_mark
+        self.last_mark = now
+
+    def end_frame(self):
+        self.frame_count += 1
+        if self.profile is not None and time.perf_counter() >= self.capture_end:
+            self.stop_capture()
+
+    def recorded_slots(self):
+        """按时间顺序返回环形缓冲区中有效的槽位"""
+        if self.frame_count <= self.capacity:
+            return range(self.frame_count)
+        start = self.frame_count % self.capacity
+        return [(start + i) % self.capacity for i in range(self.capacity)]
+
+    def frame_times(self):
+        return [sum(self.samples[phase][slot] for phase in self.phases) for slot in self.recorded_slots()]
+
+    def summary(self):
+        """FPS、帧耗时百分位（毫秒）、各阶段平均耗时和最慢阶段"""
+        slots = self.recorded_slots()
+        times = sorted(self.frame_times())
+        if not times:
+            return None
+        phase_means = {phase: sum(self.samples[phase][slot] for slot in slots) / len(times) * 1000
+                       for phase in self.phases}
+        # 'wait' is time the frame limiter sleeps, not work
+        busy = {phase: value for phase, value in phase_means.items() if phase != 'wait'}
+        return {
+            'fps': len(times) / sum(times) if sum(times) else 0.0,
+            'p50_ms': percentile(times, 0.50) * 1000,
+            'p95_ms': percentile(times, 0.95) * 1000,
+            'p99_ms': percentile(times, 0.99) * 1000,
+            'max_ms': times[-1] * 1000,
+            'phase_ms': phase_means,
+            'worst_phase': max(busy, key=busy.get) if busy else None,
+        }
+
+    def export(self, path):
+        """导出帧耗时记录；扩展名为 .csv 时写 CSV，否则写 JSON"""
+        rows = [[self.frame_count - len(self.recorded_slots()) + i] +
+                [self.samples[phase][slot] * 1000 for phase in self.phases]
+                for i, slot in enumerate(self.recorded_slots())]
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['frame'] + [f'{phase}_ms' for phase in self.phases])
+                writer.writerows(rows)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'phases': list(self.phases),
+                    'summary': self.summary(),
+                    'frames': rows,
+                }, f)
+
+    def start_capture(self, seconds=5.0, path=None):
+        """开始 cProfile 采样，seconds 秒后的第一个帧结束时自动保存
+
+        Measured in time rather than frames: idle frames block for a
+        variable time, so a frame count would not give a fixed length.
+        """
+        if self.profile is not None:
+            return False
+        self.capture_path = path or time.strftime('tetris_profile_%Y%m%d_%H%M%S.prof')
+        self.capture_end = time.perf_counter() + seconds
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return True
+
+    def stop_capture(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        self.profile.dump_stats(self.capture_path)
+        print(f"Profile saved to {self.capture_path}")
+        pstats.Stats(self.profile).sort_stats('cumulative').print_stats(15)
+        self.profile = None
+
+    @property
+    def capturing(self):
+        return self.profile is not None
@@ -0,0 +1,191 @@
+"""回放：种子 + 带帧号的输入流
+
+A replay stores the engine settings, the seed and every input applied to the
+engine, so a game can be re-simulated headlessly and bit-exactly.  Binary
+layout (little endian):
+
+    magic b'TRPL' | version u8 | randomizer u8 | preview u8 | seed u64
+    | final score u64 | final lines u64 | input count u32
+    | board width u8 | board height u16 | inputs
+
+Each input is one varint holding (tick delta << 3) | action.  Versions 1
+and 2 stored the final score and lines as u32; version 1 files also have no
+board size and are played on the default board.
+"""
+import struct
+import sys
+
+from tetris_engine import TetrisEngine, GAME_WIDTH, GAME_HEIGHT, RANDOMIZER_RANDOM, RANDOMIZER_BAG
+from tetris_snapshot import snapshot, restore
+
+MAGIC = b'TRPL'
+VERSION = 3
+HEADER_V1 = struct.Struct('<4sBBBQIII')
+HEADER_V2 = struct.Struct('<4sBBBQIIIBH')
+HEADER = struct.Struct('<4sBBBQQQIBH')
+HEADERS = {1: HEADER_V1, 2: HEADER_V2, VERSION: HEADER}
+RANDOMIZERS = [RANDOMIZER_RANDOM, RANDOMIZER_BAG]
+KEYFRAME_INTERVAL = 600  # ticks between seek keyframes (5 s of play)
+
+
+class ReplayError(ValueError):
+    pass
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ReplayError("truncated input stream")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class Replay:
+    def __init__(self, seed, inputs, randomizer=RANDOMIZER_RANDOM, preview=1, score=0, lines=0,
+                 width=GAME_WIDTH, height=GAME_HEIGHT):
+        self.seed = seed
+        self.inputs = inputs  # list of (tick, action), ticks non-decreasing
+        self.randomizer = randomizer
+        self.preview = preview
+        self.width = width
+        self.height = height
+        self.score = score  # final values, used by verify()
+        self.lines = lines
+
+    @classmethod
+    def from_engine(cls, engine):
+        """从开启了 record 的引擎生成回放"""
+        if engine.input_log is None:
+            raise ReplayError("engine was created without record=True")
+        return cls(engine.seed, list(engine.input_log), engine.randomizer, engine.preview,
+                   engine.score, engine.lines, engine.width, engine.height)
+
+    @property
+    def last_tick(self):
+        return self.inputs[-1][0] if self.inputs else 0
+
+    def to_bytes(self):
+        out = bytearray(HEADER.pack(MAGIC, VERSION, RANDOMIZERS.index(self.randomizer),
+                                    self.preview, self.seed, self.score, self.lines,
+                                    len(self.inputs), self.width, self.height))
+        last = 0
+        for tick, action in self.inputs:
+            write_varint(out, (tick - last) << 3 | action)
+            last = tick
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER_V1.size:
+            raise ReplayError("replay too short")
+        if data[:4] != MAGIC:
+            raise ReplayError("not a replay file")
+        version = data[4]
+        header = HEADERS.get(version)
+        if header is None:
+            raise ReplayError(f"unsupported replay version {version}")
+        if len(data) < header.size:
+            raise ReplayError("replay too short")
+        fields = header.unpack_from(data)
+        randomizer, preview, seed, score, lines, count = fields[2:8]
+        width, height = fields[8:] if version > 1 else (GAME_WIDTH, GAME_HEIGHT)
+        pos = header.size
+        inputs = []
+        tick = 0
+        for _ in range(count):
+            value, pos = read_varint(data, pos)
+            tick += value >> 3
+            inputs.append((tick, value & 0x7))
+        return cls(seed, inputs, RANDOMIZERS[randomizer], preview, score, lines, width, height)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+class ReplayPlayer:
+    """无界面重新模拟回放，支持跳到任意帧"""
+
+    def __init__(self, replay, bitboard=True, keyframe_interval=KEYFRAME_INTERVAL):
+        self.replay = replay
+        self.bitboard = bitboard
+        # (tick, input index, snapshot) taken while seeking forward, so a
+        # backward seek resumes from the nearest one instead of tick 0
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = []
+        self.restart()
+
+    def restart(self):
+        self.engine = TetrisEngine(bitboard=self.bitboard, seed=self.replay.seed,
+                                   randomizer=self.replay.randomizer, preview=self.replay.preview,
+                                   width=self.replay.width, height=self.replay.height)
+        self.position = 0  # index of the next input to apply
+
+    def seek(self, tick):
+        """模拟到第 tick 帧开始时的状态（该帧的输入尚未执行）"""
+        self.jump(tick)
+        engine = self.engine
+        inputs = self.replay.inputs
+        while self.position < len(inputs) and inputs[self.position][0] < tick:
+            input_tick, action = inputs[self.position]
+            engine.tick_count = input_tick
+            if self.keyframe_interval and input_tick >= self.next_keyframe_tick():
+                self.keyframes.append((input_tick, self.position, snapshot(engine)))
+            engine.step(action)
+            self.position += 1
+        engine.tick_count = tick
+        return engine
+
+    def next_keyframe_tick(self):
+        if not self.keyframes:
+            return self.keyframe_interval
+        return self.keyframes[-1][0] + self.keyframe_interval
+
+    def jump(self, tick):
+        """从 tick 之前最近的关键帧继续（比当前位置更近时）；往回跳且没有关键帧则从头开始"""
+        current = self.engine.tick_count
+        for key_tick, position, data in reversed(self.keyframes):
+            if key_tick <= tick:
+                if key_tick > current or tick < current:
+                    restore(self.engine, data)
+                    self.position = position
+                    return
+                break
+        if tick < current:
+            self.restart()
+
+    def run_to_end(self):
+        return self.seek(self.replay.last_tick + 1)
+
+    def verify(self):
+        """重放整局并核对最终分数和消行数"""
+        engine = self.run_to_end()
+        return engine.score == self.replay.score and engine.lines == self.replay.lines
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        replay = Replay.load(path)
+        player = ReplayPlayer(replay)
+        ok = player.verify()
+        print(f"{path}: seed={replay.seed} inputs={len(replay.inputs)} "
+              f"score={player.engine.score}/{replay.score} lines={player.engine.lines}/{replay.lines} "
+              f"{'OK' if ok else 'MISMATCH'}")
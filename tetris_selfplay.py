@@ -0,0 +1,234 @@
+"""多进程自我对弈
+
+Plays many headless games across a process pool and reports score, lines,
+level and throughput statistics.  Each game uses its own seed (base seed +
+game index), so any single game can be reproduced later.
+
+    python tetris_selfplay.py --games 100000 --workers 8 --output results.jsonl
+    python tetris_selfplay.py --policy mypackage.policies:make_policy
+
+A policy is a callable ``policy(engine) -> list of ACTION_*`` that is asked
+for the moves of every new piece.  --policy takes a built-in name or
+``module:factory``, where factory() returns the policy; it is imported once
+in every worker process.
+
+Gravity follows the engine's own rules: each action takes --action-ms of
+simulated time and the piece falls one row every get_fall_speed()
+milliseconds, so faster levels leave the policy fewer moves per piece.
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from tetris_engine import (TetrisEngine, GAME_WIDTH, GAME_HEIGHT, EVENT_LOCK, ACTION_LEFT, ACTION_RIGHT,
+                           ACTION_ROTATE, ACTION_HARD_DROP, ACTION_GRAVITY, RANDOMIZER_RANDOM, RANDOMIZER_BAG)
+from tetris_ai import Autoplayer
+from tetris_profiler import percentile
+
+
+def random_policy_factory():
+    def policy(engine):
+        # Derived from the game seed and board so every game is reproducible
+        rng = random.Random(engine.seed * 1000003 + engine.field_version)
+        actions = [ACTION_ROTATE] * rng.randint(0, 3)
+        shift = rng.randint(-(engine.width // 2), engine.width // 2)
+        actions += [ACTION_RIGHT if shift > 0 else ACTION_LEFT] * abs(shift)
+        return actions + [ACTION_HARD_DROP]
+    return policy
+
+
+def ai_policy_factory():
+    return Autoplayer().plan
+
+
+POLICIES = {
+    'ai': ai_policy_factory,
+    'random': random_policy_factory,
+}
+
+
+def load_policy(spec):
+    """按名称或 "模块:工厂函数" 创建策略"""
+    if spec in POLICIES:
+        return POLICIES[spec]()
+    module_name, _, factory_name = spec.partition(':')
+    if not factory_name:
+        raise ValueError(f"unknown policy: {spec}")
+    return getattr(importlib.import_module(module_name), factory_name)()
+
+
+def play_game(seed, policy, action_ms=0, max_pieces=None, randomizer=RANDOMIZER_RANDOM,
+              width=GAME_WIDTH, height=GAME_HEIGHT):
+    """无界面玩一整局，返回结果字典；duration 为模拟的游戏时间（秒）"""
+    engine = TetrisEngine(bitboard=True, seed=seed, randomizer=randomizer, width=width, height=height)
+    clock = 0
+    next_fall = engine.get_fall_speed()
+    pieces = 0
+    while not engine.game_over and (max_pieces is None or pieces < max_pieces):
+        piece = engine.current_piece
+        for action in policy(engine) or [ACTION_HARD_DROP]:
+            clock += action_ms
+            # Gravity may lock the piece before the policy finishes its moves
+            while clock >= next_fall and engine.current_piece is piece:
+                pieces += count_locks(engine.step(ACTION_GRAVITY))
+                next_fall += engine.get_fall_speed()
+            if engine.current_piece is not piece or engine.game_over:
+                break
+            pieces += count_locks(engine.step(action))
+        if engine.current_piece is piece and not engine.game_over:
+            # The policy left the piece floating: let it fall
+            pieces += count_locks(engine.hard_drop())
+    return {'seed': seed, 'score': engine.score, 'lines': engine.lines, 'level': engine.level,
+            'pieces': pieces, 'duration': clock / 1000}
+
+
+def count_locks(events):
+    return sum(1 for event in events if event['type'] == EVENT_LOCK)
+
+
+# ---- Worker process -----------------------------------------------------
+
+worker_policy = None
+
+
+def init_worker(policy_spec):
+    global worker_policy
+    worker_policy = load_policy(policy_spec)
+
+
+def play_batch(seeds, action_ms, max_pieces, randomizer, width, height):
+    """在工作进程中连续玩一批种子，整批返回以减少进程间通信"""
+    results = []
+    for seed in seeds:
+        start = time.perf_counter()
+        result = play_game(seed, worker_policy, action_ms, max_pieces, randomizer, width, height)
+        result['wall_time'] = time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+def run_games(options, on_result=None):
+    """把 options.games 局分批交给进程池，结果到达时逐个回调 on_result"""
+    seeds = range(options.seed, options.seed + options.games)
+    batches = (seeds[i:i + options.batch_size] for i in range(0, len(seeds), options.batch_size))
+    args = (options.action_ms, options.max_pieces, RANDOMIZER_BAG if options.bag else RANDOMIZER_RANDOM,
+            options.width, options.height)
+    with ProcessPoolExecutor(options.workers, initializer=init_worker,
+                             initargs=(options.policy,)) as pool:
+        # Keep a few batches per worker in flight instead of submitting
+        # millions of futures up front
+        pending = set()
+        for batch in batches:
+            pending.add(pool.submit(play_batch, list(batch), *args))
+            if len(pending) >= options.workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                report_batches(done, on_result)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            report_batches(done, on_result)
+
+
+def report_batches(futures, on_result):
+    for future in futures:
+        for result in future.result():
+            if on_result is not None:
+                on_result(result)
+
+
+class Summary:
+    """累积每局结果，计算均值、百分位和吞吐量"""
+
+    METRICS = ('score', 'lines', 'level', 'pieces', 'duration')
+
+    def __init__(self):
+        self.values = {metric: array('d') for metric in self.METRICS}
+        self.start = time.perf_counter()
+
+    def add(self, result):
+        for metric in self.METRICS:
+            self.values[metric].append(result[metric])
+
+    @property
+    def games(self):
+        return len(self.values['score'])
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        report = {
+            'games': self.games,
+            'elapsed_s': elapsed,
+            'games_per_s': self.games / elapsed if elapsed else 0.0,
+            'pieces_per_s': sum(self.values['pieces']) / elapsed if elapsed else 0.0,
+        }
+        for metric, values in self.values.items():
+            ordered = sorted(values)
+            report[metric] = {
+                'mean': sum(ordered) / len(ordered) if ordered else 0.0,
+                'min': ordered[0] if ordered else 0.0,
+                'p50': percentile(ordered, 0.50),
+                'p90': percentile(ordered, 0.90),
+                'p99': percentile(ordered, 0.99),
+                'max': ordered[-1] if ordered else 0.0,
+            }
+        return report
+
+
+def print_report(report):
+    print(f"{report['games']} games in {report['elapsed_s']:.1f} s: "
+          f"{report['games_per_s']:.1f} games/s, {report['pieces_per_s']:.0f} pieces/s")
+    print(f"{'':10s}{'mean':>12s}{'min':>12s}{'p50':>12s}{'p90':>12s}{'p99':>12s}{'max':>12s}")
+    for metric in Summary.METRICS:
+        stats = report[metric]
+        print(f"{metric:10s}" + ''.join(f"{stats[key]:12.1f}" for key in ('mean', 'min', 'p50', 'p90', 'p99', 'max')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many headless games in parallel")
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game; game i uses seed + i")
+    parser.add_argument('--policy', default='ai', help="built-in policy (ai, random) or module:factory")
+    parser.add_argument('--action-ms', type=float, default=50,
+                        help="simulated time per policy action (0 = instant moves, no gravity)")
+    parser.add_argument('--max-pieces', type=int, default=10000, help="stop a game after this many pieces")
+    parser.add_argument('--bag', action='store_true', help="use the 7-bag randomizer")
+    parser.add_argument('--width', type=int, default=GAME_WIDTH, help="board width in cells")
+    parser.add_argument('--height', type=int, default=GAME_HEIGHT, help="board height in cells")
+    parser.add_argument('--batch-size', type=int, default=16, help="games per task sent to a worker")
+    parser.add_argument('--output', help="stream per-game results to this JSON Lines file")
+    parser.add_argument('--json', help="write the summary report as JSON to this file")
+    options = parser.parse_args(argv)
+
+    summary = Summary()
+    out = open(options.output, 'w', encoding='utf-8') if options.output else None
+    progress_step = max(1, options.games // 20)
+
+    def on_result(result):
+        summary.add(result)
+        if out is not None:
+            out.write(json.dumps(result) + '\n')
+        if summary.games % progress_step == 0:
+            print(f"{summary.games}/{options.games} games", file=sys.stderr)
+
+    try:
+        run_games(options, on_result)
+    finally:
+        if out is not None:
+            out.close()
+
+    report = summary.report()
+    print_report(report)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
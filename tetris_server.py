@@ -0,0 +1,447 @@
+"""对战服务器：一个进程托管大量对局
+
+Authoritative asyncio TCP server for versus games.  Clients only send
+inputs; the server applies them on a fixed tick (TICK_RATE per second), runs
+gravity on the engine's simulation clock, sends garbage lines between the two
+boards of a match and streams every player a delta of their own board: only
+the rows that changed since the last update that player was sent.
+
+    python tetris_server.py --port 7777
+    python tetris_loadtest.py --bots 2000 --spawn-server
+
+Wire format (little endian).  Every message is a frame of u16 payload length
+followed by the payload, whose first byte is the message type:
+
+    client -> server  JOIN    type
+                      INPUT   type | one ACTION_* byte per input
+    server -> client  START   type | match id u32 | side u8 | width u8 | height u16
+                      UPDATE  type | tick u32 | piece id u8 | rotation u8 | x i8 | y i16 | color u8
+                              | next piece u8 | score u32 | lines u16 | pending garbage u8
+                              | board crc32 u32 | row count u16
+                              | rows (y u16 + one color byte per column)
+                      OVER    type | won u8 | score u32 | lines u16
+
+A player is matched with the next player that joins; after OVER either
+player may JOIN again on the same connection.  The crc32 in UPDATE covers the
+whole board (row-major color bytes) after the rows are applied, so a client
+can check that its copy matches the server's.
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from tetris_engine import (TetrisEngine, FixedTimestep, GAME_WIDTH, GAME_HEIGHT, SIM_RATE, MAX_CATCH_UP_MS,
+                           EVENT_LINE_CLEAR, ACTION_HARD_DROP, RANDOMIZER_BAG)
+from tetris_profiler import percentile
+
+TICK_RATE = 30  # server ticks per second (SIM_RATE must be a multiple)
+MAX_INPUTS_PER_TICK = 8  # inputs applied per player per tick; the rest wait
+MAX_QUEUED_INPUTS = 64  # inputs beyond this are dropped
+MAX_WRITE_BUFFER = 64 * 1024  # clients further behind than this skip updates
+GARBAGE_LINES = {2: 1, 3: 2, 4: 4}  # lines cleared at once -> garbage lines sent
+
+MSG_JOIN = 0x01
+MSG_INPUT = 0x02
+MSG_START = 0x81
+MSG_UPDATE = 0x82
+MSG_OVER = 0x83
+
+FRAME = struct.Struct('<H')
+START = struct.Struct('<BIBBH')
+UPDATE = struct.Struct('<BIBBbhBBIHBIH')
+ROW = struct.Struct('<H')
+OVER = struct.Struct('<BBIH')
+MAX_FRAME = 0xFFFF
+
+
+def frame(payload):
+    return FRAME.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    """读取一帧，返回负载（连接关闭时抛出 IncompleteReadError）"""
+    size = FRAME.unpack(await reader.readexactly(FRAME.size))[0]
+    return await reader.readexactly(size)
+
+
+def decode_update(payload, width):
+    """解析 UPDATE，返回 (状态字典, [(行号, 颜色字节), ...])"""
+    (_, tick, piece_id, rotation, x, y, color, next_piece, score, lines,
+     garbage, checksum, count) = UPDATE.unpack_from(payload)
+    state = {'tick': tick, 'piece': (piece_id, rotation, x, y, color), 'next_piece': next_piece,
+             'score': score, 'lines': lines, 'garbage': garbage, 'checksum': checksum}
+    rows = []
+    pos = UPDATE.size
+    for _ in range(count):
+        row = ROW.unpack_from(payload, pos)[0]
+        pos += ROW.size
+        rows.append((row, payload[pos:pos + width]))
+        pos += width
+    return state, rows
+
+
+def set_nodelay(writer):
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+
+def raise_file_limit():
+    """把打开文件数的软限制提高到硬限制（每个连接一个文件描述符）"""
+    try:
+        import resource
+    except ImportError:
+        return  # not available on Windows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as e:
+            print(f"Could not raise the open file limit: {e}")
+
+
+class Player:
+    """一个连接：对局中的一块棋盘，以及客户端已收到的棋盘副本"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.match = None
+        self.opponent = None
+        self.engine = None
+        self.inputs = bytearray()  # queued ACTION_* bytes
+        self.sent_cells = None  # the board as of the last update sent
+        self.sent_height = 0  # stack height in that update
+        self.sent_key = None
+        self.dirty = False  # board may differ from the last update sent
+
+
+class Match:
+    def __init__(self, match_id, players, seed, width, height):
+        self.id = match_id
+        self.players = players
+        self.rng = random.Random(seed)  # garbage hole columns
+        self.ticks = 0
+        for player in players:
+            # Both boards get the same piece sequence
+            player.engine = TetrisEngine(bitboard=True, seed=seed, randomizer=RANDOMIZER_BAG,
+                                         width=width, height=height)
+            player.sent_cells = bytearray(len(player.engine.cells))
+            player.sent_height = 0
+            player.sent_key = None
+            player.dirty = True
+            player.inputs.clear()
+            player.match = self
+        players[0].opponent = players[1]
+        players[1].opponent = players[0]
+
+
+class ServerStats:
+    """一个报告周期内的节拍耗时和流量"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.tick_ms = array('d')
+        self.bytes_sent = 0
+        self.updates_sent = 0
+        self.updates_skipped = 0
+        self.inputs = 0
+        self.inputs_dropped = 0
+        self.board_ticks = 0  # sum over ticks of the boards in play
+
+    def report(self, server):
+        elapsed = time.perf_counter() - self.start
+        ticks = sorted(self.tick_ms)
+        # Average number of boards in play over the period
+        boards = self.board_ticks / len(ticks) if ticks else 0
+        board_seconds = boards * elapsed
+        return {
+            'elapsed_s': elapsed,
+            'boards': len(server.matches) * 2,
+            'avg_boards': boards,
+            'waiting': 1 if server.waiting else 0,
+            'matches_finished': server.matches_finished,
+            'ticks': len(ticks),
+            'tick_p50_ms': percentile(ticks, 0.50),
+            'tick_p99_ms': percentile(ticks, 0.99),
+            'tick_max_ms': ticks[-1] if ticks else 0.0,
+            'tick_budget_ms': 1000 / server.tick_rate,
+            'dropped_ticks': server.clock.dropped_steps,
+            'bytes_per_board_s': self.bytes_sent / board_seconds if board_seconds else 0.0,
+            'updates_per_board_s': self.updates_sent / board_seconds if board_seconds else 0.0,
+            'updates_skipped': self.updates_skipped,
+            'inputs': self.inputs,
+            'inputs_dropped': self.inputs_dropped,
+        }
+
+
+def print_report(report):
+    print(f"{report['boards']:6d} boards  tick p50 {report['tick_p50_ms']:6.2f} p99 {report['tick_p99_ms']:6.2f} "
+          f"max {report['tick_max_ms']:6.2f} ms (budget {report['tick_budget_ms']:.1f})  "
+          f"dropped {report['dropped_ticks']}  {report['bytes_per_board_s']:7.1f} B/s "
+          f"{report['updates_per_board_s']:5.1f} updates/s per board  "
+          f"finished {report['matches_finished']}", flush=True)
+
+
+class VersusServer:
+    def __init__(self, tick_rate=TICK_RATE, width=GAME_WIDTH, height=GAME_HEIGHT, seed=None):
+        if SIM_RATE % tick_rate:
+            raise ValueError(f"tick rate must divide {SIM_RATE}")
+        if UPDATE.size + height * (ROW.size + width) > MAX_FRAME:
+            raise ValueError("board too large for one update frame")
+        self.tick_rate = tick_rate
+        self.sim_steps = SIM_RATE // tick_rate  # engine simulation steps per server tick
+        self.width = width
+        self.height = height
+        self.rng = random.Random(seed)
+        self.clock = FixedTimestep(tick_rate, MAX_CATCH_UP_MS)
+        self.waiting = None  # player waiting for an opponent
+        self.matches = {}
+        self.next_match_id = 1
+        self.matches_finished = 0
+        self.tick_count = 0
+        self.stats = ServerStats()
+
+    # ---- Connections ----------------------------------------------------
+
+    async def handle_client(self, reader, writer):
+        set_nodelay(writer)
+        player = Player(writer)
+        try:
+            while True:
+                payload = await read_frame(reader)
+                if not payload:
+                    continue
+                if payload[0] == MSG_INPUT:
+                    self.queue_inputs(player, payload)
+                elif payload[0] == MSG_JOIN:
+                    self.join(player)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.leave(player)
+            writer.close()
+
+    def queue_inputs(self, player, payload):
+        count = len(payload) - 1
+        room = MAX_QUEUED_INPUTS - len(player.inputs)
+        if count > room:
+            self.stats.inputs_dropped += count - max(0, room)
+            count = max(0, room)
+        player.inputs += payload[1:1 + count]
+        self.stats.inputs += count
+
+    def join(self, player):
+        if player.match is not None or player is self.waiting:
+            return
+        if self.waiting is None:
+            self.waiting = player
+            return
+        opponent, self.waiting = self.waiting, None
+        match = Match(self.next_match_id, [opponent, player], self.rng.randrange(2 ** 63),
+                      self.width, self.height)
+        self.next_match_id += 1
+        self.matches[match.id] = match
+        for side, p in enumerate(match.players):
+            self.send(p, START.pack(MSG_START, match.id & 0xFFFFFFFF, side, self.width, self.height))
+
+    def leave(self, player):
+        if self.waiting is player:
+            self.waiting = None
+        if player.match is not None:
+            # Leaving forfeits the match
+            self.end_match(player.match, loser=player)
+
+    def send(self, player, payload):
+        transport = player.writer.transport
+        if transport.is_closing():
+            return False
+        player.writer.write(frame(payload))
+        self.stats.bytes_sent += FRAME.size + len(payload)
+        return True
+
+    # ---- Simulation -----------------------------------------------------
+
+    def tick(self):
+        """一个服务器节拍：应用输入、推进所有对局并发送增量"""
+        self.tick_count += 1
+        self.stats.board_ticks += len(self.matches) * 2
+        for match in list(self.matches.values()):
+            self.tick_match(match)
+
+    def tick_match(self, match):
+        match.ticks += 1
+        for player in match.players:
+            engine = player.engine
+            y = engine.current_piece['y']
+            if player.inputs:
+                count = min(len(player.inputs), MAX_INPUTS_PER_TICK)
+                for action in player.inputs[:count]:
+                    if action <= ACTION_HARD_DROP:  # gravity is the server's job
+                        self.send_garbage(match, player, engine.step(action))
+                del player.inputs[:count]
+                player.dirty = True
+            events = engine.simulate_ticks(self.sim_steps)
+            if events:
+                self.send_garbage(match, player, events)
+                player.dirty = True
+            elif engine.current_piece['y'] != y:
+                player.dirty = True
+        for player in match.players:
+            # Most boards do not change in a given tick
+            if player.dirty:
+                player.dirty = False
+                self.send_update(player)
+        for player in match.players:
+            if player.engine.game_over:
+                self.end_match(match, loser=player)
+                break
+
+    def send_garbage(self, match, player, events):
+        for event in events:
+            if event['type'] == EVENT_LINE_CLEAR:
+                garbage = GARBAGE_LINES.get(event['count'], 0)
+                if garbage:
+                    player.opponent.engine.queue_garbage(garbage, match.rng.randrange(self.width))
+                    player.opponent.dirty = True  # shows the pending garbage
+
+    def send_update(self, player):
+        """状态有变化时发送 UPDATE，只包含客户端上次收到之后变化的行"""
+        engine = player.engine
+        piece = engine.current_piece
+        garbage = min(255, sum(count for count, _ in engine.pending_garbage))
+        key = (piece['id'], piece['rotation'], piece['x'], piece['y'], engine.field_version,
+               engine.score, garbage)
+        if key == player.sent_key:
+            return
+        if player.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            # The client is not keeping up; the next update it gets still
+            # carries every row changed since the last one it was sent
+            self.stats.updates_skipped += 1
+            player.dirty = True
+            return
+        rows = []
+        if player.sent_key is None or engine.field_version != player.sent_key[4]:
+            rows = self.changed_rows(player)
+        parts = [UPDATE.pack(MSG_UPDATE, self.tick_count & 0xFFFFFFFF, piece['id'], piece['rotation'],
+                             piece['x'], piece['y'], piece['color'], engine.next_piece,
+                             min(engine.score, 0xFFFFFFFF), min(engine.lines, 0xFFFF), garbage,
+                             zlib.crc32(engine.cells), len(rows))]
+        cells = engine.cells
+        width = self.width
+        for y in rows:
+            parts.append(ROW.pack(y))
+            parts.append(cells[y * width:(y + 1) * width])
+        if self.send(player, b''.join(parts)):
+            player.sent_key = key
+            self.stats.updates_sent += 1
+
+    def changed_rows(self, player):
+        """与已发送的副本比较，返回变化的行号并更新副本"""
+        engine = player.engine
+        width = self.width
+        # Rows above the taller of the old and new stacks are empty in both
+        top = self.height - max(engine.max_height, player.sent_height)
+        current = memoryview(engine.cells)
+        sent = memoryview(player.sent_cells)
+        rows = []
+        for y in range(top, self.height):
+            start = y * width
+            end = start + width
+            if current[start:end] != sent[start:end]:
+                sent[start:end] = current[start:end]
+                rows.append(y)
+        player.sent_height = engine.max_height
+        return rows
+
+    def end_match(self, match, loser):
+        if self.matches.pop(match.id, None) is None:
+            return
+        self.matches_finished += 1
+        for player in match.players:
+            engine = player.engine
+            self.send(player, OVER.pack(MSG_OVER, player is not loser, min(engine.score, 0xFFFFFFFF),
+                                        min(engine.lines, 0xFFFF)))
+            player.match = None
+            player.opponent = None
+            player.engine = None
+
+    async def run_ticks(self):
+        """固定节拍循环：按实际经过的时间执行整数个节拍，落后太多时丢弃"""
+        clock = self.clock
+        last = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            steps = clock.advance((now - last) * 1000)
+            last = now
+            for _ in range(steps):
+                start = time.perf_counter()
+                self.tick()
+                self.stats.tick_ms.append((time.perf_counter() - start) * 1000)
+            # Sleep until the next tick is due
+            await asyncio.sleep((1000 - clock.accumulator) / clock.rate / 1000)
+
+    async def report_loop(self, interval, reports):
+        while True:
+            await asyncio.sleep(interval)
+            report = self.stats.report(self)
+            reports.append(report)
+            print_report(report)
+            self.stats = ServerStats()
+
+
+async def serve(options):
+    server = VersusServer(options.tick_rate, options.width, options.height, options.seed)
+    listener = await asyncio.start_server(server.handle_client, options.host, options.port,
+                                          backlog=options.backlog)
+    print(f"Listening on {options.host}:{options.port}, {options.tick_rate} ticks/s", flush=True)
+    reports = []
+    tasks = [asyncio.ensure_future(server.run_ticks()),
+             asyncio.ensure_future(server.report_loop(options.report_interval, reports))]
+    try:
+        if options.duration:
+            await asyncio.sleep(options.duration)
+        else:
+            await asyncio.Event().wait()  # until interrupted
+    finally:
+        for task in tasks:
+            task.cancel()
+        listener.close()
+        if options.json:
+            with open(options.json, 'w', encoding='utf-8') as f:
+                json.dump(reports, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Authoritative versus-mode game server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--tick-rate', type=int, default=TICK_RATE, help="server ticks per second")
+    parser.add_argument('--width', type=int, default=GAME_WIDTH, help="board width in cells")
+    parser.add_argument('--height', type=int, default=GAME_HEIGHT, help="board height in cells")
+    parser.add_argument('--seed', type=int, help="seed for match seeds and garbage holes")
+    parser.add_argument('--backlog', type=int, default=1024, help="listen queue length")
+    parser.add_argument('--report-interval', type=float, default=5.0, help="seconds between stats lines")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    parser.add_argument('--json', help="write the periodic reports as JSON to this file on exit")
+    options = parser.parse_args(argv)
+
+    raise_file_limit()
+    try:
+        asyncio.run(serve(options))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
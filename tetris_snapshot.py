@@ -0,0 +1,179 @@
+"""快照：保存和恢复一局游戏的完整状态
+
+A snapshot holds everything needed to resume or fork a game: the field, the
+current piece, the preview queue and 7-bag, score, level, lines, the
+simulation clock, elapsed play time, pending garbage and the RNG state.
+Restoring a snapshot and playing on gives exactly the same game as the
+original engine.  Binary layout (little endian):
+
+    magic b'TSNP' | version u8 | randomizer u8 | flags u8 | board width u8
+    | board height u16 | seed u64 | score u64 | level u32
+    | lines u64 | tick count u32 | gravity time u32 | elapsed play ms u32
+    | piece id u8 | rotation u8 | color u8 | x i16 | y i16
+    | queue length u8 | bag length u8 | garbage entries u8 | stack rows u16
+    | queue bytes | bag bytes | garbage (count u16, hole u8)...
+    | RNG state 625 x u32 | [gauss_next f64] | stack rows x width cells
+
+Only the rows from the top of the stack down are stored; the rows above it
+are empty.  Derived state (bitboard, column heights, board features) is
+rebuilt on restore, so restoring costs time in proportion to the stack height
+rather than the board size.  The replay input log is not part of a snapshot,
+so a restored game cannot be saved as a replay.
+"""
+import struct
+import sys
+from collections import deque
+from datetime import datetime, timedelta
+
+from tetris_engine import TetrisEngine, RANDOMIZER_RANDOM, RANDOMIZER_BAG
+
+MAGIC = b'TSNP'
+VERSION = 2  # version 1 packed score and lines as u32, level as u16
+HEADER = struct.Struct('<4sBBBBHQQIQIIIBBBhhBBBH')
+GARBAGE = struct.Struct('<HB')
+RNG_STATE = struct.Struct('<625I')  # Mersenne Twister key plus position
+GAUSS = struct.Struct('<d')
+RANDOMIZERS = [RANDOMIZER_RANDOM, RANDOMIZER_BAG]
+
+# flags
+FLAG_GAME_OVER = 0x01
+FLAG_PAUSED = 0x02
+FLAG_GAUSS = 0x04  # random.gauss() left a cached value in the RNG
+
+# Cell colors -> b'0' / b'1', to build row bitmasks with int(..., 2)
+BIT_CHARS = bytes.maketrans(bytes(range(256)), b'0' + b'1' * 255)
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def snapshot(engine):
+    """把引擎状态打包成 bytes"""
+    piece = engine.current_piece
+    width = engine.width
+    stack_rows = engine.max_height
+    rng_version, rng_state, gauss_next = engine.rng.getstate()
+    flags = ((FLAG_GAME_OVER if engine.game_over else 0) | (FLAG_PAUSED if engine.is_paused else 0)
+             | (FLAG_GAUSS if gauss_next is not None else 0))
+    elapsed_ms = int((datetime.now() - engine.start_time).total_seconds() * 1000)
+    parts = [
+        HEADER.pack(MAGIC, VERSION, RANDOMIZERS.index(engine.randomizer), flags, width, engine.height,
+                    engine.seed, engine.score, engine.level, engine.lines,
+                    engine.tick_count, engine.gravity_time, elapsed_ms,
+                    piece['id'], piece['rotation'], piece['color'], piece['x'], piece['y'],
+                    len(engine.next_queue), len(engine.bag), len(engine.pending_garbage), stack_rows),
+        bytes(engine.next_queue),
+        bytes(engine.bag),
+    ]
+    for count, hole in engine.pending_garbage:
+        parts.append(GARBAGE.pack(count, hole))
+    parts.append(RNG_STATE.pack(*rng_state))
+    if gauss_next is not None:
+        parts.append(GAUSS.pack(gauss_next))
+    parts.append(engine.cells[(engine.height - stack_rows) * width:])
+    return b''.join(parts)
+
+
+def read_header(data):
+    if len(data) < HEADER.size:
+        raise SnapshotError("snapshot too short")
+    header = HEADER.unpack_from(data)
+    if header[0] != MAGIC:
+        raise SnapshotError("not a snapshot")
+    if header[1] != VERSION:
+        raise SnapshotError(f"unsupported snapshot version {header[1]}")
+    return header
+
+
+def restore(engine, data):
+    """用快照替换引擎状态；棋盘尺寸必须与引擎相同"""
+    (_, _, randomizer, flags, width, height, seed, score, level, lines, tick_count, gravity_time,
+     elapsed_ms, shape_id, rotation, color, x, y, queue_len, bag_len, garbage_len, stack_rows) = read_header(data)
+    if (width, height) != (engine.width, engine.height):
+        raise SnapshotError(f"snapshot is for a {width}x{height} board, engine is {engine.width}x{engine.height}")
+    pos = HEADER.size
+    queue = data[pos:pos + queue_len]
+    pos += queue_len
+    bag = data[pos:pos + bag_len]
+    pos += bag_len
+    try:
+        garbage = [GARBAGE.unpack_from(data, pos + i * GARBAGE.size) for i in range(garbage_len)]
+        pos += garbage_len * GARBAGE.size
+        rng_state = RNG_STATE.unpack_from(data, pos)
+        pos += RNG_STATE.size
+        gauss_next = None
+        if flags & FLAG_GAUSS:
+            gauss_next, = GAUSS.unpack_from(data, pos)
+            pos += GAUSS.size
+    except struct.error:
+        raise SnapshotError("corrupt snapshot") from None
+    stack = bytes(data[pos:pos + stack_rows * width])
+    if not queue_len or len(stack) != stack_rows * width or pos + len(stack) != len(data):
+        raise SnapshotError("corrupt snapshot")
+
+    engine.seed = seed
+    engine.randomizer = RANDOMIZERS[randomizer]
+    engine.rng.setstate((3, rng_state, gauss_next))
+    engine.bag = list(bag)
+    engine.tick_count = tick_count
+    engine.gravity_time = gravity_time
+    engine.input_log = None  # the inputs before the snapshot are not known
+    engine.preview = queue_len
+    engine.next_queue = deque(queue)
+    engine.next_piece = engine.next_queue[0]
+    engine.current_piece = {'id': shape_id, 'rotation': rotation, 'color': color, 'x': x, 'y': y}
+    engine.pending_garbage = garbage
+    engine.score = score
+    engine.level = level
+    engine.lines = lines
+    engine.start_time = datetime.now() - timedelta(milliseconds=elapsed_ms)
+    engine.game_over = bool(flags & FLAG_GAME_OVER)
+    engine.is_paused = bool(flags & FLAG_PAUSED)
+
+    # Field and everything derived from it; rows above the stack are empty
+    top = height - stack_rows
+    rows = [stack[i:i + width] for i in range(0, len(stack), width)]
+    engine.cells[:top * width] = bytes(top * width)
+    engine.cells[top * width:] = stack
+    if not engine.bitboard:
+        # In bitboard mode the rows are views of cells; otherwise rows above
+        # both the old and the new stack are already empty
+        field = engine.game_field
+        for y in range(height - max(engine.max_height, stack_rows), top):
+            field[y] = [0] * width
+        field[top:] = [list(row) for row in rows]
+    engine.board = [0] * top + [int(row.translate(BIT_CHARS)[::-1], 2) for row in rows]
+    engine.row_fill = [0] * top + [width - row.count(0) for row in rows]
+    engine.filled_cells = sum(engine.row_fill)
+    engine.column_heights = [len(stack[col::width].lstrip(b'\0')) for col in range(width)]
+    engine._features = None
+    engine.field_version += 1
+    engine._landing_key = None
+    return engine
+
+
+def from_snapshot(data, bitboard=False, record=False):
+    """按快照中的棋盘尺寸新建引擎并恢复状态（用于分叉一局游戏）"""
+    header = read_header(data)
+    engine = TetrisEngine(bitboard=bitboard, seed=0, record=record, width=header[4], height=header[5])
+    return restore(engine, data)
+
+
+def save(engine, path):
+    with open(path, 'wb') as f:
+        f.write(snapshot(engine))
+
+
+def load(engine, path):
+    with open(path, 'rb') as f:
+        return restore(engine, f.read())
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            engine = from_snapshot(f.read())
+        print(f"{path}: {engine.width}x{engine.height} seed={engine.seed} score={engine.score} "
+              f"level={engine.level} lines={engine.lines} tick={engine.tick_count} "
+              f"{'game over' if engine.game_over else 'in progress'}")